@@ -21,6 +21,12 @@
 #
 
 import copy
+import heapq
+import itertools
+import threading
+from multiprocessing.pool import ThreadPool
+
+from six.moves import queue  # pylint: disable=import-error
 
 from .deviceaction import ActionCreateDevice
 from .deviceaction import action_type_from_string, action_object_from_string
@@ -28,24 +34,136 @@ from .devicelibs import lvm
 from .devices import PartitionDevice
 from .errors import DiskLabelCommitError, StorageError
 from .flags import flags
+from .callstats import call_stats
+from .statuscache import statusCache
 from . import tsort
+from . import udev
 
 import logging
 log = logging.getLogger("blivet")
 
+_commitLock = threading.Lock()
+""" held while executing an action that involves a disklabel or partition
+
+    libparted's exception handling is global to the process, so no two such
+    actions run at the same time, even on different disks.
+"""
+
+def _runAction(node, action, callbacks, lock=None):
+    """ Execute a single action and return the outcome.
+
+        :param int node: the action's node in the dependency graph
+        :param action: the action to execute
+        :type action: :class:`~.deviceaction.DeviceAction`
+        :param callbacks: callbacks to pass to the action
+        :keyword lock: a lock to hold while the action executes, or None
+        :returns: a (node, exception) tuple; exception is None on success
+    """
+    try:
+        if lock is None:
+            action.execute(callbacks)
+        else:
+            with lock:
+                action.execute(callbacks)
+    except Exception as e: # pylint: disable=broad-except
+        return (node, e)
+
+    return (node, None)
+
+class _ActionIndex(object):
+    """ Hash indexes over the actions in an :class:`ActionList`.
+
+        Actions are indexed by the id of their device, their type and their
+        object type, none of which change during an action's lifetime. Device
+        paths can change (eg: when partitions are renumbered), so they are
+        not indexed.
+
+        The index also remembers the position of each action in the list so
+        that lookups return actions in list order.
+    """
+    attrs = ("devid", "type", "obj")
+
+    def __init__(self):
+        self._order = {}
+        self._maps = dict((attr, {}) for attr in self.attrs)
+        self._counter = itertools.count()
+
+    @staticmethod
+    def _getKeys(action):
+        return {"devid": action.device.id, "type": action.type, "obj": action.obj}
+
+    def add(self, action):
+        """ Add an action to the index, after all indexed actions. """
+        self._order[action.id] = next(self._counter)
+        for (attr, key) in self._getKeys(action).items():
+            self._maps[attr].setdefault(key, {})[action.id] = action
+
+    def remove(self, action):
+        """ Remove an action from the index. """
+        if self._order.pop(action.id, None) is None:
+            return
+
+        for (attr, key) in self._getKeys(action).items():
+            actions = self._maps[attr][key]
+            del actions[action.id]
+            if not actions:
+                del self._maps[attr][key]
+
+    def reorder(self, actions):
+        """ Record a new order for the indexed actions.
+
+            :param actions: all of the indexed actions, in their new order
+            :type actions: list of :class:`~.deviceaction.DeviceAction`
+        """
+        self._counter = itertools.count()
+        for action in actions:
+            self._order[action.id] = next(self._counter)
+
+    def position(self, action):
+        """ Return a sort key reflecting the action's place in the list. """
+        return self._order[action.id]
+
+    def find(self, attr, key):
+        """ Return the indexed actions with the given key for attr.
+
+            :param str attr: one of :attr:`attrs`
+            :param key: the value to look up
+            :returns: the matching actions, in no particular order
+            :rtype: list of :class:`~.deviceaction.DeviceAction`
+        """
+        return list(self._maps[attr].get(key, {}).values())
+
+    def devices(self):
+        """ Return the devices the indexed actions operate on. """
+        return [next(iter(actions.values())).device
+                for actions in self._maps["devid"].values()]
+
 class ActionList(object):
     def __init__(self):
         self._actions = []
         self._completed_actions = []
+        self._index = _ActionIndex()
 
     def __iter__(self):
         return iter(self._actions)
 
     def append(self, action):
         self._actions.append(action)
+        self._index.add(action)
 
     def remove(self, action):
         self._actions.remove(action)
+        self._index.remove(action)
+
+    def _rebuildIndex(self):
+        """ Re-create the lookup indexes from the action list.
+
+            This is only needed after replacing the contents of
+            :attr:`_actions` directly.
+        """
+        self._index = _ActionIndex()
+        for action in self._actions:
+            self._index.add(action)
 
     def find(self, device=None, action_type=None, object_type=None,
              path=None, devid=None):
@@ -76,8 +194,26 @@ class ActionList(object):
         _type = action_type_from_string(action_type)
         _object = action_object_from_string(object_type)
 
+        # start with the smallest set of candidates the indexes can provide
+        if device is not None and devid is None:
+            devid = device.id
+
+        candidates = None
+        for (attr, key) in (("devid", devid), ("type", _type), ("obj", _object)):
+            if key is None:
+                continue
+
+            found = self._index.find(attr, key)
+            if candidates is None or len(found) < len(candidates):
+                candidates = found
+
+        if candidates is None:
+            # only a path was specified; actions on the same device share it
+            candidates = [a for d in self._index.devices() if d.path == path
+                            for a in self._index.find("devid", d.id)]
+
         actions = []
-        for action in self._actions:
+        for action in sorted(candidates, key=self._index.position):
             if device is not None and action.device != device:
                 continue
 
@@ -97,58 +233,152 @@ class ActionList(object):
 
         return actions
 
+    @staticmethod
+    def _pruneKeys(action):
+        """ Return the ids of the devices whose actions can obsolete action.
+
+            An action can only be obsoleted by actions on the same device or,
+            if it adds a member to a container, by destruction of the
+            container.
+        """
+        keys = set([action.device.id])
+        if action.isAdd and action.container is not None:
+            keys.add(action.container.id)
+
+        return keys
+
     def prune(self):
         """ Remove redundant/obsolete actions from the action list. """
-        for action in reversed(self._actions[:]):
-            if action not in self._actions:
+        groups = {}
+        for action in self._actions:
+            for key in self._pruneKeys(action):
+                groups.setdefault(key, []).append(action)
+
+        pruned = set()
+        for action in reversed(self._actions):
+            if action.id in pruned:
                 log.debug("action %d already pruned", action.id)
                 continue
 
-            for obsolete in self._actions[:]:
+            candidates = [a for a in groups[action.device.id]
+                          if a.id not in pruned]
+            for obsolete in candidates:
                 if action.obsoletes(obsolete):
                     log.info("removing obsolete action %d (%d)",
                              obsolete.id, action.id)
-                    self._actions.remove(obsolete)
+                    pruned.add(obsolete.id)
 
-                    if obsolete.obsoletes(action) and action in self._actions:
+                    if obsolete.obsoletes(action) and action.id not in pruned:
                         log.info("removing mutually-obsolete action %d (%d)",
                                  action.id, obsolete.id)
-                        self._actions.remove(action)
+                        pruned.add(action.id)
 
-    def sort(self):
-        """ Sort actions based on dependencies. """
-        if not self._actions:
+        if not pruned:
             return
 
-        edges = []
+        for action in (a for a in self._actions if a.id in pruned):
+            self._index.remove(action)
 
-        # collect all ordering requirements for the actions
-        for action in self._actions:
-            action_idx = self._actions.index(action)
-            children = []
-            for _action in self._actions:
-                if _action == action:
-                    continue
+        self._actions = [a for a in self._actions if a.id not in pruned]
+
+    @staticmethod
+    def _bucketKeys(action):
+        """ Return the keys of the buckets action belongs in for sorting.
+
+            Two actions can only require one another (other than by action
+            type alone) if their devices share a root device (an ancestor with
+            no parents) or if they involve the same container. Actions that
+            share no bucket do not need to be compared.
+        """
+        keys = set(("root", d.id) for d in action.device.ancestors
+                   if not d.parents)
+        for container in (action.container,
+                          getattr(action.device, "container", None)):
+            if container is not None:
+                keys.add(("container", container.id))
+
+        return keys
+
+    def _graph(self):
+        """ Return a graph of the ordering requirements of the actions.
+
+            :returns: the number of nodes and a set of (before, after) edges
+            :rtype: tuple of (int, set of (int, int))
+
+            Nodes below len(self._actions) are indices into the action list.
+            Every non-container action requires all non-container actions of
+            a higher type (eg: creates come after destroys). Rather than add
+            an edge for every such pair, one node per action type is added to
+            the graph to act as a barrier between consecutive types. The
+            remaining dependencies are found by comparing only the actions
+            that share a bucket (see :meth:`_bucketKeys`).
+        """
+        num_actions = len(self._actions)
+        edges = set()
+
+        # order the action types using barrier nodes, which are numbered after
+        # the actions
+        types = sorted(set(a.type for a in self._actions if not a.isContainer),
+                       reverse=True)
+        barriers = dict((t, num_actions + i) for (i, t) in enumerate(types))
+        for (higher, lower) in zip(types, types[1:]):
+            edges.add((barriers[higher], barriers[lower]))
+
+        buckets = {}
+        for (idx, action) in enumerate(self._actions):
+            if not action.isContainer:
+                edges.add((idx, barriers[action.type]))
+                if action.type != types[0]:
+                    prev = types[types.index(action.type) - 1]
+                    edges.add((barriers[prev], idx))
+
+            for key in self._bucketKeys(action):
+                buckets.setdefault(key, []).append(idx)
+
+        # collect all other ordering requirements for the actions
+        compared = set()
+        for members in buckets.values():
+            for (i, action_idx) in enumerate(members):
+                action = self._actions[action_idx]
+                for other_idx in members[i+1:]:
+                    if (action_idx, other_idx) in compared:
+                        continue
+
+                    compared.add((action_idx, other_idx))
+                    other = self._actions[other_idx]
 
-                # create edges based on both action type and dependencies.
-                if _action.requires(action):
-                    children.append(_action)
+                    # create edges based on both action type and dependencies.
+                    if other.requires(action):
+                        edges.add((action_idx, other_idx))
 
-            for child in children:
-                child_idx = self._actions.index(child)
-                edges.append((action_idx, child_idx))
+                    if action.requires(other):
+                        edges.add((other_idx, action_idx))
+
+        return (num_actions + len(types), edges)
+
+    def sort(self):
+        """ Sort actions based on dependencies (see :meth:`_graph`). """
+        if not self._actions:
+            return
+
+        with call_stats.phase("sort"):
+            self._sort()
+
+    def _sort(self):
+        num_actions = len(self._actions)
+        (num_nodes, edges) = self._graph()
 
         # create a graph reflecting the ordering information we have
-        graph = tsort.create_graph(list(range(len(self._actions))), edges)
+        items = list(range(num_nodes))
+        graph = tsort.create_graph(items, sorted(edges))
 
         # perform a topological sort based on the graph's contents
         order = tsort.tsort(graph)
 
         # now replace self._actions with a sorted version of the same list
-        actions = []
-        for idx in order:
-            actions.append(self._actions[idx])
-        self._actions = actions
+        self._actions = [self._actions[idx] for idx in order
+                         if idx < num_actions]
+        self._index.reorder(self._actions)
 
     def _preProcess(self, devices=None):
         """ Prepare the action queue for execution. """
@@ -209,7 +439,7 @@ class ActionList(object):
                 action = ActionCreateDevice(device)
                 # apply the action first in case the apply method fails
                 action.apply()
-                self._actions.append(action)
+                self.append(action)
 
         log.info("sorting actions...")
         self.sort()
@@ -232,8 +462,7 @@ class ActionList(object):
         # now we have to update the parted partitions of all devices so they
         # match the parted disks we just updated
         for partition in (d for d in devices if isinstance(d, PartitionDevice)):
-            pdisk = partition.disk.format.partedDisk
-            partition.partedPartition = pdisk.getPartitionByPath(partition.path)
+            partition.partedPartition = partition.disk.format.getPartitionByPath(partition.path)
 
     def _findActiveDevicesOnActionDisks(self, devices=None):
         """ Return a list of devices using the disks we plan to change. """
@@ -269,32 +498,265 @@ class ActionList(object):
         :param devices: a list of all devices current in the devicetree
         :type callbacks: :class:`~.callbacks.DoItCallbacks`
 
+        If :attr:`~.flags.Flags.action_workers` is greater than 1, actions
+        that do not depend on one another are executed concurrently (see
+        :meth:`_processConcurrently`). Callbacks may then be invoked from
+        several threads.
         """
-        devices = devices or []
-        self._preProcess(devices=devices)
+        with call_stats.phase("process"), udev.coalesced_settles(), \
+             statusCache.cached():
+            self._process(callbacks=callbacks, devices=devices or [],
+                          dryRun=dryRun)
 
-        for action in self._actions[:]:
-            log.info("executing action: %s", action)
-            if not dryRun:
-                try:
-                    action.execute(callbacks)
-                except DiskLabelCommitError:
-                    # it's likely that a previous action
-                    # triggered setup of an lvm or md device.
-                    # include deps no longer in the tree due to pending removal
-                    devs = devices + [a.device for a in self._actions]
-                    for dep in set(devs):
-                        if dep.exists and dep.dependsOn(action.device.disk):
-                            dep.teardown(recursive=True)
-
-                    action.execute(callbacks)
+        log.debug("external calls: %s", call_stats)
 
-                for device in devices:
-                    # make sure we catch any renumbering parted does
-                    if device.exists and isinstance(device, PartitionDevice):
-                        device.updateName()
-                        device.format.device = device.path
+    def _process(self, callbacks=None, devices=None, dryRun=None):
+        self._preProcess(devices=devices)
+
+        if not dryRun and flags.action_workers > 1 and len(self._actions) > 1:
+            self._processConcurrently(callbacks=callbacks, devices=devices)
+        else:
+            for action in self._actions[:]:
+                log.info("executing action: %s", action)
+                if not dryRun:
+                    try:
+                        action.execute(callbacks)
+                    except DiskLabelCommitError:
+                        self._tearDownDiskUsers(action, devices)
+                        action.execute(callbacks)
 
-                self._completed_actions.append(self._actions.pop(0))
+                self._actionExecuted(action, devices, dryRun=dryRun)
 
         self._postProcess(devices=devices)
+
+    def _tearDownDiskUsers(self, action, devices):
+        """ Deactivate the devices that prevent a disklabel commit. """
+        # it's likely that a previous action
+        # triggered setup of an lvm or md device.
+        # include deps no longer in the tree due to pending removal
+        devs = devices + [a.device for a in self._actions]
+        for dep in set(devs):
+            if dep.exists and dep.dependsOn(action.device.disk):
+                dep.teardown(recursive=True)
+
+    def _actionExecuted(self, action, devices, dryRun=None):
+        """ Move an executed action to the list of completed actions. """
+        if not dryRun:
+            self._updatePartitionNames(devices)
+
+        self._actionCompleted(action)
+
+    def _actionCompleted(self, action):
+        self.remove(action)
+        self._completed_actions.append(action)
+
+    @staticmethod
+    def _updatePartitionNames(devices, disk=None):
+        """ Make sure we catch any renumbering parted does.
+
+            :param devices: the devices in the tree
+            :keyword disk: only update the partitions of this disk
+            :type disk: :class:`~.devices.StorageDevice`
+        """
+        for device in devices:
+            if device.exists and isinstance(device, PartitionDevice) and \
+               (disk is None or device.disk is disk):
+                device.updateName()
+                device.format.device = device.path
+
+    @staticmethod
+    def _actionDisk(action):
+        """ Return the disk whose partitions an action may renumber, or None. """
+        device = action.device
+        if isinstance(device, PartitionDevice):
+            return device.disk
+
+        if device.partitioned or \
+           (action.isFormat and action.format.type == "disklabel"):
+            return device
+
+        return None
+
+    @classmethod
+    def _diskKey(cls, action):
+        """ Return the id of the disk whose partitioning action involves.
+
+            :returns: a disk's id, or None if the action involves no disklabel
+            :rtype: int or NoneType
+        """
+        disk = cls._actionDisk(action)
+        return disk.id if disk is not None else None
+
+    @staticmethod
+    def _sharedAncestors(actions):
+        """ Return the existing devices that several actions' devices are
+            built on.
+
+            Disks and partitions are left out since they need no setting up.
+
+            :rtype: set of :class:`~.devices.Device`
+        """
+        seen = set()
+        shared = set()
+        for action in actions:
+            for ancestor in action.device.ancestors:
+                if ancestor is action.device or not ancestor.exists or \
+                   ancestor.isDisk or isinstance(ancestor, PartitionDevice):
+                    continue
+
+                if ancestor in seen:
+                    shared.add(ancestor)
+
+                seen.add(ancestor)
+
+        return shared
+
+    def _processConcurrently(self, callbacks=None, devices=None):
+        """ Execute the sorted actions using a pool of threads.
+
+            An action is started as soon as every action it has to follow
+            according to :meth:`_graph` has completed. Actions on the same
+            disk's disklabel or partitions are also executed in sorted order,
+            and no two actions involving any disklabel or partition run at
+            the same time (see :data:`_commitLock`). When several actions are
+            ready, they are started in sorted order.
+
+            Existing devices that several actions' devices are built on (eg:
+            a LUKS or md device holding a volume group) are set up by the
+            calling thread before the first of those actions is started, so
+            that concurrent actions don't race to set them up. Partitions
+            are renamed after parted renumbers them by the calling thread,
+            once no running action involves their disk.
+
+            If a disklabel commit fails, no other actions are started until
+            the running ones complete. The disk's users are then torn down
+            and the action is retried, as in serial execution. If an action
+            fails, the running actions are allowed to complete before the
+            exception is re-raised. Actions that completed are moved to
+            :attr:`_completed_actions` in the order they completed, and the
+            others remain queued.
+        """
+        actions = self._actions[:]
+        (num_nodes, edges) = self._graph()
+        last = {}
+        for (idx, action) in enumerate(actions):
+            key = self._diskKey(action)
+            if key is None:
+                continue
+
+            if key in last:
+                edges.add((last[key], idx))
+
+            last[key] = idx
+
+        successors = dict((node, []) for node in range(num_nodes))
+        waiting = [0] * num_nodes
+        for (before, after) in edges:
+            successors[before].append(after)
+            waiting[after] += 1
+
+        ready = [node for node in range(num_nodes) if not waiting[node]]
+        heapq.heapify(ready)
+
+        def completed(node):
+            for successor in successors[node]:
+                waiting[successor] -= 1
+                if not waiting[successor]:
+                    heapq.heappush(ready, successor)
+
+        shared = self._sharedAncestors(actions)
+
+        def involves(action, disk):
+            return action.device is disk or action.device.dependsOn(disk)
+
+        workers = min(flags.action_workers, len(actions))
+        log.info("executing %d actions using %d threads", len(actions), workers)
+        pool = ThreadPool(workers)
+        results = queue.Queue()
+        running = {}
+        renames = set()     # disks whose partitions may have been renumbered
+        retries = []
+        failure = None
+        try:
+            while failure is None and (ready or running or retries):
+                for disk in [d for d in renames
+                             if not any(involves(a, d) for a in running.values())]:
+                    self._updatePartitionNames(devices, disk=disk)
+                    renames.discard(disk)
+
+                if retries and not running:
+                    node = retries.pop(0)
+                    try:
+                        self._tearDownDiskUsers(actions[node], devices)
+                        actions[node].execute(callbacks)
+                    except Exception as e: # pylint: disable=broad-except
+                        failure = e
+                        break
+
+                    self._actionExecuted(actions[node], devices)
+                    completed(node)
+                    continue
+
+                deferred = []
+                while ready and len(running) < workers and not retries:
+                    node = heapq.heappop(ready)
+                    if node >= len(actions):
+                        # action type barriers complete immediately
+                        completed(node)
+                        continue
+
+                    action = actions[node]
+                    if any(involves(action, d) for d in renames):
+                        # wait until the partitions have their new names
+                        deferred.append(node)
+                        continue
+
+                    if shared.intersection(action.device.ancestors):
+                        try:
+                            action.device.setupParents(orig=action.isDestroy)
+                        except Exception as e: # pylint: disable=broad-except
+                            failure = e
+                            break
+
+                    log.info("executing action: %s", action)
+                    lock = _commitLock if self._actionDisk(action) is not None else None
+                    pool.apply_async(call_stats.inCurrentPhase(_runAction),
+                                     (node, action, callbacks, lock),
+                                     callback=results.put)
+                    running[node] = action
+
+                for node in deferred:
+                    heapq.heappush(ready, node)
+
+                if failure is not None or not running:
+                    continue
+
+                (node, exc) = results.get()
+                del running[node]
+                if exc is None:
+                    self._actionCompleted(actions[node])
+                    disk = self._actionDisk(actions[node])
+                    if disk is not None:
+                        renames.add(disk)
+                    completed(node)
+                elif isinstance(exc, DiskLabelCommitError):
+                    retries.append(node)
+                else:
+                    failure = exc
+
+            # let the actions that are already running complete
+            while running:
+                (node, exc) = results.get()
+                del running[node]
+                if exc is None:
+                    self._actionCompleted(actions[node])
+                else:
+                    log.error("action %s failed: %s", actions[node], exc)
+
+            self._updatePartitionNames(devices)
+        finally:
+            pool.close()
+            pool.join()
+
+        if failure is not None:
+            raise failure
@@ -37,6 +37,7 @@ from .devices import LVMLogicalVolumeDevice, LVMThinLogicalVolumeDevice, LVMThin
 from .devices import MDRaidArrayDevice, PartitionDevice, TmpFSDevice, devicePathToName
 from .deviceaction import ActionCreateDevice, ActionCreateFormat, ActionDestroyDevice
 from .deviceaction import ActionDestroyFormat, ActionResizeDevice, ActionResizeFormat
+from .callstats import call_stats
 from .devicelibs.edd import get_edd_dict
 from .devicelibs.btrfs import MAIN_VOLUME_ID
 from .errors import StorageError
@@ -46,6 +47,7 @@ from .formats import get_default_filesystem_type
 from .flags import flags
 from .platform import platform as _platform
 from .formats import getFormat
+from .formats.fs import prefetch_size_info
 from .osinstall import FSSet, findExistingInstallations
 from . import arch
 from . import iscsi
@@ -323,6 +325,19 @@ class Blivet(object):
         _all = set(self.devices)
         return list(_all.difference(used))
 
+    @property
+    def callStats(self):
+        """ Timing and counters for the external programs and libblockdev
+            functions called so far.
+
+            :rtype: :class:`~.callstats.CallStats`
+
+            The measurements are shared by all instances. Use
+            :meth:`~.callstats.CallStats.toJSON` to export them and
+            :meth:`~.callstats.CallStats.reset` to start over.
+        """
+        return call_stats
+
     @property
     def devices(self):
         """ A list of all the devices in the device tree. """
@@ -730,6 +745,21 @@ class Blivet(object):
         if clearPartType is None:
             clearPartType = self.config.clearPartType
 
+        # gather the size info of the filesystems examined below all at once
+        partitions = self.partitions
+        formats = []
+        for disk in disks:
+            if self.shouldClear(disk, clearPartType=clearPartType,
+                                clearPartDisks=[disk.name]):
+                continue
+
+            formats.append(disk.format)
+            formats.extend(p.format for p in partitions
+                           if p.disk == disk and
+                           not self.shouldClear(p, clearPartType=clearPartType,
+                                                clearPartDisks=[disk.name]))
+        prefetch_size_info(formats)
+
         free = {}
         for disk in disks:
             should_clear = self.shouldClear(disk, clearPartType=clearPartType,
@@ -742,7 +772,7 @@ class Blivet(object):
             fs_free = Size(0)
             if disk.partitioned:
                 disk_free = disk.format.free
-                for partition in [p for p in self.partitions if p.disk == disk]:
+                for partition in [p for p in partitions if p.disk == disk]:
                     # only check actual filesystems since lvm &c require a bunch of
                     # operations to translate free filesystem space into free disk
                     # space
@@ -1676,6 +1706,26 @@ class Blivet(object):
         factory.configure()
         return factory.device
 
+    def checkpoint(self):
+        """ Record the storage configuration so it can be rolled back to.
+
+            :returns: the recorded state, for :meth:`rollback`
+            :rtype: :class:`~.devicetree.DeviceTreeCheckpoint`
+
+            Unlike :meth:`copy`, this does not create any new devices, which
+            makes it the cheaper choice for trying out changes that may have
+            to be discarded.
+        """
+        return self.devicetree.checkpoint(objects=[self] + self.roots)
+
+    def rollback(self, checkpoint):
+        """ Return the storage configuration to a recorded state.
+
+            :param checkpoint: the state to return to
+            :type checkpoint: :class:`~.devicetree.DeviceTreeCheckpoint`
+        """
+        self.devicetree.rollback(checkpoint)
+
     def copy(self):
         log.debug("starting Blivet copy")
         new = copy.deepcopy(self)
@@ -1691,7 +1741,7 @@ class Blivet(object):
             req_disks = (new.devicetree.getDeviceByID(disk.id) for disk in partition.req_disks)
             partition.req_disks = [disk for disk in req_disks if disk is not None]
 
-            p = partition.disk.format.partedDisk.getPartitionByPath(partition.path)
+            p = partition.disk.format.getPartitionByPath(partition.path)
             partition.partedPartition = p
 
         for root in new.roots:
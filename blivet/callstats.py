@@ -0,0 +1,316 @@
+# callstats.py
+# Timing and counters for external programs and libblockdev calls.
+#
+# Copyright (C) 2015  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+import json
+import sys
+import time
+from contextlib import contextmanager
+from threading import Lock, local
+
+import gi
+gi.require_version("BlockDev", "1.0")
+
+from gi.repository import BlockDev as _blockdev
+
+BLOCKDEV_PLUGINS = ("btrfs", "crypto", "dm", "loop", "lvm", "md", "mpath",
+                    "s390", "swap")
+""" the libblockdev plugin namespaces whose functions are timed """
+
+class _Counter(object):
+    """ Aggregated measurements of a group of calls. """
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.time = 0.0
+        self.maxTime = 0.0
+        self.outputSize = 0
+        self.exitCodes = {}
+
+    def add(self, seconds, rc=0, outputSize=0):
+        self.calls += 1
+        self.time += seconds
+        self.maxTime = max(self.maxTime, seconds)
+        self.outputSize += outputSize
+        self.exitCodes[rc] = self.exitCodes.get(rc, 0) + 1
+        if rc != 0:
+            self.failures += 1
+
+    def update(self, other):
+        self.calls += other.calls
+        self.failures += other.failures
+        self.time += other.time
+        self.maxTime = max(self.maxTime, other.maxTime)
+        self.outputSize += other.outputSize
+        for (rc, count) in other.exitCodes.items():
+            self.exitCodes[rc] = self.exitCodes.get(rc, 0) + count
+
+    @property
+    def dict(self):
+        return {"calls": self.calls, "failures": self.failures,
+                "time": self.time, "maxTime": self.maxTime,
+                "outputSize": self.outputSize,
+                "exitCodes": dict((str(rc), count)
+                                  for (rc, count) in self.exitCodes.items())}
+
+class CallStats(object):
+    """ Timing and counters for calls to external programs and libblockdev.
+
+        Each call is recorded with the tool that was run (eg: "mkfs.xfs" or
+        "blockdev.lvm.pvs"), the blivet module it was called from and the
+        phase it happened in (eg: "populate" or "process"; see
+        :meth:`phase`). The measurements are aggregated rather than kept
+        individually.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._local = local()
+        self._counters = {}
+
+    def reset(self):
+        """ Discard all measurements. """
+        with self._lock:
+            self._counters = {}
+
+    @property
+    def _phases(self):
+        """ The calling thread's stack of active phases. """
+        phases = getattr(self._local, "phases", None)
+        if phases is None:
+            phases = self._local.phases = []
+
+        return phases
+
+    @property
+    def currentPhase(self):
+        """ The calling thread's innermost active phase, or None. """
+        phases = self._phases
+        return phases[-1] if phases else None
+
+    @contextmanager
+    def phase(self, name):
+        """ Attribute the calls made within the context to a phase.
+
+            :param str name: the name of the phase
+
+            Phases can be nested, in which case calls are attributed to the
+            innermost one. Phases are kept per thread; work handed to other
+            threads is attributed to the caller's phase only if it is wrapped
+            with :meth:`inCurrentPhase`.
+        """
+        phases = self._phases
+        phases.append(name)
+        try:
+            yield
+        finally:
+            phases.pop()
+
+    def inCurrentPhase(self, func):
+        """ Bind a function to the calling thread's active phases.
+
+            :param func: the function to wrap
+            :returns: a function that calls func with the phases that were
+                      active when it was wrapped, whichever thread calls it
+        """
+        phases = list(self._phases)
+
+        def bound(*args, **kwargs):
+            saved = self._phases
+            self._local.phases = list(phases)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.phases = saved
+
+        return bound
+
+    def record(self, tool, seconds, rc=0, outputSize=0, subsystem=None):
+        """ Record a call.
+
+            :param str tool: the program or function that was called
+            :param float seconds: how long the call took
+            :keyword rc: the exit code, or None if the call raised an exception
+            :type rc: int or NoneType
+            :keyword int outputSize: size of the call's output
+            :keyword str subsystem: the blivet module the call was made from
+        """
+        key = (self.currentPhase, tool, subsystem)
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = _Counter()
+
+            counter.add(seconds, rc=rc, outputSize=outputSize)
+
+    def _aggregate(self, key_func):
+        with self._lock:
+            items = list(self._counters.items())
+
+        result = {}
+        for (key, counter) in items:
+            result.setdefault(key_func(*key), _Counter()).update(counter)
+
+        return result
+
+    def byTool(self):
+        """ Return the measurements for each tool.
+
+            :returns: a dict of tool to a dict of measurements (calls,
+                      failures, time, maxTime, outputSize, exitCodes)
+            :rtype: dict
+        """
+        counters = self._aggregate(lambda phase, tool, subsystem: tool)
+        return dict((tool, c.dict) for (tool, c) in counters.items())
+
+    def byPhase(self):
+        """ Return the measurements for each tool within each phase.
+
+            :returns: a dict of phase to a dict like the one returned by
+                      :meth:`byTool`; calls made outside of any phase are
+                      listed under "none"
+            :rtype: dict
+        """
+        counters = self._aggregate(lambda phase, tool, subsystem: (phase, tool))
+        result = {}
+        for ((phase, tool), counter) in counters.items():
+            result.setdefault(phase or "none", {})[tool] = counter.dict
+
+        return result
+
+    def bySubsystem(self):
+        """ Return the measurements for each tool called from each module.
+
+            :returns: a dict of blivet module (eg: "devices.lvm") to a dict
+                      like the one returned by :meth:`byTool`
+            :rtype: dict
+        """
+        counters = self._aggregate(lambda phase, tool, subsystem: (subsystem, tool))
+        result = {}
+        for ((subsystem, tool), counter) in counters.items():
+            result.setdefault(subsystem or "none", {})[tool] = counter.dict
+
+        return result
+
+    def toJSON(self, **kwargs):
+        """ Return all of the measurements as a JSON document.
+
+            Keyword arguments are passed to :func:`json.dumps`.
+        """
+        return json.dumps({"tools": self.byTool(),
+                           "phases": self.byPhase(),
+                           "subsystems": self.bySubsystem()},
+                          sort_keys=True, **kwargs)
+
+    def __str__(self):
+        tools = sorted(self.byTool().items(), key=lambda i: i[1]["time"],
+                       reverse=True)
+        return ", ".join("%s: %d calls in %.3fs" % (tool, c["calls"], c["time"])
+                         for (tool, c) in tools)
+
+call_stats = CallStats()
+
+def caller_subsystem(skip=()):
+    """ Return the name of the blivet module a call was made from.
+
+        :keyword skip: names of modules to look beyond, in addition to this one
+        :type skip: tuple of str
+        :returns: the name of the module relative to the blivet package
+                  (eg: "devices.lvm"), or None if not called from blivet
+        :rtype: str or NoneType
+    """
+    # pylint: disable=protected-access
+    frame = sys._getframe(1)
+    while frame is not None:
+        name = frame.f_globals.get("__name__", "")
+        if name != __name__ and name not in skip:
+            if name.startswith("blivet."):
+                return name[len("blivet."):]
+            return None
+
+        frame = frame.f_back
+
+    return None
+
+class _PluginProxy(object):
+    """ A libblockdev plugin namespace whose functions are timed. """
+
+    def __init__(self, name, plugin, owner=None):
+        self._name = name
+        self._plugin = plugin
+        self._owner = owner
+
+    def __getattr__(self, attr):
+        func = getattr(self._plugin, attr)
+        if not callable(func) or isinstance(func, type):
+            return func
+
+        tool = "blockdev.%s.%s" % (self._name, attr)
+
+        def timed(*args, **kwargs):
+            start = time.time()
+            rc = None
+            interceptor = getattr(self._owner, "interceptor", None)
+            try:
+                if interceptor is None:
+                    result = func(*args, **kwargs)
+                else:
+                    result = interceptor(tool, func, args, kwargs)
+                rc = 0
+                return result
+            finally:
+                call_stats.record(tool, time.time() - start, rc=rc,
+                                  subsystem=caller_subsystem())
+
+        # only looked up once; later accesses find the wrapper directly
+        self.__dict__[attr] = timed
+        return timed
+
+class _BlockDevProxy(object):
+    """ The libblockdev module, with calls to plugin functions recorded in
+        :data:`call_stats`.
+
+        Everything else is passed through unchanged.
+    """
+
+    def __init__(self, module):
+        self._module = module
+        self._plugins = {}
+
+        self.interceptor = None
+        """ a function to call plugin functions through, or None
+
+            It is called with the tool name (eg: "blockdev.lvm.pvs"), the
+            plugin function and its positional and keyword arguments, and
+            returns the result in place of the plugin function.
+        """
+
+    def __getattr__(self, attr):
+        value = getattr(self._module, attr)
+        if attr not in BLOCKDEV_PLUGINS:
+            return value
+
+        proxy = self._plugins.get(attr)
+        if proxy is None or proxy._plugin is not value:
+            proxy = self._plugins[attr] = _PluginProxy(attr, value, self)
+
+        return proxy
+
+blockdev = _BlockDevProxy(_blockdev)
+""" libblockdev, for use throughout blivet """
@@ -557,7 +557,7 @@ class ActionCreateFormat(DeviceAction):
                 self.device.partedPartition.system = self.format.partedSystem
 
             self.device.disk.format.commitToDisk()
-            udev.settle()
+            udev.settle(devices=[self.device.disk.sysfsPath])
 
         if isinstance(self.device.format, luks.LUKS):
             # LUKS needs to wait for random data entropy if it is too low
@@ -582,7 +582,7 @@ class ActionCreateFormat(DeviceAction):
                                   options=self.device.formatArgs)
 
         # Get the UUID now that the format is created
-        udev.settle()
+        udev.settle(devices=[self.device.sysfsPath])
         self.device.updateSysfsPath()
         info = udev.get_device(self.device.sysfsPath)
         # only do this if the format has a device known to udev
@@ -667,7 +667,7 @@ class ActionDestroyFormat(DeviceAction):
         status = self.device.status
         self.device.setup(orig=True)
         self.format.destroy()
-        udev.settle()
+        udev.settle(devices=[self.device.sysfsPath])
         if not status:
             self.device.teardown()
 
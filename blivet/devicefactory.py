@@ -35,10 +35,7 @@ from .partitioning import TotalSizeSet
 from .partitioning import doPartitioning
 from .size import Size
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from .callstats import blockdev
 
 import logging
 log = logging.getLogger("blivet")
@@ -336,10 +333,7 @@ class DeviceFactory(object):
         self.min_luks_entropy = min_luks_entropy
 
         # used for error recovery
-        self.__devices = []
-        self.__actions = []
-        self.__names = []
-        self.__roots = []
+        self.__checkpoint = None
 
     @property
     def raid_level(self):
@@ -849,17 +843,10 @@ class DeviceFactory(object):
     # methods for error recovery
     #
     def _save_devicetree(self):
-        _blivet_copy = self.storage.copy()
-        self.__devices = _blivet_copy.devicetree._devices
-        self.__actions = _blivet_copy.devicetree._actions
-        self.__names = _blivet_copy.devicetree.names
-        self.__roots = _blivet_copy.roots
+        self.__checkpoint = self.storage.checkpoint()
 
     def _revert_devicetree(self):
-        self.storage.devicetree._devices = self.__devices
-        self.storage.devicetree._actions = self.__actions
-        self.storage.devicetree.names = self.__names
-        self.storage.roots = self.__roots
+        self.storage.rollback(self.__checkpoint)
 
 class PartitionFactory(DeviceFactory):
     """ Factory class for creating a partition. """
@@ -26,6 +26,10 @@ import logging
 import os
 import re
 import struct
+import threading
+import time
+
+from six.moves import queue
 
 from .. import util
 from ..util import open # pylint: disable=redefined-builtin
@@ -153,38 +157,129 @@ def collect_edd_data():
         edd_data_dict[biosdev] = EddEntry(sysfspath)
     return edd_data_dict
 
+MBR_WORKERS = 8
+""" the maximum number of disks whose MBR signatures are read at once """
+
+MBR_TIMEOUT = 30
+""" seconds to wait for all of the MBR signatures """
+
+MBR_THREADS = 2 * MBR_WORKERS
+""" maximum number of reads, hung or not, to have running at once """
+
+MBR_READ_TIMEOUT = 5
+""" seconds after which a read is assumed to hang, so that it stops
+    counting against :data:`MBR_WORKERS`
+"""
+
+def _read_mbrsig(path):
+    """ Read the MBR signature of a device.
+
+        :param str path: the device node
+        :returns: the signature
+        :rtype: int
+        :raises OSError: if the device can not be read
+        :raises struct.error: if the device is too small
+    """
+    fd = util.eintr_retry_call(os.open, path, os.O_RDONLY)
+    try:
+        # The signature is the unsigned integer at byte 440:
+        if hasattr(os, "pread"):
+            data = util.eintr_retry_call(os.pread, fd, 4, 440)
+        else:
+            os.lseek(fd, 440, 0)
+            data = util.eintr_retry_call(os.read, fd, 4)
+    finally:
+        util.eintr_ignore(os.close, fd)
+
+    return struct.unpack('I', data)[0]
+
+def _read_mbrsig_into(results, dev):
+    try:
+        results.put((dev, _read_mbrsig(dev.path), None))
+    except Exception as e: # pylint: disable=broad-except
+        results.put((dev, None, e))
+
 def collect_mbrs(devices):
     """ Read MBR signatures from devices.
 
         Returns a dict mapping device names to their MBR signatures. It is not
         guaranteed this will succeed, with a new disk for instance.
+
+        Up to :data:`MBR_WORKERS` devices are read in parallel. A read that
+        takes longer than :data:`MBR_READ_TIMEOUT` seconds is left to
+        finish in the background while the next device is read, so hung
+        devices don't hold up the others, up to a total of
+        :data:`MBR_THREADS` reads. Devices that have not been read when
+        that many reads have hung, or after :data:`MBR_TIMEOUT` seconds in
+        total, are skipped.
     """
-    mbr_dict = {}
-    for dev in devices:
+    devices = list(devices)
+    queued = devices[:]
+    started = {}
+    sigs = {}
+    results = queue.Queue()
+    deadline = time.time() + MBR_TIMEOUT
+    while queued or len(sigs) < len(started):
+        now = time.time()
+        if now >= deadline:
+            break
+
+        running = [start for (dev, start) in started.items() if dev not in sigs]
+        reading = [start for start in running if now - start < MBR_READ_TIMEOUT]
+        if queued and not reading and len(running) >= MBR_THREADS:
+            # don't pile up any more threads stuck on hung devices
+            break
+
+        while queued and len(reading) < MBR_WORKERS and len(running) < MBR_THREADS:
+            dev = queued.pop(0)
+            # daemon threads, so that reads that hang don't keep the
+            # process alive
+            thread = threading.Thread(target=_read_mbrsig_into, args=(results, dev))
+            thread.daemon = True
+            thread.start()
+            started[dev] = now
+            running.append(now)
+            reading.append(now)
+
+        wait = min([deadline] + [start + MBR_READ_TIMEOUT for start in reading]) - now
         try:
-            fd = util.eintr_retry_call(os.open, dev.path, os.O_RDONLY)
-            # The signature is the unsigned integer at byte 440:
-            os.lseek(fd, 440, 0)
-            mbrsig = struct.unpack('I', util.eintr_retry_call(os.read, fd, 4))
-            util.eintr_ignore(os.close, fd)
-        except OSError as e:
-            log.warning("edd: error reading mbrsig from disk %s: %s",
-                        dev.name, str(e))
+            (dev, mbrsig, error) = results.get(timeout=max(wait, 0))
+        except queue.Empty:
             continue
 
+        sigs[dev] = mbrsig
+        if error is not None and not isinstance(error, (OSError, struct.error)):
+            raise error
+        elif error is not None:
+            log.warning("edd: error reading mbrsig from disk %s: %s",
+                        dev.name, str(error))
+
+    unread = [dev.name for dev in devices if dev in started and dev not in sigs]
+    if unread:
+        log.warning("edd: timed out reading mbrsig from disks %s", ", ".join(unread))
+
+    if queued:
+        log.warning("edd: not reading mbrsig from disks %s: reads of other "
+                    "disks did not complete in time",
+                    ", ".join(dev.name for dev in queued))
+
+    mbrsigs = [(dev, sigs[dev]) for dev in devices if sigs.get(dev) is not None]
+
+    mbr_dict = {}
+    sig_dict = {}
+    for (dev, mbrsig) in mbrsigs:
         mbrsig_str = "0x%08x" % mbrsig
         # sanity check
         if mbrsig_str == '0x00000000':
             log.info("edd: MBR signature on %s is zero. new disk image?", dev.name)
             continue
-        else:
-            for (dev_name, mbrsig_str_old) in mbr_dict.items():
-                if mbrsig_str_old == mbrsig_str:
-                    log.error("edd: dupicite MBR signature %s for %s and %s",
-                              mbrsig_str, dev_name, dev.name)
-                    # this actually makes all the other data useless
-                    return {}
-        # update the dictionary
+        elif mbrsig_str in sig_dict:
+            log.error("edd: dupicite MBR signature %s for %s and %s",
+                      mbrsig_str, sig_dict[mbrsig_str], dev.name)
+            # this actually makes all the other data useless
+            return {}
+        # update the dictionaries
+        sig_dict[mbrsig_str] = dev.name
         mbr_dict[dev.name] = mbrsig_str
     log.info("edd: collected mbr signatures: %s", mbr_dict)
     return mbr_dict
@@ -20,14 +20,12 @@
 # Author(s): Dave Lehman <dlehman@redhat.com>
 #
 
+import json
 import re
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from ..callstats import blockdev
 
 import logging
 log = logging.getLogger("blivet")
@@ -37,6 +35,7 @@ from ..size import Size
 from ..i18n import N_
 from ..flags import flags
 from ..tasks import availability
+from .. import udev
 
 # some of lvm's defaults that we have no way to ask it for
 LVM_PE_START = Size("1 MiB")
@@ -64,8 +63,8 @@ EXTERNAL_DEPENDENCIES = [availability.BLOCKDEV_LVM_PLUGIN]
 config_args_data = { "filterRejects": [],    # regular expressions to reject.
                      "filterAccepts": [] }   # regexp to accept
 
-def _set_global_config():
-    """lvm command accepts lvm.conf type arguments preceded by --config. """
+def _get_global_config():
+    """ Return the lvm.conf type arguments for --config. """
 
     filter_string = ""
     rejects = config_args_data["filterRejects"]
@@ -88,7 +87,11 @@ def _set_global_config():
     if not flags.lvm_metadata_backup:
         config_string += "backup {backup=0 archive=0} "
 
-    blockdev.lvm.set_global_config(config_string)
+    return config_string
+
+def _set_global_config():
+    """lvm command accepts lvm.conf type arguments preceded by --config. """
+    blockdev.lvm.set_global_config(_get_global_config())
 
 def needs_config_refresh(fn):
     if not availability.BLOCKDEV_LVM_PLUGIN.available:
@@ -122,12 +125,15 @@ def lvm_cc_resetFilter():
     config_args_data["filterRejects"] = []
     config_args_data["filterAccepts"] = []
 
-def determine_parent_lv(vg_name, internal_lv, lvs):
+def determine_parent_lv(vg_name, internal_lv, lvs, report=None):
     """Try to determine which of the lvs is the parent of the internal_lv
 
     :param str vg_name: name of the VG the internal_lv and lvs belong to
     :type internal_lv: :class:`~.devices.lvm.LMVInternalLogicalVolumeDevice`
     :type lvs: :class:`~.devices.lvm.LMVLogicalVolumeDevice`
+    :keyword report: LVM report to take the relations between LVs from
+                     instead of querying lvm for each LV
+    :type report: :class:`LVMReport`
 
     """
     # try name matching first (fast, cheap, often works)
@@ -141,6 +147,19 @@ def determine_parent_lv(vg_name, internal_lv, lvs):
         if re.match(lv.lvname+internal_lv.name_suffix+"$", internal_lv.lvname):
             return lv
 
+    if report is not None and report.relations:
+        for lv in lvs:
+            lv_info = report.getLV(vg_name, lv.lvname) or \
+                      report.getLV(vg_name, "[%s]" % lv.lvname)
+            if lv_info is None:
+                continue
+
+            related = (lv_info.pool_lv, lv_info.data_lv, lv_info.metadata_lv)
+            if any(name and name.strip("[]") == internal_lv.lvname for name in related):
+                return lv
+
+        return None
+
     # now try checking relations between LVs
     for lv in lvs:
         # cache pools are internal LVs of cached LVs
@@ -172,3 +191,172 @@ def determine_parent_lv(vg_name, internal_lv, lvs):
                 return lv
 
     return None
+
+#
+# LVM report snapshots
+#
+# The attribute names match those of libblockdev's BDLVMPVdata, BDLVMVGdata
+# and BDLVMLVdata so that either can be used by callers.
+PVInfo = namedtuple("PVInfo", ["pv_name", "pv_uuid", "pv_size", "pv_free",
+                               "pe_start", "vg_name", "vg_uuid", "vg_size",
+                               "vg_free", "vg_extent_size", "vg_extent_count",
+                               "vg_free_count", "vg_pv_count"])
+VGInfo = namedtuple("VGInfo", ["name", "uuid", "size", "free", "extent_size",
+                               "extent_count", "free_count", "pv_count"])
+LVInfo = namedtuple("LVInfo", ["lv_name", "vg_name", "uuid", "size", "attr",
+                               "segtype", "origin", "pool_lv", "data_lv",
+                               "metadata_lv", "segments"])
+SegmentInfo = namedtuple("SegmentInfo", ["segtype", "devices"])
+
+_REPORT_FIELDS = OrderedDict([("vg", ["vg_name", "vg_uuid", "vg_size", "vg_free",
+                                      "vg_extent_size", "vg_extent_count",
+                                      "vg_free_count", "pv_count"]),
+                              ("pv", ["pv_name", "pv_uuid", "pv_size",
+                                      "pv_free", "pe_start"]),
+                              ("lv", ["lv_name", "lv_uuid", "lv_size", "lv_attr",
+                                      "origin", "pool_lv", "data_lv",
+                                      "metadata_lv"]),
+                              ("seg", ["lv_uuid", "segtype", "devices"])])
+
+class LVMReport(object):
+    """ A snapshot of the system's LVM configuration.
+
+        PVs are indexed by device path, VGs by UUID and name, and LVs by full
+        name (eg: "vg-lv") and VG name.
+    """
+
+    def __init__(self, pvs=None, vgs=None, lvs=None, relations=False):
+        """
+            :keyword pvs: the PVs
+            :type pvs: list of :class:`PVInfo`
+            :keyword vgs: the VGs
+            :type vgs: list of :class:`VGInfo`
+            :keyword lvs: the LVs
+            :type lvs: list of :class:`LVInfo`
+            :keyword bool relations: whether the LVs' origin, pool_lv,
+                                     data_lv and metadata_lv are known
+        """
+        self.relations = relations
+        self.pvs = OrderedDict((pv.pv_name, pv) for pv in pvs or [])
+        self.vgs = OrderedDict((vg.uuid, vg) for vg in vgs or [])
+        self._vgsByName = dict((vg.name, vg) for vg in self.vgs.values())
+        self.lvs = OrderedDict(("%s-%s" % (lv.vg_name, lv.lv_name), lv)
+                               for lv in lvs or [])
+        self._vgLVs = {}
+        for (name, lv) in self.lvs.items():
+            self._vgLVs.setdefault(lv.vg_name, OrderedDict())[name] = lv
+
+    def getPV(self, path):
+        """ Return the :class:`PVInfo` for a device path, or None. """
+        return self.pvs.get(path)
+
+    def getVG(self, uuid=None, name=None):
+        """ Return the :class:`VGInfo` for a VG UUID or name, or None. """
+        if uuid is not None:
+            return self.vgs.get(uuid)
+
+        return self._vgsByName.get(name)
+
+    def getLV(self, vg_name, lv_name):
+        """ Return the :class:`LVInfo` for an LV, or None. """
+        return self.lvs.get("%s-%s" % (vg_name, lv_name))
+
+    def getVGLVs(self, vg_name):
+        """ Return the LVs in a VG as a dict keyed by full LV name. """
+        return self._vgLVs.get(vg_name, OrderedDict())
+
+    @classmethod
+    def fromFullReport(cls, data):
+        """ Create a snapshot from the JSON output of "lvm fullreport".
+
+            :param str data: the output of "lvm fullreport --reportformat json"
+                             with the fields in :data:`_REPORT_FIELDS`, in bytes
+                             and without unit suffixes
+            :rtype: :class:`LVMReport`
+        """
+        pvs = []
+        vgs = []
+        lvs = []
+        for section in json.loads(data)["report"]:
+            vg = None
+            if section.get("vg"):
+                fields = section["vg"][0]
+                vg = VGInfo(fields["vg_name"], fields["vg_uuid"],
+                            int(fields["vg_size"]), int(fields["vg_free"]),
+                            int(fields["vg_extent_size"]),
+                            int(fields["vg_extent_count"]),
+                            int(fields["vg_free_count"]),
+                            int(fields["pv_count"]))
+                vgs.append(vg)
+
+            for fields in section.get("pv", []):
+                pvs.append(PVInfo(fields["pv_name"], fields["pv_uuid"],
+                                  int(fields["pv_size"]), int(fields["pv_free"]),
+                                  int(fields["pe_start"]),
+                                  vg.name if vg else "", vg.uuid if vg else "",
+                                  vg.size if vg else 0, vg.free if vg else 0,
+                                  vg.extent_size if vg else 0,
+                                  vg.extent_count if vg else 0,
+                                  vg.free_count if vg else 0,
+                                  vg.pv_count if vg else 0))
+
+            segments = {}
+            for fields in section.get("seg", []):
+                seg = SegmentInfo(fields["segtype"], fields["devices"])
+                segments.setdefault(fields["lv_uuid"], []).append(seg)
+
+            for fields in section.get("lv", []):
+                lv_segments = segments.get(fields["lv_uuid"], [])
+                lvs.append(LVInfo(fields["lv_name"], vg.name, fields["lv_uuid"],
+                                  int(fields["lv_size"]), fields["lv_attr"],
+                                  lv_segments[0].segtype if lv_segments else None,
+                                  fields["origin"] or None,
+                                  fields["pool_lv"] or None,
+                                  fields["data_lv"] or None,
+                                  fields["metadata_lv"] or None,
+                                  lv_segments))
+
+        return cls(pvs=pvs, vgs=vgs, lvs=lvs, relations=True)
+
+    @classmethod
+    def fromBlockDev(cls):
+        """ Create a snapshot using libblockdev's pvs, vgs and lvs functions. """
+        pvs = list(blockdev.lvm.pvs())
+        vgs = [VGInfo(vg.name, vg.uuid, vg.size, vg.free, vg.extent_size,
+                      vg.extent_count, vg.free_count, vg.pv_count)
+               for vg in blockdev.lvm.vgs()]
+        lvs = [LVInfo(lv.lv_name, lv.vg_name, lv.uuid, lv.size, lv.attr,
+                      lv.segtype, None, None, None, None, [])
+               for lv in blockdev.lvm.lvs()]
+        return cls(pvs=pvs, vgs=vgs, lvs=lvs)
+
+def get_report():
+    """ Return a snapshot of the system's LVM configuration.
+
+        :rtype: :class:`LVMReport`
+
+        All PVs, VGs, LVs and LV segments are collected by a single run of
+        "lvm fullreport", through :data:`~.udev.backend` so that the report
+        can be recorded and replayed. If that is not possible (eg: with older
+        versions of lvm), libblockdev is used instead, which takes a separate
+        scan for each kind of object and does not provide LV relationships.
+    """
+    argv = ["lvm", "fullreport", "--all", "--reportformat", "json",
+            "--units", "b", "--nosuffix", "--config", _get_global_config()]
+    for (report, fields) in _REPORT_FIELDS.items():
+        argv.extend(["--configreport", report, "-o", ",".join(fields)])
+
+    try:
+        (rc, out) = udev.backend.run_program(argv)
+    except OSError as e:
+        log.info("failed to run lvm fullreport: %s", e)
+    else:
+        if rc == 0:
+            try:
+                return LVMReport.fromFullReport(out)
+            except (ValueError, KeyError, TypeError) as e:
+                log.info("failed to parse lvm fullreport output: %s", e)
+        else:
+            log.info("lvm fullreport failed with exit status %d", rc)
+
+    return LVMReport.fromBlockDev()
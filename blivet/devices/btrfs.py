@@ -23,10 +23,7 @@ import os
 import copy
 import tempfile
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from ..callstats import blockdev
 
 from ..devicelibs import btrfs
 from ..devicelibs import raid
@@ -289,6 +286,7 @@ class BTRFSVolumeDevice(BTRFSDevice, ContainerDevice, RaidDevice):
 
     def _setName(self, value):
         self._name = value  # name is not used outside of blivet
+        self._changed("name")
 
     def _setFormat(self, fmt):
         """ Set the Device's format. """
@@ -580,6 +578,11 @@ class BTRFSSubVolumeDevice(BTRFSDevice):
         blockdev.btrfs.delete_subvolume(mountpoint, self.name)
         self.volume._undo_temp_mount()
 
+    @property
+    def _extraDependents(self):
+        return [d for d in self.volume.descendants
+                if isinstance(d, BTRFSSnapShotDevice) and d._extraDependsOn(self)]
+
     def removeHook(self, modparent=True):
         if modparent:
             self.volume._removeSubVolume(self.name)
@@ -673,6 +676,6 @@ class BTRFSSnapShotDevice(BTRFSSubVolumeDevice):
         finally:
             self.volume._undo_temp_mount()
 
-    def dependsOn(self, dep):
+    def _extraDependsOn(self, dep):
         return (dep == self.source or
-                super(BTRFSSnapShotDevice, self).dependsOn(dep))
+                super(BTRFSSnapShotDevice, self)._extraDependsOn(dep))
@@ -21,6 +21,7 @@
 #
 
 import pprint
+import threading
 
 from .. import util
 from ..storage_log import log_method_call
@@ -30,13 +31,17 @@ log = logging.getLogger("blivet")
 
 from .lib import ParentList
 
+# guards the children sets and memoized closures of all devices, which actions
+# executed concurrently may update
+_topologyLock = threading.RLock()
+
 class Device(util.ObjectID):
     """ A generic device.
 
         Device instances know which devices they depend upon (parents
-        attribute). They do not know which devices depend upon them, but
-        they do know whether or not they have any dependent devices
-        (isleaf attribute).
+        attribute) and which devices are built directly upon them (children
+        attribute). They also know whether or not they have any dependent
+        devices in the device tree (isleaf attribute).
 
         A Device's setup method should set up all parent devices as well
         as the device itself. It should not run the resident format's
@@ -76,6 +81,10 @@ class Device(util.ObjectID):
         """
         util.ObjectID.__init__(self)
         self.kids = 0
+        self._changeHook = None
+        self._children = set()
+        self._ancestorCache = None
+        self._descendantCache = None
 
         # Copy only the validity check from _setName so we don't try to check a
         # bunch of inappropriate state properties during __init__ in subclasses
@@ -94,10 +103,14 @@ class Device(util.ObjectID):
             We can't do copy.deepcopy on parted objects, which is okay.
             For these parted objects, we just do a shallow copy.
         """
-        return util.variable_copy(self, memo,
-           omit=('node',),
+        new = util.variable_copy(self, memo,
+           omit=('node', '_changeHook'),
            shallow=('_partedPartition',))
 
+        # the observer belongs to whatever holds the original instance
+        new._changeHook = None
+        return new
+
     def __repr__(self):
         s = ("%(type)s instance (%(id)s) --\n"
              "  name = %(name)s  status = %(status)s"
@@ -120,26 +133,104 @@ class Device(util.ObjectID):
     def __unicode__(self):
         return util.unicodeize(self._toString())
 
+    def _changed(self, attr):
+        """ Notify this device's observer of a change to one of its attributes.
+
+            :param str attr: the name of the attribute that changed
+
+            The observer, if any, is a callable stored in :attr:`_changeHook`
+            that takes the device and the attribute name. It is set by the
+            :class:`~.devicetree.DeviceTree` containing the device so it can
+            keep its lookup indexes current.
+        """
+        hook = getattr(self, "_changeHook", None)
+        if hook is not None:
+            hook(self, attr)
+
     def _addParent(self, parent):
         """ Called before adding a parent to this device.
 
             See :attr:`~.ParentList.appendfunc`.
         """
-        parent.addChild()
+        with _topologyLock:
+            parent.addChild()
+            parent._children.add(self)
+            self._topologyChanged([parent])
 
     def _removeParent(self, parent):
         """ Called before removing a parent from this device.
 
             See :attr:`~.ParentList.removefunc`.
         """
-        parent.removeChild()
+        with _topologyLock:
+            parent.removeChild()
+            parent._children.discard(self)
+            self._topologyChanged([parent])
+
+    def _replaceParent(self, old, new):
+        """ Called after replacing one of this device's parents.
+
+            See :attr:`~.ParentList.replacefunc`.
+        """
+        with _topologyLock:
+            old._children.discard(self)
+            new._children.add(self)
+            self._topologyChanged([old, new])
+
+    def _linkChildren(self, linked):
+        """ Add this device to, or drop it from, its parents' children.
+
+            :param bool linked: whether the parents should list this device
+
+            Devices are dropped while they are not in a device tree, so that
+            their parents do not keep them alive or report them as children.
+        """
+        with _topologyLock:
+            for parent in self.parents:
+                if linked:
+                    parent._children.add(self)
+                else:
+                    parent._children.discard(self)
+
+            self._topologyChanged(self.parents)
+
+    def _topologyChanged(self, parents):
+        """ Invalidate the closures affected by a change to this device's
+            parents.
+
+            :param parents: the parents that were added or removed
+            :type parents: list of :class:`Device`
+
+            The ancestors of this device and of everything built upon it
+            change, as do the descendants of the parents and their ancestors.
+        """
+        self._clearClosure("_ancestorCache", "_children")
+        for parent in parents:
+            parent._clearClosure("_descendantCache", "parents")
+
+    def _clearClosure(self, cache, attr):
+        """ Drop the memoized closures over attr of this device and of the
+            devices reachable from it through attr.
+
+            :param str cache: the name of the attribute the closures are in
+            :param str attr: "parents" or "_children"
+        """
+        # A closure is only memoized along with those of the devices it
+        # contains, so there is no need to look beyond a device without one.
+        devices = [self]
+        while devices:
+            device = devices.pop()
+            if getattr(device, cache, None) is not None:
+                setattr(device, cache, None)
+                devices.extend(getattr(device, attr))
 
     def _initParentList(self):
         """ Initialize this instance's parent list. """
         if not hasattr(self, "_parents"):
             # pylint: disable=attribute-defined-outside-init
             self._parents = ParentList(appendfunc=self._addParent,
-                                       removefunc=self._removeParent)
+                                       removefunc=self._removeParent,
+                                       replacefunc=self._replaceParent)
 
         # iterate over a copy of the parent list because we are altering it in
         # the for-cycle
@@ -158,6 +249,18 @@ class Device(util.ObjectID):
     parents = property(_getParentList, _setParentList,
                        doc="devices upon which this device is built")
 
+    @property
+    def children(self):
+        """ Devices built directly upon this device.
+
+            This includes any device whose parent list contains this device,
+            unless it was removed from a device tree. Use
+            :meth:`~.devicetree.DeviceTree.getChildren` for the children
+            within a tree.
+        """
+        with _topologyLock:
+            return list(self._children)
+
     @property
     def dict(self):
         d =  {"type": self.type, "name": self.name,
@@ -222,15 +325,55 @@ class Device(util.ObjectID):
             :rtype: bool
         """
         # XXX does a device depend on itself?
-        if dep in self.parents:
+        ancestors = self._getClosure("_ancestorCache", "parents")
+        if dep is not self and dep in ancestors:
             return True
 
-        for parent in self.parents:
-            if parent.dependsOn(dep):
-                return True
+        return any(a._extraDependsOn(dep) for a in ancestors)
+
+    def _extraDependsOn(self, dep):
+        """ Return True if this device depends on dep other than by being
+            built upon it.
 
+            :param dep: the other device
+            :type dep: :class:`Device`
+            :rtype: bool
+
+            Subclasses that override this should also override
+            :attr:`_extraDependents`.
+        """
+        # pylint: disable=unused-argument
         return False
 
+    @property
+    def _extraDependents(self):
+        """ Devices whose :meth:`_extraDependsOn` is True for this device. """
+        return []
+
+    def _getClosure(self, cache, attr):
+        """ Return the transitive closure of this device over attr.
+
+            :param str cache: the name of the attribute to memoize the result in
+            :param str attr: "parents" or "_children"
+            :returns: this device and all devices reachable through attr
+            :rtype: frozenset of :class:`Device`
+
+            The result is memoized until the parents of a device in it
+            change (see :meth:`_topologyChanged`).
+        """
+        closure = getattr(self, cache, None)
+        if closure is not None:
+            return closure
+
+        with _topologyLock:
+            closure = set([self])
+            for device in getattr(self, attr):
+                closure.update(device._getClosure(cache, attr))
+
+            closure = frozenset(closure)
+            setattr(self, cache, closure)
+            return closure
+
     def dracutSetupArgs(self):
         return set()
 
@@ -246,6 +389,7 @@ class Device(util.ObjectID):
         if not self.isNameValid(value):
             raise ValueError("%s is not a valid name for this device" % value)
         self._name = value
+        self._changed("name")
 
     name = property(lambda s: s._getName(),
                     lambda s, v: s._setName(v),
@@ -269,10 +413,16 @@ class Device(util.ObjectID):
     @property
     def ancestors(self):
         """ A list of all of this device's ancestors, including itself. """
-        l = set([self])
-        for p in [d for d in self.parents if d not in l]:
-            l.update(set(p.ancestors))
-        return list(l)
+        return list(self._getClosure("_ancestorCache", "parents"))
+
+    @property
+    def descendants(self):
+        """ A list of all devices built upon this device, directly or
+            indirectly, including itself.
+
+            Like :attr:`children`, this is not limited to a device tree.
+        """
+        return list(self._getClosure("_descendantCache", "_children"))
 
     @property
     def packages(self):
@@ -20,10 +20,7 @@
 # Red Hat Author(s): David Lehman <dlehman@redhat.com>
 #
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from ..callstats import blockdev
 
 import os
 
@@ -31,6 +28,7 @@ from .. import errors
 from .. import util
 from ..storage_log import log_method_call
 from .. import udev
+from ..statuscache import statusCache
 from ..tasks import availability
 
 import logging
@@ -105,6 +103,9 @@ class DMDevice(StorageDevice):
 
     @property
     def status(self):
+        return statusCache.get(self, self._getStatus)
+
+    def _getStatus(self):
         try:
             return blockdev.dm.map_exists(self.mapName, True, True)
         except blockdev.DMError as e:
@@ -108,7 +108,8 @@ class ParentList(object):
             x in ml
             x = ml[i]   # not ml[i] = x
     """
-    def __init__(self, items=None, appendfunc=None, removefunc=None):
+    def __init__(self, items=None, appendfunc=None, removefunc=None,
+                 replacefunc=None):
         """
             :keyword items: initial contents
             :type items: any iterable
@@ -116,6 +117,8 @@ class ParentList(object):
             :type appendfunc: callable
             :keyword removefunc: a function to call before removing an item
             :type removefunc: callable
+            :keyword replacefunc: a function to call after replacing an item
+            :type replacefunc: callable
 
             appendfunc and removefunc should take the item to be added or
             removed and perform any checks or other processing. The appropriate
@@ -125,6 +128,9 @@ class ParentList(object):
             to the function. While this is not optimal for general-purpose use,
             it is ideal for the intended use as part of :class:`~.Device`. The
             functions themselves should not modify the :class:`~.ParentList`.
+
+            replacefunc takes the replaced item and its replacement. It is
+            only meant for bookkeeping and cannot prevent the replacement.
         """
         self.items = list()
         if items:
@@ -136,6 +142,14 @@ class ParentList(object):
         self.removefunc = removefunc or (lambda i: True)
         """ a function to call before removing an item """
 
+        self.replacefunc = replacefunc or (lambda x, y: True)
+        """ a function to call after replacing an item """
+
+    def __copy__(self):
+        return ParentList(items=self.items, appendfunc=self.appendfunc,
+                          removefunc=self.removefunc,
+                          replacefunc=self.replacefunc)
+
     def __iter__(self):
         return iter(self.items)
 
@@ -165,7 +179,8 @@ class ParentList(object):
         self.items.remove(y)
 
     def replace(self, x, y):
-        """ Replace the first instance of x with y, bypassing callbacks.
+        """ Replace the first instance of x with y, bypassing the append and
+            remove callbacks.
 
             .. note::
 
@@ -178,3 +193,4 @@ class ParentList(object):
 
         idx = self.items.index(x)
         self.items[idx] = y
+        self.replacefunc(x, y)
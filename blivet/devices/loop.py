@@ -19,10 +19,7 @@
 # Red Hat Author(s): David Lehman <dlehman@redhat.com>
 #
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from ..callstats import blockdev
 
 import os
 
@@ -68,6 +65,7 @@ class LoopDevice(StorageDevice):
 
     def _setName(self, value):
         self._name = value  # actual name is set by losetup
+        self._changed("name")
 
     def updateName(self):
         """ Update this device's name. """
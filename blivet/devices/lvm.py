@@ -27,10 +27,7 @@ import pprint
 import re
 import os
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from ..callstats import blockdev
 
 # device backend modules
 from ..devicelibs import lvm
@@ -40,6 +37,7 @@ from .. import util
 from ..storage_log import log_method_call
 from .. import udev
 from ..size import Size, KiB, MiB, ROUND_UP, ROUND_DOWN
+from ..statuscache import statusCache
 from ..tasks import availability
 
 import logging
@@ -196,6 +194,9 @@ class LVMVolumeGroupDevice(ContainerDevice):
     @property
     def status(self):
         """ The device's status (True means active). """
+        return statusCache.get(self, self._getStatus)
+
+    def _getStatus(self):
         if not self.exists:
             return False
 
@@ -772,6 +773,10 @@ class LVMLogicalVolumeDevice(DMDevice):
         return (super(LVMLogicalVolumeDevice, self).isleaf and
                 not non_thin_snapshots)
 
+    @property
+    def _extraDependents(self):
+        return [s for s in self.snapshots if s._extraDependsOn(self)]
+
     @property
     def direct(self):
         """ Is this device directly accessible? """
@@ -1324,10 +1329,10 @@ class LVMSnapShotDevice(LVMSnapShotBase, LVMLogicalVolumeDevice):
     def _getPartedDevicePath(self):
         return "%s-cow" % self.path
 
-    def dependsOn(self, dep):
+    def _extraDependsOn(self, dep):
         # pylint: disable=bad-super-call
         return (self.origin == dep or
-                super(LVMSnapShotBase, self).dependsOn(dep))
+                super(LVMSnapShotBase, self)._extraDependsOn(dep))
 
     def readCurrentSize(self):
         log_method_call(self, exists=self.exists, path=self.path,
@@ -1609,10 +1614,10 @@ class LVMThinSnapShotDevice(LVMSnapShotBase, LVMThinLogicalVolumeDevice):
         # A snapshot's format exists as soon as the snapshot has been created.
         self.format.exists = True
 
-    def dependsOn(self, dep):
+    def _extraDependsOn(self, dep):
         # once a thin snapshot exists it no longer depends on its origin
         return ((self.origin == dep and not self.exists) or
-                super(LVMThinSnapShotDevice, self).dependsOn(dep))
+                super(LVMThinSnapShotDevice, self)._extraDependsOn(dep))
 
 class LVMCache(Cache):
     """Class providing the cache-related functionality of a cached LV"""
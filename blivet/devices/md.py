@@ -22,10 +22,7 @@
 import os
 import six
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from ..callstats import blockdev
 
 from ..devicelibs import mdraid, raid
 
@@ -35,6 +32,7 @@ from ..flags import flags
 from ..storage_log import log_method_call
 from .. import udev
 from ..size import Size
+from ..statuscache import statusCache
 from ..tasks import availability
 from ..util import open # pylint: disable=redefined-builtin
 
@@ -371,6 +369,9 @@ class MDRaidArrayDevice(ContainerDevice, RaidDevice):
                 True    the device is open and ready for use
                 False   the device is not open
         """
+        return statusCache.get(self, self._getStatus)
+
+    def _getStatus(self):
         # check the status in sysfs
         status = False
         if not self.exists:
@@ -23,10 +23,7 @@ import os
 import parted
 import _ped
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from ..callstats import blockdev
 
 from .. import errors
 from .. import util
@@ -155,7 +152,7 @@ class PartitionDevice(StorageDevice):
 
         if self.exists and not flags.testing:
             log.debug("looking up parted Partition: %s", self.path)
-            self._partedPartition = self.disk.format.partedDisk.getPartitionByPath(self.path)
+            self._partedPartition = self.disk.format.getPartitionByPath(self.path)
             if not self._partedPartition:
                 raise errors.DeviceError("cannot find parted partition instance", self.name)
 
@@ -375,21 +372,35 @@ class PartitionDevice(StorageDevice):
                       lambda d,w: d._setWeight(w))
 
     def _setName(self, value):
+        if value == self._name:
+            return
+
         self._name = value  # actual name setting is done by parted
+        self._changed("name")
 
     def updateName(self):
         if self.partedPartition is None:
             self.name = self.req_name
+        elif self.disk is not None and self.disk.partitioned:
+            self.name = devicePathToName(self.disk.format.partitionPath(self.partedPartition))
         else:
             self.name = devicePathToName(self.partedPartition.path)
 
-    def dependsOn(self, dep):
-        """ Return True if this device depends on dep. """
+    def _extraDependsOn(self, dep):
+        """ Return True if this is a logical partition within dep. """
         if isinstance(dep, PartitionDevice) and dep.isExtended and \
            self.isLogical and self.disk == dep.disk:
             return True
 
-        return Device.dependsOn(self, dep)
+        return Device._extraDependsOn(self, dep)
+
+    @property
+    def _extraDependents(self):
+        if not self.isExtended or self.disk is None:
+            return []
+
+        return [p for p in self.disk.children
+                if isinstance(p, PartitionDevice) and p._extraDependsOn(self)]
 
     @property
     def isleaf(self):
@@ -562,7 +573,7 @@ class PartitionDevice(StorageDevice):
             # If a udev device is created with the watch option, then
             # a change uevent is synthesized and we need to wait for
             # things to settle.
-            udev.settle()
+            udev.settle(devices=[self.disk.sysfsPath])
 
     def _create(self):
         """ Create the device. """
@@ -575,7 +586,7 @@ class PartitionDevice(StorageDevice):
         try:
             self.disk.format.commit()
         except errors.DiskLabelCommitError:
-            part = self.disk.format.partedDisk.getPartitionByPath(self.path)
+            part = self.disk.format.getPartitionByPath(self.path)
             self.disk.format.removePartition(part)
             raise
 
@@ -637,11 +648,11 @@ class PartitionDevice(StorageDevice):
         log_method_call(self, self.name, status=self.status)
         self._preDestroy()
 
-        # partedDisk has been restored to _origPartedDisk, so
+        # partedDisk has been restored to the original partition table, so
         # recalculate resize geometry because we may have new
         # partitions on the disk, which could change constraints
         partedDisk = self.disk.format.partedDisk
-        partition = partedDisk.getPartitionByPath(self.path)
+        partition = self.disk.format.getPartitionByPath(self.path)
         (constraint, geometry) = self._computeResize(partition)
 
         partedDisk.setPartitionGeometry(partition=partition,
@@ -672,7 +683,7 @@ class PartitionDevice(StorageDevice):
                                         self.partedPartition.geometry.start,
                                         self.partedPartition.geometry.end,
                                         self.partedPartition.type)
-            self.partedPartition = self.disk.originalFormat.partedDisk.getPartitionByPath(self.path)
+            self.partedPartition = self.disk.originalFormat.getPartitionByPath(self.path)
             raise
 
         if self.disk.format.exists and \
@@ -680,7 +691,7 @@ class PartitionDevice(StorageDevice):
            self.disk.format.partedDisk != self.disk.originalFormat.partedDisk:
             # If the new/current disklabel is the same as the original one, we
             # have to duplicate the removal on the other copy of the DiskLabel.
-            part = self.disk.format.partedDisk.getPartitionByPath(self.path)
+            part = self.disk.format.getPartitionByPath(self.path)
             self.disk.format.removePartition(part)
             self.disk.format.commit()
 
@@ -31,6 +31,7 @@ from ..storage_log import log_method_call
 from .. import udev
 from ..formats import getFormat, DeviceFormat
 from ..size import Size
+from ..statuscache import statusCache
 from ..util import open # pylint: disable=redefined-builtin
 
 import logging
@@ -181,6 +182,35 @@ class StorageDevice(Device):
         """ The device itself, or when encrypted, the backing device. """
         return self
 
+    def __deepcopy__(self, memo):
+        new = super(StorageDevice, self).__deepcopy__(memo)
+
+        # the copied format's observer was dropped along with ours
+        new._format._changeHook = new._formatChanged
+        return new
+
+    def _getUUID(self):
+        return self._uuid
+
+    def _setUUID(self, value):
+        self._uuid = value
+        self._changed("uuid")
+
+    uuid = property(lambda s: s._getUUID(),
+                    lambda s, v: s._setUUID(v),
+                    doc="This device's UUID (device -- not fs)")
+
+    def _getSysfsPath(self):
+        return self._sysfsPath
+
+    def _setSysfsPath(self, value):
+        self._sysfsPath = value
+        self._changed("sysfsPath")
+
+    sysfsPath = property(lambda s: s._getSysfsPath(),
+                         lambda s, v: s._setSysfsPath(v),
+                         doc="This device's sysfs path")
+
     def _setName(self, value):
         """Set the device's name.
 
@@ -390,6 +420,7 @@ class StorageDevice(Device):
 
     def _postSetup(self):
         """ Perform post-setup operations. """
+        self._statusChanged()
         udev.settle()
         self.updateSysfsPath()
         # the device may not be set up when we want information about it
@@ -414,7 +445,7 @@ class StorageDevice(Device):
             self.originalFormat.teardown()
         if self.format.exists:
             self.format.teardown()
-        udev.settle()
+        udev.settle(devices=[self.sysfsPath])
         return True
 
     def _teardown(self, recursive=None):
@@ -433,6 +464,7 @@ class StorageDevice(Device):
 
     def _postTeardown(self, recursive=None):
         """ Perform post-teardown operations. """
+        self._statusChanged()
         if recursive:
             self.teardownParents(recursive=recursive)
 
@@ -459,10 +491,11 @@ class StorageDevice(Device):
 
     def _postCreate(self):
         """ Perform post-create operations. """
+        self._statusChanged()
         self.exists = True
         self.setup()
         self.updateSysfsPath()
-        udev.settle()
+        udev.settle(devices=[self.sysfsPath])
 
         # make sure that targetSize is updated to reflect the actual size
         self.updateSize()
@@ -495,6 +528,7 @@ class StorageDevice(Device):
 
     def _postDestroy(self):
         """ Perform post-destruction operations. """
+        self._statusChanged()
         self.exists = False
 
     #
@@ -529,6 +563,8 @@ class StorageDevice(Device):
         for parent in self.parents:
             parent.removeChild()
 
+        self._linkChildren(False)
+
     def addHook(self, new=True):
         """ Perform actions related to adding a device to the devicetree.
 
@@ -542,13 +578,18 @@ class StorageDevice(Device):
             for p in self.parents:
                 p.addChild()
 
+            self._linkChildren(True)
+
     #
     # size manipulations
     #
     def _getSize(self):
         """ Get the device's size, accounting for pending changes. """
         size = self._size
-        if self.exists and self.resizable and self.targetSize != Size(0):
+        # only a resize can have changed the target size, so resizable (which
+        # may mean probing the format) only needs checking in that case
+        if self.exists and self.targetSize not in (Size(0), size) and \
+           self.resizable:
             size = self.targetSize
 
         return size
@@ -586,9 +627,9 @@ class StorageDevice(Device):
         log_method_call(self, exists=self.exists, path=self.path,
                         sysfsPath=self.sysfsPath)
         size = Size(0)
-        if self.exists and os.path.exists(self.path) and \
-           os.path.isdir(self.sysfsPath):
-            blocks = int(util.get_sysfs_attr(self.sysfsPath, "size"))
+        if self.exists and udev.backend.exists(self.path) and \
+           udev.backend.isdir(self.sysfsPath):
+            blocks = int(udev.get_sysfs_attr(self.sysfsPath, "size"))
             size = Size(blocks * LINUX_SECTOR_SIZE)
 
         return size
@@ -663,6 +704,15 @@ class StorageDevice(Device):
             return False
         return os.access(self.path, os.W_OK)
 
+    def _statusChanged(self):
+        """ Forget the cached status of this device and related devices.
+
+            Called whenever this device has been set up, torn down, created
+            or destroyed, any of which can change the status of the devices
+            above and below it too.
+        """
+        statusCache.invalidate(self.ancestors + self.descendants)
+
     #
     # format manipulations
     #
@@ -703,9 +753,19 @@ class StorageDevice(Device):
             elif fmt.minSize and fmt.minSize > self.size:
                 raise errors.DeviceError("device is too small for new format")
 
+        if getattr(self._format, "_changeHook", None) == self._formatChanged:
+            self._format._changeHook = None
+
         self._format = fmt
         self._format.device = self.path
+        self._format._changeHook = self._formatChanged
         self._updateNetDevMountOption()
+        self._changed("format")
+
+    def _formatChanged(self, fmt, attr):
+        """ Relay changes to this device's format to our own observer. """
+        # pylint: disable=unused-argument
+        self._changed("format")
 
     def _updateNetDevMountOption(self):
         """ Fix mount options to include or exclude _netdev as appropriate. """
@@ -22,18 +22,18 @@
 
 import os
 import re
+import itertools
+import threading
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from .callstats import blockdev
 
 from .actionlist import ActionList
 from .errors import DeviceError, DeviceTreeError, StorageError
-from .deviceaction import ActionDestroyDevice, ActionDestroyFormat
-from .devices import BTRFSDevice, DASDDevice, NoDevice, PartitionDevice
+from .deviceaction import ActionDestroyDevice, ActionDestroyFormat, DeviceAction
+from .devices import BTRFSDevice, DASDDevice, Device, NoDevice, ParentList, PartitionDevice
 from .devices import LVMLogicalVolumeDevice, LVMVolumeGroupDevice
 from . import formats, arch
+from .formats.disklabel import DiskLabel
 from .devicelibs import lvm
 from .devicelibs import edd
 from . import udev
@@ -48,6 +48,250 @@ log = logging.getLogger("blivet")
 
 _LVM_DEVICE_CLASSES = (LVMLogicalVolumeDevice, LVMVolumeGroupDevice)
 
+def _actionTouchesLVM(action):
+    """ Whether an action can change the system's LVM configuration. """
+    if isinstance(action.device, _LVM_DEVICE_CLASSES):
+        return True
+
+    fmts = (action.format, action.device.format, getattr(action, "origFormat", None))
+    return any(fmt is not None and fmt.type == "lvmpv" for fmt in fmts)
+
+class _DeviceIndex(object):
+    """ Hash indexes over the devices in a :class:`DeviceTree`.
+
+        Devices are indexed by id, name, path, sysfs path, UUID (device and
+        format) and format label. The index registers itself as the observer
+        of each device it contains (see :meth:`~.devices.Device._changed`), so
+        renames and changes to a device's UUID, sysfs path or formatting are
+        reflected immediately. Since actions may be executed concurrently, the
+        index is guarded by a lock.
+
+        The index also remembers the position of each device in the tree's
+        device list (hidden devices sort after all visible devices) so that
+        lookups can select the same device a scan of that list would.
+    """
+    attrs = ("name", "path", "sysfsPath", "uuid", "label")
+
+    def __init__(self):
+        self._devices = {}
+        self._hidden = set()
+        self._order = {}
+        self._keys = {}
+        self._maps = dict((attr, {}) for attr in self.attrs)
+        self._counter = itertools.count()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _getKeys(device):
+        """ Return a dict of attribute name to a set of index keys. """
+        fmt = getattr(device, "format", None)
+        keys = {"name": set([device.name]),
+                "path": set([getattr(device, "path", None)]),
+                "sysfsPath": set([getattr(device, "sysfsPath", None)]),
+                "uuid": set([getattr(device, "uuid", None),
+                             getattr(fmt, "uuid", None)]),
+                "label": set([getattr(fmt, "label", None)])}
+        for values in keys.values():
+            values.discard(None)
+            values.discard("")
+
+        return keys
+
+    def _link(self, device):
+        keys = self._getKeys(device)
+        for (attr, values) in keys.items():
+            index = self._maps[attr]
+            for value in values:
+                index.setdefault(value, set()).add(device.id)
+
+        self._keys[device.id] = keys
+
+    def _unlink(self, device):
+        keys = self._keys.pop(device.id, {})
+        for (attr, values) in keys.items():
+            index = self._maps[attr]
+            for value in values:
+                ids = index.get(value)
+                if ids is None:
+                    continue
+
+                ids.discard(device.id)
+                if not ids:
+                    del index[value]
+
+    def __contains__(self, device):
+        return self._devices.get(device.id) is device
+
+    def add(self, device, hidden=False):
+        """ Add a device to the index.
+
+            :param device: the device to add
+            :type device: :class:`~.devices.Device`
+            :keyword bool hidden: whether the device is hidden
+
+            A device that is already indexed is moved to the end of the
+            visible or hidden device list, as appropriate.
+        """
+        with self._lock:
+            if device in self:
+                self._unlink(device)
+
+            self._devices[device.id] = device
+            if hidden:
+                self._hidden.add(device.id)
+            else:
+                self._hidden.discard(device.id)
+
+            self._order[device.id] = (hidden, next(self._counter))
+            self._link(device)
+            device._changeHook = self._deviceChanged
+
+    def remove(self, device):
+        """ Remove a device from the index. """
+        with self._lock:
+            if device not in self:
+                return
+
+            self._unlink(device)
+            del self._devices[device.id]
+            del self._order[device.id]
+            self._hidden.discard(device.id)
+            if device._changeHook == self._deviceChanged:
+                device._changeHook = None
+
+    def update(self, device):
+        """ Recompute the index keys for a device. """
+        with self._lock:
+            if device not in self:
+                return
+
+            self._unlink(device)
+            self._link(device)
+
+    def _deviceChanged(self, device, attr):
+        """ Observer for changes to indexed devices. """
+        with self._lock:
+            self.update(device)
+            if attr != "name":
+                return
+
+            # the names and paths of some devices are derived from those of
+            # their parents (eg: lvs, btrfs volumes)
+            seen = set([device.id])
+            parents = [device]
+            while parents:
+                parent = parents.pop()
+                for child in parent.children:
+                    if child.id not in seen and child in self:
+                        seen.add(child.id)
+                        self.update(child)
+                        parents.append(child)
+
+    def isHidden(self, device):
+        with self._lock:
+            return device.id in self._hidden
+
+    def position(self, device):
+        """ Return a sort key reflecting the device's place in the tree. """
+        with self._lock:
+            return self._order[device.id]
+
+    def getByID(self, id_num):
+        return self._devices.get(id_num)
+
+    def find(self, attr, key):
+        """ Return the devices indexed under key for attr, in list order.
+
+            :param str attr: one of :attr:`attrs`
+            :param key: the value to look up
+            :returns: the matching devices, in device list order
+            :rtype: list of :class:`~.devices.Device`
+        """
+        with self._lock:
+            ids = self._maps[attr].get(key, ())
+            return sorted((self._devices[i] for i in ids), key=self.position)
+
+class DeviceTreeCheckpoint(object):
+    """ The recorded state of a :class:`DeviceTree`, for rolling back to.
+
+        The state of each device, format and action that can be reached from
+        the tree (visible and hidden devices, registered and completed
+        actions) is recorded one level deep, along with the tree's device
+        lists and any other objects the creator asks for. Unlike a deep copy,
+        no new device instances are created: rolling back restores the
+        recorded objects in place, and objects created since the checkpoint
+        are simply dropped from the tree.
+    """
+    _treeAttrs = ("_devices", "_hidden", "names")
+    _trackedTypes = (Device, formats.DeviceFormat, DeviceAction)
+
+    def __init__(self, tree, objects=None):
+        """
+            :param tree: the tree to record
+            :type tree: :class:`DeviceTree`
+            :keyword objects: other objects whose state to record
+            :type objects: list
+        """
+        self.tree = tree
+        self._treeState = dict((attr, list(getattr(tree, attr)))
+                               for attr in self._treeAttrs)
+
+        roots = list(objects or [])
+        roots.append(tree.actions)
+        roots.extend(tree._devices)
+        roots.extend(tree._hidden)
+        roots.extend(tree.actions)
+        roots.extend(tree.actions._completed_actions)
+
+        self._states = []
+        seen = set()
+        while roots:
+            obj = roots.pop()
+            if id(obj) in seen:
+                continue
+
+            seen.add(id(obj))
+            self._states.append((obj, self._recordState(obj)))
+            roots.extend(self._trackedValues(obj, seen))
+
+    def _trackedValues(self, obj, seen):
+        """ Return devices, formats and actions referred to by obj. """
+        for value in obj.__dict__.values():
+            if isinstance(value, dict):
+                values = value.values()
+            elif isinstance(value, (list, tuple, set, ParentList)):
+                values = value
+            else:
+                values = [value]
+
+            for item in values:
+                if isinstance(item, self._trackedTypes) and id(item) not in seen:
+                    yield item
+
+    @staticmethod
+    def _recordState(obj):
+        if isinstance(obj, DiskLabel):
+            # parted disks are modified in place by partition allocation
+            return util.object_state(obj, duplicate=("_partedDisk",))
+        elif isinstance(obj, Device):
+            return util.object_state(obj, shallow=("_parents",))
+        else:
+            return util.object_state(obj)
+
+    def restore(self):
+        """ Restore the recorded state. """
+        for (obj, state) in self._states:
+            util.restore_object_state(obj, state)
+
+        for (attr, value) in self._treeState.items():
+            setattr(self.tree, attr, list(value))
+
+        # the parted partitions belong to the restored parted disks
+        for (obj, _state) in self._states:
+            if isinstance(obj, PartitionDevice) and obj._partedPartition and \
+               isinstance(obj.disk.format, DiskLabel):
+                obj._partedPartition = obj.disk.format.getPartitionByPath(obj.path)
+
 class DeviceTree(object):
     """ A quasi-tree that represents the devices in the system.
 
@@ -91,6 +335,10 @@ class DeviceTree(object):
         # internal data members
         self._devices = []
         self._actions = ActionList()
+        self._index = _DeviceIndex()
+
+        # uevent monitor (see startMonitor), kept across resets
+        self._monitor = getattr(self, "_monitor", None)
 
         # a list of all device names we encounter
         self.names = []
@@ -109,6 +357,57 @@ class DeviceTree(object):
                                     iscsi=iscsi,
                                     dasd=dasd)
 
+    def __deepcopy__(self, memo):
+        new = util.variable_copy(self, memo, omit=('_index', '_monitor'))
+
+        # the copied devices are not observed by anything yet
+        new._rebuildIndex()
+
+        # only the original tree receives uevents
+        new._monitor = None
+        return new
+
+    def checkpoint(self, objects=None):
+        """ Record the state of the tree so it can be rolled back to later.
+
+            :keyword objects: other objects whose state to record
+            :type objects: list
+            :returns: the recorded state, for :meth:`rollback`
+            :rtype: :class:`DeviceTreeCheckpoint`
+
+            This is much cheaper than copying the tree. It is intended for
+            trying out changes that may have to be discarded.
+        """
+        return DeviceTreeCheckpoint(self, objects=objects)
+
+    def rollback(self, checkpoint):
+        """ Return the tree to the state recorded in a checkpoint.
+
+            :param checkpoint: a checkpoint of this tree
+            :type checkpoint: :class:`DeviceTreeCheckpoint`
+
+            A checkpoint can be rolled back to any number of times.
+        """
+        if checkpoint.tree is not self:
+            raise DeviceTreeError("checkpoint belongs to a different tree")
+
+        checkpoint.restore()
+        self._rebuildIndex()
+        self._actions._rebuildIndex()
+
+    def _rebuildIndex(self):
+        """ Re-create the lookup indexes from the device and hidden lists.
+
+            This is only needed after replacing :attr:`_devices` or
+            :attr:`_hidden` directly.
+        """
+        self._index = _DeviceIndex()
+        for device in self._devices:
+            self._index.add(device)
+
+        for device in self._hidden:
+            self._index.add(device, hidden=True)
+
     @property
     def actions(self):
         return self._actions
@@ -152,25 +451,32 @@ class DeviceTree(object):
         return self._populator.diskImages
 
     @property
-    def pvInfo(self):
-        if self._pvs_cache is None:
-            pvs = blockdev.lvm.pvs()
-            self._pvs_cache = dict((pv.pv_name, pv) for pv in pvs) # pylint: disable=attribute-defined-outside-init
+    def lvmReport(self):
+        """ A snapshot of the system's LVM configuration.
+
+            :rtype: :class:`~.devicelibs.lvm.LVMReport`
 
-        return self._pvs_cache
+            The snapshot is taken the first time it is needed and kept until
+            :meth:`dropLVMCache` is called.
+        """
+        if self._lvm_report is None:
+            self._lvm_report = lvm.get_report() # pylint: disable=attribute-defined-outside-init
+
+        return self._lvm_report
 
     @property
-    def lvInfo(self):
-        if self._lvs_cache is None:
-            lvs = blockdev.lvm.lvs()
-            self._lvs_cache = dict(("%s-%s" % (lv.vg_name, lv.lv_name), lv) for lv in lvs) # pylint: disable=attribute-defined-outside-init
+    def pvInfo(self):
+        """ A dict of PV info keyed by device path. """
+        return self.lvmReport.pvs
 
-        return self._lvs_cache
+    @property
+    def lvInfo(self):
+        """ A dict of LV info keyed by full LV name (eg: "vg-lv"). """
+        return self.lvmReport.lvs
 
     def dropLVMCache(self):
         """ Drop cached lvm information. """
-        self._pvs_cache = None # pylint: disable=attribute-defined-outside-init
-        self._lvs_cache = None # pylint: disable=attribute-defined-outside-init
+        self._lvm_report = None # pylint: disable=attribute-defined-outside-init
 
     def _addDevice(self, newdev, new=True):
         """ Add a device to the tree.
@@ -181,17 +487,19 @@ class DeviceTree(object):
             Raise ValueError if the device's identifier is already
             in the list.
         """
-        if newdev.uuid and newdev.uuid in [d.uuid for d in self._devices] and \
-           not isinstance(newdev, NoDevice):
+        if newdev.uuid and not isinstance(newdev, NoDevice) and \
+           any(d.uuid == newdev.uuid and not self._index.isHidden(d)
+               for d in self._index.find("uuid", newdev.uuid)):
             raise ValueError("device is already in tree")
 
         # make sure this device's parent devices are in the tree already
         for parent in newdev.parents:
-            if parent not in self._devices:
+            if not self._isInTree(parent):
                 raise DeviceTreeError("parent device not in tree")
 
         newdev.addHook(new=new)
         self._devices.append(newdev)
+        self._index.add(newdev)
 
         # don't include "req%d" partition names
         if ((newdev.type != "partition" or
@@ -217,7 +525,7 @@ class DeviceTree(object):
 
                 Only leaves may be removed.
         """
-        if dev not in self._devices:
+        if not self._isInTree(dev):
             raise ValueError("Device '%s' not in tree" % dev.name)
 
         if not dev.isleaf and not force:
@@ -237,6 +545,7 @@ class DeviceTree(object):
                         device.updateName()
 
         self._devices.remove(dev)
+        self._index.remove(dev)
         if dev.name in self.names and getattr(dev, "complete", True):
             self.names.remove(dev.name)
         log.info("removed %s %s (id %d) from device tree", dev.type,
@@ -304,10 +613,10 @@ class DeviceTree(object):
             get here.
         """
         if not (action.isCreate and action.isDevice) and \
-           action.device not in self._devices:
+           not self._isInTree(action.device):
             raise DeviceTreeError("device is not in the tree")
         elif (action.isCreate and action.isDevice):
-            if action.device in self._devices:
+            if self._isInTree(action.device):
                 raise DeviceTreeError("device is already in the tree")
 
         if action.isCreate and action.isDevice:
@@ -375,9 +684,68 @@ class DeviceTree(object):
                                   devid=devid)
 
     def processActions(self, callbacks=None, dryRun=False):
-        self.actions.process(devices=self.devices,
-                             dryRun=dryRun,
-                             callbacks=callbacks)
+        touches_lvm = any(_actionTouchesLVM(a) for a in self.actions)
+        try:
+            self.actions.process(devices=self.devices,
+                                 dryRun=dryRun,
+                                 callbacks=callbacks)
+        finally:
+            if touches_lvm and not dryRun:
+                self.dropLVMCache()
+
+            if self._monitor and not dryRun:
+                # the tree already reflects the changes we just made, including
+                # the intermediate states the queued events describe
+                udev.get_events(self._monitor)
+                self._populator.recordUdevFormats()
+
+    @property
+    def monitoring(self):
+        """ Whether the tree is being kept up to date using uevents. """
+        return self._monitor is not None
+
+    def startMonitor(self):
+        """ Start receiving uevents for block devices.
+
+            Once started, :meth:`processEvents` updates the tree to reflect
+            devices that have been added, removed or changed since the tree
+            was populated, without rescanning the whole system. Monitoring
+            continues across calls to :meth:`reset`.
+        """
+        if self._monitor:
+            return
+
+        self._monitor = udev.get_monitor()
+        self._populator.recordUdevFormats()
+
+    def stopMonitor(self):
+        """ Stop receiving uevents. Pending events are discarded. """
+        self._monitor = None
+
+    def fileno(self):
+        """ The uevent monitor's file descriptor, for use with select/poll. """
+        if not self._monitor:
+            raise DeviceTreeError("uevent monitoring is not active")
+
+        return self._monitor.fileno()
+
+    def processEvents(self, timeout=0):
+        """ Apply pending uevents to the tree.
+
+            :keyword timeout: seconds to wait for an event (None to block)
+            :type timeout: float or NoneType
+            :returns: the number of events processed
+            :rtype: int
+        """
+        if not self._monitor:
+            raise DeviceTreeError("uevent monitoring is not active")
+
+        events = udev.get_events(self._monitor, timeout=timeout)
+        if events:
+            self._populator.handleUdevEvents(events)
+            self._hideIgnoredDisks()
+
+        return len(events)
 
     def getDependentDevices(self, dep, hidden=False):
         """ Return a list of devices that depend on dep.
@@ -388,24 +756,25 @@ class DeviceTree(object):
             :type dep: :class:`~.devices.StorageDevice`
             :keyword bool hidden: include hidden devices in search
         """
-        dependents = []
         log_method_call(self, dep=dep, hidden=hidden)
 
-        # don't bother looping looking for dependents if this is a leaf device
+        # don't bother looking for dependents if this is a leaf device
         # XXX all hidden devices are leaves
         if dep.isleaf and not hidden:
             log.debug("dep is a leaf")
-            return dependents
-
-        devices = self._devices[:]
-        if hidden:
-            devices.extend(self._hidden)
-
-        for device in devices:
-            log.debug("checking if %s depends on %s", device.name, dep.name)
-            if device.dependsOn(dep):
-                dependents.append(device)
-
+            return []
+
+        # a device depends on dep if it is built upon dep or upon a device
+        # that depends on dep other than by being built upon it
+        dependents = set(dep.descendants)
+        for device in dep._extraDependents:
+            dependents.update(device.descendants)
+
+        dependents.discard(dep)
+        dependents = [d for d in dependents
+                      if d in self._index and (hidden or not self._index.isHidden(d))]
+        dependents.sort(key=self._index.position)
+        log.debug("devices depending on %s: %s", dep.name, [d.name for d in dependents])
         return dependents
 
     def getRelatedDisks(self, disk):
@@ -459,7 +828,7 @@ class DeviceTree(object):
             Therefore, _removeDevice() is invoked with the force parameter
             set to True, to skip the isleaf check.
         """
-        if device in self._hidden:
+        if device in self._index and self._index.isHidden(device):
             return
 
         # cancel actions first thing so that we hide the correct set of devices
@@ -489,6 +858,7 @@ class DeviceTree(object):
         self._removeDevice(device, force=True, modparent=False)
 
         self._hidden.append(device)
+        self._index.add(device, hidden=True)
         lvm.lvm_cc_addFilterRejectRegexp(device.name)
 
         if isinstance(device, DASDDevice):
@@ -520,6 +890,7 @@ class DeviceTree(object):
                                                           hidden.id)
                 self._hidden.remove(hidden)
                 self._devices.append(hidden)
+                self._index.add(hidden)
                 hidden.addHook(new=False)
                 lvm.lvm_cc_removeFilterRejectRegexp(hidden.name)
                 if isinstance(device, DASDDevice):
@@ -557,6 +928,10 @@ class DeviceTree(object):
         finally:
             self._hideIgnoredDisks()
 
+        if self._monitor:
+            # the tree reflects everything that has happened so far
+            udev.get_events(self._monitor)
+
         if flags.installer_mode:
             self.teardownAll()
 
@@ -621,6 +996,29 @@ class DeviceTree(object):
             devices = (d for d in devices if getattr(d, "complete", True))
         return devices
 
+    def _isInTree(self, device):
+        """ Return True if device is in the (visible part of the) tree. """
+        return device in self._index and not self._index.isHidden(device)
+
+    def _findDevices(self, attr, key, match, incomplete=False, hidden=False):
+        """ Return indexed devices matching the given criteria.
+
+            :param str attr: the indexed attribute to look up (see
+                             :attr:`_DeviceIndex.attrs`)
+            :param key: the value to look up
+            :param match: a function taking a device and returning whether it
+                          matches
+            :param bool incomplete: include incomplete devices in result
+            :param bool hidden: include hidden devices in result
+            :returns: matching devices, in the order :meth:`_filterDevices`
+                      would yield them
+            :rtype: list of :class:`~.devices.Device`
+        """
+        return [d for d in self._index.find(attr, key)
+                if (hidden or not self._index.isHidden(d)) and
+                   (incomplete or getattr(d, "complete", True)) and
+                   match(d)]
+
     def make_dasd_list(self, dasds, disks):
         """ Create a list of DASDs recognized by the system
 
@@ -669,8 +1067,10 @@ class DeviceTree(object):
         log_method_call(self, path=path, incomplete=incomplete, hidden=hidden)
         result = None
         if path:
-            devices = self._filterDevices(incomplete=incomplete, hidden=hidden)
-            result = next((d for d in devices if d.sysfsPath == path), None)
+            devices = self._findDevices("sysfsPath", path,
+                                        lambda d: d.sysfsPath == path,
+                                        incomplete=incomplete, hidden=hidden)
+            result = next(iter(devices), None)
         log_method_return(self, result)
         return result
 
@@ -686,8 +1086,10 @@ class DeviceTree(object):
         log_method_call(self, uuid=uuid, incomplete=incomplete, hidden=hidden)
         result = None
         if uuid:
-            devices = self._filterDevices(incomplete=incomplete, hidden=hidden)
-            result = next((d for d in devices if d.uuid == uuid or d.format.uuid == uuid), None)
+            devices = self._findDevices("uuid", uuid,
+                                        lambda d: d.uuid == uuid or d.format.uuid == uuid,
+                                        incomplete=incomplete, hidden=hidden)
+            result = next(iter(devices), None)
         log_method_return(self, result)
         return result
 
@@ -725,8 +1127,10 @@ class DeviceTree(object):
         log_method_call(self, label=label, incomplete=incomplete, hidden=hidden)
         result = None
         if label:
-            devices = self._filterDevices(incomplete=incomplete, hidden=hidden)
-            result = next((d for d in devices if getattr(d.format, "label", None) == label), None)
+            devices = self._findDevices("label", label,
+                                        lambda d: getattr(d.format, "label", None) == label,
+                                        incomplete=incomplete, hidden=hidden)
+            result = next(iter(devices), None)
         log_method_return(self, result)
         return result
 
@@ -742,10 +1146,16 @@ class DeviceTree(object):
         log_method_call(self, name=name, incomplete=incomplete, hidden=hidden)
         result = None
         if name:
-            devices = self._filterDevices(incomplete=incomplete, hidden=hidden)
-            result = next((d for d in devices if d.name == name or \
-               (isinstance(d, _LVM_DEVICE_CLASSES) and d.name == name.replace("--","-"))),
-               None)
+            lvm_name = name.replace("--", "-")
+            devices = self._findDevices("name", name,
+                                        lambda d: d.name == name,
+                                        incomplete=incomplete, hidden=hidden)
+            if lvm_name != name:
+                devices.extend(self._findDevices("name", lvm_name,
+                                                 lambda d: isinstance(d, _LVM_DEVICE_CLASSES),
+                                                 incomplete=incomplete, hidden=hidden))
+                devices.sort(key=self._index.position)
+            result = next(iter(devices), None)
         log_method_return(self, result)
         return result
 
@@ -764,14 +1174,20 @@ class DeviceTree(object):
         log_method_call(self, path=path, incomplete=incomplete, hidden=hidden)
         result = None
         if path:
-            devices = self._filterDevices(incomplete=incomplete, hidden=hidden)
+            lvm_path = path.replace("--", "-")
+            devices = self._findDevices("path", path,
+                                        lambda d: d.path == path,
+                                        incomplete=incomplete, hidden=hidden)
+            if lvm_path != path:
+                devices.extend(self._findDevices("path", lvm_path,
+                                                 lambda d: isinstance(d, _LVM_DEVICE_CLASSES),
+                                                 incomplete=incomplete, hidden=hidden))
+                devices.sort(key=self._index.position)
 
             # The usual order of the devices list is one where leaves are at
             # the end. So that the search can prefer leaves to interior nodes
             # the list that is searched is the reverse of the devices list.
-            result = next((d for d in reversed(list(devices)) if d.path == path or \
-               (isinstance(d, _LVM_DEVICE_CLASSES) and d.path == path.replace("--","-"))),
-               None)
+            result = next(reversed(devices), None)
 
         log_method_return(self, result)
         return result
@@ -818,8 +1234,11 @@ class DeviceTree(object):
             :rtype: :class:`~.devices.Device`
         """
         log_method_call(self, id_num=id_num, incomplete=incomplete, hidden=hidden)
-        devices = self._filterDevices(incomplete=incomplete, hidden=hidden)
-        result = next((d for d in devices if d.id == id_num), None)
+        result = self._index.getByID(id_num)
+        if result is not None and \
+           ((not hidden and self._index.isHidden(result)) or
+            (not incomplete and not getattr(result, "complete", True))):
+            result = None
         log_method_return(self, result)
         return result
 
@@ -827,14 +1246,16 @@ class DeviceTree(object):
     def devices(self):
         """ List of devices currently in the tree """
         devices = []
+        uuids = set()
         for device in self._devices:
             if not getattr(device, "complete", True):
                 continue
 
-            if device.uuid and device.uuid in [d.uuid for d in devices] and \
+            if device.uuid and device.uuid in uuids and \
                not isinstance(device, NoDevice):
                 raise DeviceTreeError("duplicate uuids in device tree")
 
+            uuids.add(device.uuid)
             devices.append(device)
 
         return devices
@@ -896,7 +1317,9 @@ class DeviceTree(object):
 
     def getChildren(self, device):
         """ Return a list of a device's children. """
-        return [c for c in self._devices if device in c.parents]
+        children = [c for c in device.children if self._isInTree(c)]
+        children.sort(key=self._index.position)
+        return children
 
     def resolveDevice(self, devspec, blkidTab=None, cryptTab=None, options=None):
         """ Return the device matching the provided device specification.
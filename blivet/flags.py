@@ -66,6 +66,14 @@ class Flags(object):
         # meaningful when flags.installer_mode is False)
         self.include_nodev = False
 
+        # maximum number of threads used to probe devices concurrently while
+        # populating the devicetree (0 or 1 to probe them serially)
+        self.probe_workers = 1
+
+        # maximum number of threads used to execute actions that do not
+        # depend on one another concurrently (0 or 1 to execute them in order)
+        self.action_workers = 1
+
         self.boot_cmdline = {}
 
         self.update_from_boot_cmdline()
@@ -21,10 +21,7 @@
 # Red Hat Author(s): Dave Lehman <dlehman@redhat.com>
 #
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from ..callstats import blockdev
 
 import os
 import importlib
@@ -33,10 +30,12 @@ from ..util import notify_kernel
 from ..util import get_sysfs_path_by_name
 from ..util import run_program
 from ..util import ObjectID
+from ..util import variable_copy
 from ..storage_log import log_method_call
 from ..errors import DeviceFormatError, FormatCreateError, FormatDestroyError, FormatSetupError
 from ..i18n import N_
 from ..size import Size
+from ..statuscache import statusCache
 
 import logging
 log = logging.getLogger("blivet")
@@ -183,6 +182,7 @@ class DeviceFormat(ObjectID):
                 it via the 'device' kwarg to the :meth:`create` method.
         """
         ObjectID.__init__(self)
+        self._changeHook = None
         self._label = None
         self._options = None
         self._device = None
@@ -193,6 +193,22 @@ class DeviceFormat(ObjectID):
         self.options = kwargs.get("options")
         self._createOptions = kwargs.get("createOptions")
 
+    def __deepcopy__(self, memo):
+        new = variable_copy(self, memo, omit=('_changeHook',))
+
+        # a copy is not the format of the device observing this instance
+        new._changeHook = None
+        return new
+
+    def _changed(self, attr):
+        """ Notify this format's observer (normally its device) of a change.
+
+            :param str attr: the name of the attribute that changed
+        """
+        hook = getattr(self, "_changeHook", None)
+        if hook is not None:
+            hook(self, attr)
+
     def __repr__(self):
         s = ("%(classname)s instance (%(id)s) object id %(object_id)d--\n"
              "  type = %(type)s  name = %(name)s  status = %(status)s\n"
@@ -205,7 +221,7 @@ class DeviceFormat(ObjectID):
               "type": self.type, "name": self.name, "status": self.status,
               "device": self.device, "uuid": self.uuid, "exists": self.exists,
               "options": self.options, "supported": self.supported,
-              "format": self.formattable, "resize": self.resizable,
+              "format": self.formattable, "resize": self._knownResizable,
               "createOptions": self.createOptions})
         return s
 
@@ -225,7 +241,8 @@ class DeviceFormat(ObjectID):
         d = {"type": self.type, "name": self.name, "device": self.device,
              "uuid": self.uuid, "exists": self.exists,
              "options": self.options, "supported": self.supported,
-             "resizable": self.resizable, "createOptions": self.createOptions}
+             "resizable": self._knownResizable,
+             "createOptions": self.createOptions}
         return d
 
     def labeling(self):
@@ -274,6 +291,7 @@ class DeviceFormat(ObjectID):
            This method is not intended to be overridden.
         """
         self._label = label
+        self._changed("label")
 
     def _getLabel(self):
         """The label for this filesystem.
@@ -285,6 +303,17 @@ class DeviceFormat(ObjectID):
         """
         return self._label
 
+    def _getUUID(self):
+        return self._uuid
+
+    def _setUUID(self, value):
+        self._uuid = value
+        self._changed("uuid")
+
+    uuid = property(lambda s: s._getUUID(),
+                    lambda s, v: s._setUUID(v),
+                    doc="This format's UUID")
+
     def _setOptions(self, options):
         self._options = options
 
@@ -481,6 +510,8 @@ class DeviceFormat(ObjectID):
             return
 
         self._setup(**kwargs)
+        # eg: opening a LUKS format activates the device that holds it
+        statusCache.invalidate()
         self._postSetup(**kwargs)
 
     @property
@@ -524,6 +555,7 @@ class DeviceFormat(ObjectID):
             return
 
         self._teardown(**kwargs)
+        statusCache.invalidate()
         self._postTeardown(**kwargs)
 
     def _preTeardown(self, **kwargs):
@@ -572,6 +604,13 @@ class DeviceFormat(ObjectID):
         """ Can formats of this type be resized? """
         return self._resizable and self.exists
 
+    @property
+    def _knownResizable(self):
+        """ Whether formats of this type are known to be resizable, without
+            probing this one.
+        """
+        return self.resizable
+
     @property
     def linuxNative(self):
         """ Is this format type native to linux? """
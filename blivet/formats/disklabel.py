@@ -20,8 +20,6 @@
 # Red Hat Author(s): Dave Lehman <dlehman@redhat.com>
 #
 
-import os
-
 from ..storage_log import log_exception_info, log_method_call
 import parted
 import _ped
@@ -64,6 +62,7 @@ class DiskLabel(DeviceFormat):
         self._size = Size(0)
 
         self._partedDevice = None
+        self._partedDevicePath = None
         self._partedDisk = None
         self._origPartedDisk = None
         self._alignment = None
@@ -78,9 +77,14 @@ class DiskLabel(DeviceFormat):
 
             We can't do copy.deepcopy on parted objects, which is okay.
         """
-        return util.variable_copy(self, memo,
+        # The original parted disk is never modified, so copies share it.
+        # A copy without a current parted disk gets one when it is needed.
+        new = util.variable_copy(self, memo,
+           omit=('_changeHook', '_origPartedDisk'),
            shallow=('_partedDevice', '_alignment', '_endAlignment'),
-           duplicate=('_partedDisk', '_origPartedDisk'))
+           duplicate=('_partedDisk',))
+        new._changeHook = None
+        return new
 
     def __repr__(self):
         s = DeviceFormat.__repr__(self)
@@ -123,7 +127,8 @@ class DiskLabel(DeviceFormat):
     def resetPartedDisk(self):
         """ Set this instance's partedDisk to reflect the disk's contents. """
         log_method_call(self, device=self.device)
-        self._partedDisk = self._origPartedDisk
+        # a duplicate of the original is made when partedDisk is next used
+        self._partedDisk = None
 
     def freshPartedDisk(self):
         """ Return a new, empty parted.Disk instance for this device. """
@@ -133,7 +138,9 @@ class DiskLabel(DeviceFormat):
     @property
     def partedDisk(self):
         if not self._partedDisk:
-            if self.exists:
+            if self._origPartedDisk is not None:
+                self._partedDisk = self._origPartedDisk.duplicate()
+            elif self.exists:
                 try:
                     self._partedDisk = parted.Disk(device=self.partedDevice)
                 except (_ped.DiskLabelException, _ped.IOException,
@@ -174,13 +181,14 @@ class DiskLabel(DeviceFormat):
     @property
     def partedDevice(self):
         if not self._partedDevice and self.device:
-            if os.path.exists(self.device):
+            if udev.backend.exists(self.device):
                 # We aren't guaranteed to be able to get a device.  In
                 # particular, built-in USB flash readers show up as devices but
                 # do not always have any media present, so parted won't be able
                 # to find a device.
                 try:
-                    self._partedDevice = parted.Device(path=self.device)
+                    self._partedDevice = udev.backend.get_parted_device(self.device)
+                    self._partedDevicePath = self._partedDevice.path
                 except (_ped.IOException, _ped.DeviceException) as e:
                     log.error("DiskLabel.partedDevice: Parted exception: %s", e)
             else:
@@ -190,6 +198,38 @@ class DiskLabel(DeviceFormat):
             log.info("DiskLabel.partedDevice returning None")
         return self._partedDevice
 
+    def getPartitionByPath(self, path):
+        """ Return the parted partition with a device node path, or None.
+
+            :param str path: the partition's device node path (eg: /dev/sda1)
+            :rtype: :class:`parted.Partition` or NoneType
+
+            parted names partitions after the node it opened the disk by,
+            which is not the disk's own when a recording is being replayed
+            (see :mod:`~.udevreplay`).
+        """
+        partedPath = self._partedDevicePath
+        if partedPath and partedPath != self.device and path.startswith(self.device):
+            path = partedPath + path[len(self.device):]
+
+        return self.partedDisk.getPartitionByPath(path)
+
+    def partitionPath(self, partition):
+        """ Return the device node path of a parted partition on this disk.
+
+            :param partition: the partition
+            :type partition: :class:`parted.Partition`
+            :rtype: str
+
+            This is the reverse of the mapping done by :meth:`getPartitionByPath`.
+        """
+        path = partition.path
+        partedPath = self._partedDevicePath
+        if partedPath and partedPath != self.device and path.startswith(partedPath):
+            path = self.device + path[len(partedPath):]
+
+        return path
+
     @property
     def labelType(self):
         """ The disklabel type (eg: 'gpt', 'msdos') """
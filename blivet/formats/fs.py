@@ -25,6 +25,7 @@
 from decimal import Decimal
 import os
 import tempfile
+from threading import Lock
 
 from ..tasks import fsck
 from ..tasks import fsinfo
@@ -35,9 +36,10 @@ from ..tasks import fsmount
 from ..tasks import fsreadlabel
 from ..tasks import fsresize
 from ..tasks import fssize
+from ..tasks import fssuperblock
 from ..tasks import fssync
 from ..tasks import fswritelabel
-from ..errors import FormatCreateError, FSError, FSReadLabelError
+from ..errors import FormatCreateError, FSError, FSReadLabelError, StorageError
 from ..errors import FSWriteLabelError, FSResizeError
 from . import DeviceFormat, register_device_format
 from .. import util
@@ -50,6 +52,7 @@ from ..size import Size, ROUND_UP, ROUND_DOWN, unitStr
 from ..i18n import N_
 from .. import udev
 from ..mounts import mountsCache
+from ..callstats import blockdev
 
 from .fslib import kernel_filesystems, update_kernel_filesystems
 
@@ -70,6 +73,7 @@ class FS(DeviceFormat):
     _readlabelClass = fsreadlabel.UnimplementedFSReadLabel
     _resizeClass = fsresize.UnimplementedFSResize
     _sizeinfoClass = fssize.UnimplementedFSSize
+    _superblockClass = fssuperblock.UnimplementedFSSuperblock
     _syncClass = fssync.UnimplementedFSSync
     _writelabelClass = fswritelabel.UnimplementedFSWriteLabel
 
@@ -107,6 +111,7 @@ class FS(DeviceFormat):
         self._mount = self._mountClass(self)
         self._readlabel = self._readlabelClass(self)
         self._resize = self._resizeClass(self)
+        self._superblock = self._superblockClass(self)
         self._sync = self._syncClass(self)
         self._writelabel = self._writelabelClass(self)
 
@@ -115,6 +120,7 @@ class FS(DeviceFormat):
         self._sizeinfo = self._sizeinfoClass(self)
 
         self._current_info = None # info obtained by _info task
+        self._current_superblock = None # info obtained by _superblock task
 
         self.mountpoint = kwargs.get("mountpoint")
         self.mountopts = kwargs.get("mountopts")
@@ -128,21 +134,30 @@ class FS(DeviceFormat):
         # Resize operations are limited to error-free filesystems whose current
         # size is known.
         self._resizable = False
-        if flags.installer_mode and self._resize.available:
-            # if you want current/min size you have to call updateSizeInfo
-            try:
-                self.updateSizeInfo()
-            except FSError:
-                log.warning("%s filesystem on %s needs repair", self.type,
-                                                                self.device)
-
         self._targetSize = self._size
 
+        # The size info is only gathered once something asks for it, since
+        # that means running fsck and the resize tool's min size query. If
+        # you want current/min size otherwise you have to call updateSizeInfo.
+        # Filesystems on devices that can not be opened (eg: those from a
+        # replayed recording) are never inspected.
+        self._sizeInfoPending = (flags.installer_mode and self.exists and
+                                 self._resize.available and
+                                 udev.backend.devices_available)
+        self._sizeInfoLock = Lock()
+
         self._chrootedMountpoint = None
 
         if self.supported:
             self.loadModule()
 
+    def __deepcopy__(self, memo):
+        new = util.variable_copy(self, memo,
+                                 omit=('_changeHook', '_sizeInfoLock'))
+        new._changeHook = None
+        new._sizeInfoLock = Lock()
+        return new
+
     def __repr__(self):
         s = DeviceFormat.__repr__(self)
         s += ("  mountpoint = %(mountpoint)s  mountopts = %(mountopts)s\n"
@@ -150,7 +165,7 @@ class FS(DeviceFormat):
               "  targetSize = %(targetSize)s\n" %
               {"mountpoint": self.mountpoint, "mountopts": self.mountopts,
                "label": self.label, "size": self._size,
-               "targetSize": self.targetSize})
+               "targetSize": self._targetSize})
         return s
 
     @property
@@ -164,7 +179,7 @@ class FS(DeviceFormat):
     def dict(self):
         d = super(FS, self).dict
         d.update({"mountpoint": self.mountpoint, "size": self._size,
-                  "label": self.label, "targetSize": self.targetSize,
+                  "label": self.label, "targetSize": self._targetSize,
                   "mountable": self.mountable})
         return d
 
@@ -220,6 +235,7 @@ class FS(DeviceFormat):
 
     def _getTargetSize(self):
         """ Get this filesystem's target size. """
+        self._resolveSizeInfo()
         return self._targetSize
 
     targetSize = property(_getTargetSize, _setTargetSize,
@@ -227,11 +243,73 @@ class FS(DeviceFormat):
 
     def _getSize(self):
         """ Get this filesystem's size. """
+        # the target size can only have been changed once the size info
+        # was gathered, so there is no need to gather it here
+        if self._sizeInfoPending:
+            return self._size
+
         return self.targetSize if self.resizable else self._size
 
     size = property(_getSize, doc="This filesystem's size, accounting "
                                   "for pending changes")
 
+    def _resolveSizeInfo(self):
+        """ Gather the size info if that was deferred by the constructor.
+
+            If the device has been torn down, it is set up for as long as
+            that takes. The size info stays pending if that is not possible.
+        """
+        if not self._sizeInfoPending:
+            return
+
+        with self._sizeInfoLock:
+            if not self._sizeInfoPending:
+                return
+
+            owner = None
+            if not os.path.exists(self.device):
+                owner = self._setupOwner()
+                if owner is None:
+                    return
+
+            initial_size = self._size
+            try:
+                self.updateSizeInfo()
+            except FSError:
+                log.warning("%s filesystem on %s needs repair", self.type,
+                                                                self.device)
+            finally:
+                if owner is not None:
+                    try:
+                        owner.teardown(recursive=True)
+                    except (StorageError, blockdev.BlockDevError) as e:
+                        log.info("teardown of %s failed: %s", owner.name, e)
+
+            if self._targetSize == initial_size:
+                self._targetSize = self._size
+
+    def _setupOwner(self):
+        """ Set up the device this is the format of.
+
+            :returns: the device, or None if it could not be set up
+            :rtype: :class:`~.devices.StorageDevice` or NoneType
+        """
+        # a format's change hook is a method of the device it belongs to
+        owner = getattr(self._changeHook, "__self__", None)
+        if owner is None or owner.protected or not owner.controllable:
+            log.debug("not gathering size info of %s filesystem on %s "
+                      "while the device is not available", self.type,
+                      self.device)
+            return None
+
+        try:
+            owner.setup()
+        except (StorageError, blockdev.BlockDevError) as e:
+            log.info("setup of %s failed: %s", owner.name, e)
+            return None
+
+        return owner
+
     def updateSizeInfo(self):
         """ Update this filesystem's current and minimum size (for resize). """
 
@@ -250,10 +328,12 @@ class FS(DeviceFormat):
         #     its unknown actual minimum size.
         #   * self._getMinSize() is only run if fsck succeeds and a current
         #     existing size can be obtained.
+        self._sizeInfoPending = False
         if not self.exists:
             return
 
         self._current_info = None
+        self._current_superblock = None
         self._minInstanceSize = Size(0)
         self._resizable = self.__class__._resizable
 
@@ -267,7 +347,16 @@ class FS(DeviceFormat):
             # try to gather current size info anyway
             self._size = Size(0)
             try:
-                if self._info.available:
+                if self._superblock.available:
+                    self._current_superblock = self._superblock.doTask()
+            except FSError as e:
+                log.info("Failed to read superblock of device %s: %s", self.device, e)
+
+            # Only run the info application if the superblock is not enough.
+            try:
+                if self._info.available and \
+                   (self._current_superblock is None or
+                    self._current_superblock.size is None):
                     self._current_info = self._info.doTask()
             except FSError as e:
                 log.info("Failed to obtain info for device %s: %s", self.device, e)
@@ -303,6 +392,7 @@ class FS(DeviceFormat):
         # If self._minInstanceSize is less than self._minSize,
         # but not 0, then there must be some mistake, so better to use
         # self._minSize.
+        self._resolveSizeInfo()
         return max(self._minInstanceSize, self._minSize)
 
     def _padSize(self, size):
@@ -328,6 +418,7 @@ class FS(DeviceFormat):
     @property
     def currentSize(self):
         """ The filesystem's current actual size. """
+        self._resolveSizeInfo()
         return self._size if self.exists else Size(0)
 
     @property
@@ -648,6 +739,15 @@ class FS(DeviceFormat):
         if not os.path.exists(self.device):
             raise FSReadLabelError("device does not exist")
 
+        if self._superblock.available:
+            try:
+                label = self._superblock.doTask().label
+            except FSError as e:
+                log.debug("Failed to read label from superblock of %s: %s", self.device, e)
+            else:
+                if label is not None:
+                    return label
+
         if not self._readlabel.available:
             raise FSReadLabelError("can not read label for filesystem %s" % self.type)
         return self._readlabel.doTask()
@@ -706,8 +806,14 @@ class FS(DeviceFormat):
     @property
     def resizable(self):
         """ Can formats of this filesystem type be resized? """
+        self._resolveSizeInfo()
         return super(FS, self).resizable and self._resize.available
 
+    @property
+    def _knownResizable(self):
+        # the size info is not gathered just to describe the filesystem
+        return False if self._sizeInfoPending else self.resizable
+
     def _getOptions(self):
         return self.mountopts or ",".join(self._mount.options)
 
@@ -785,6 +891,23 @@ class FS(DeviceFormat):
         data.mkfsopts = self.createOptions or ""
         data.fsprofile = self.fsprofile or ""
 
+def prefetch_size_info(formats):
+    """ Gather the deferred size info of several filesystems in parallel.
+
+        :param formats: formats whose size info will be needed
+        :type formats: iterable of :class:`~.formats.DeviceFormat`
+
+        Formats other than filesystems, and filesystems whose size info is
+        not pending, are ignored. This saves waiting for fsck and the min
+        size query of each filesystem in turn when many of them are about to
+        be looked at.
+    """
+    # pylint: disable=protected-access
+    pending = set(f for f in formats if isinstance(f, FS) and f._sizeInfoPending)
+    results = [util.submit(f._resolveSizeInfo) for f in pending]
+    for result in results:
+        result.get()
+
 class Ext2FS(FS):
     """ ext2 filesystem. """
     _type = "ext2"
@@ -805,6 +928,7 @@ class Ext2FS(FS):
     _readlabelClass = fsreadlabel.Ext2FSReadLabel
     _resizeClass = fsresize.Ext2FSResize
     _sizeinfoClass = fssize.Ext2FSSize
+    _superblockClass = fssuperblock.Ext2FSSuperblock
     _writelabelClass = fswritelabel.Ext2FSWriteLabel
     partedSystem = fileSystemType["ext2"]
 
@@ -851,6 +975,7 @@ class FATFS(FS):
     _mkfsClass = fsmkfs.FATFSMkfs
     _mountClass = fsmount.FATFSMount
     _readlabelClass = fsreadlabel.DosFSReadLabel
+    _superblockClass = fssuperblock.FATFSSuperblock
     _writelabelClass = fswritelabel.DosFSWriteLabel
     # FIXME this should be fat32 in some cases
     partedSystem = fileSystemType["fat16"]
@@ -883,6 +1008,7 @@ class BTRFS(FS):
     _minSize = Size("256 MiB")
     _maxSize = Size("16 EiB")
     _mkfsClass = fsmkfs.BTRFSMkfs
+    _superblockClass = fssuperblock.BTRFSSuperblock
     # FIXME parted needs to be taught about btrfs so that we can set the
     # partition table type correctly for btrfs partitions
     # partedSystem = fileSystemType["btrfs"]
@@ -995,6 +1121,7 @@ class XFS(FS):
     _mkfsClass = fsmkfs.XFSMkfs
     _readlabelClass = fsreadlabel.XFSReadLabel
     _sizeinfoClass = fssize.XFSSize
+    _superblockClass = fssuperblock.XFSSuperblock
     _syncClass = fssync.XFSSync
     _writelabelClass = fswritelabel.XFSWriteLabel
     partedSystem = fileSystemType["xfs"]
@@ -23,13 +23,12 @@
 from parted import PARTITION_SWAP, fileSystemType
 from ..storage_log import log_method_call
 from ..tasks import availability
+from ..tasks import fssuperblock
+from .. import udev
 from . import DeviceFormat, register_device_format
 from ..size import Size
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from ..callstats import blockdev
 
 import logging
 log = logging.getLogger("blivet")
@@ -74,6 +73,31 @@ class SwapSpace(DeviceFormat):
         self.priority = kwargs.get("priority", -1)
         self.label = kwargs.get("label")
 
+        if self.exists:
+            self._readSignature()
+
+    def _readSignature(self):
+        """ Set the label and uuid from the swap signature on the device.
+
+            The values passed to the constructor, which come from udev, are
+            kept if the signature can not be read.
+        """
+        if not self.device or not udev.backend.devices_available:
+            return
+
+        try:
+            sb = fssuperblock.read_superblock(self.device, self.type)
+        except OSError as e:
+            log.debug("failed to read swap signature of %s: %s", self.device, e)
+            return
+
+        if sb is None:
+            log.debug("no swap signature found on %s", self.device)
+            return
+
+        self.uuid = sb.uuid
+        self.label = sb.label or None
+
     def __repr__(self):
         s = DeviceFormat.__repr__(self)
         s += ("  priority = %(priority)s  label = %(label)s" %
@@ -19,6 +19,9 @@
 #
 # Red Hat Author(s): Vojtech Trefny <vtrefny@redhat.com>
 #
+import os
+import select
+import threading
 from collections import defaultdict
 from . import util
 from .util import open  # pylint: disable=redefined-builtin
@@ -27,62 +30,49 @@ from .devicelibs import btrfs
 import logging
 log = logging.getLogger("blivet")
 
-class _MountinfoCache(object):
-    """ Cache for info from /proc/self/mountinfo. Looks up the root of the
-        mount within the filesystem using a pair of mountpoint, mount
-        source as keys.
+MOUNTS_FILE = "/proc/self/mounts"
+""" file whose readers are notified of changes to the mount table """
 
-        This is a very simple helper class for MountsCache, and would
-        have to be altered for general purpose use.
+MOUNTINFO_FILE = "/proc/self/mountinfo"
+""" file listing active mounts """
 
-        Note that only info for fstype btrfs is stored within the cache,
-        as MountsCache methods only require information for btrfs.
-    """
-
-    def __init__(self):
-        self._cache = None
+class MountsCache(object):
+    """ Cache object for system mountpoints.
 
-    def _getCache(self):
-        """ Reads lines in /proc/self/mountinfo and builds a table. """
-        cache = {}
+        The cache is refreshed from /proc/self/mountinfo when the mount table
+        changes. Changes are detected by polling /proc/self/mounts, which
+        signals POLLPRI whenever something is mounted or unmounted. Where
+        that is not possible, the cache is refreshed when the MD5 hash of
+        /proc/self/mounts changes.
 
-        with open("/proc/self/mountinfo") as mountinfos:
-            for line in mountinfos:
-                fields = line.split()
-                separator_index = fields.index("-")
-                fstype = fields[separator_index + 1]
-                if not fstype.startswith("btrfs"):
-                    continue
+        The cache is guarded by a lock, since actions executed concurrently
+        may use it.
+    """
 
-                root = fields[3]
-                mountpoint = fields[4]
-                devspec = fields[separator_index + 2]
-                cache[(devspec, mountpoint)] = root
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.mountsHash = 0
+        self.mountpoints = defaultdict(list)
+        self._devspecs = defaultdict(list)
+        self._poller = None
+        self._mountsFd = None
 
-        return cache
+    def __del__(self):
+        self.close()
 
-    def getRoot(self, devspec, mountpoint):
-        """ Retrieves the root of the mount within the filesystem
-            that corresponds to devspec and mountpoint.
+    def close(self):
+        """ Stop watching the mount table for changes.
 
-            :param str devspec: device specification
-            :param str mountpoint: mountpoint
-            :rtype: str or NoneType
-            :returns: the root of the mount within the filesystem, if available
+            The cache starts watching it again when it is next used.
         """
-        if self._cache is None:
-            self._cache = self._getCache()
+        with self._lock:
+            if self._mountsFd is None:
+                return
 
-        return self._cache.get((devspec, mountpoint))
-
-class MountsCache(object):
-    """ Cache object for system mountpoints; checks /proc/mounts and
-        /proc/self/mountinfo for up-to-date information.
-    """
-
-    def __init__(self):
-        self.mountsHash = 0
-        self.mountpoints = defaultdict(list)
+            fd = self._mountsFd
+            self._mountsFd = None
+            self._poller = None
+            os.close(fd)
 
     def getMountpoints(self, devspec, subvolspec=None):
         """ Get mountpoints for selected device
@@ -98,57 +88,105 @@ class MountsCache(object):
                 Devices can be mounted on multiple paths, and paths can have multiple
                 devices mounted to them (hiding previous mounts). Callers should take this into account.
         """
-        self._cacheCheck()
-
         if subvolspec is not None:
             subvolspec = str(subvolspec)
 
-        return self.mountpoints[(devspec, subvolspec)]
+        with self._lock:
+            self._cacheCheck()
+            return self.mountpoints[(devspec, subvolspec)]
+
+    def getDevspecs(self, path):
+        """ Get the devices mounted on a path
+
+            :param str path: mountpoint
+            :returns: list of device specifications, eg. "/dev/vda1", in the
+                      order they were mounted
+            :rtype: list of str or empty list
+        """
+        with self._lock:
+            self._cacheCheck()
+            return [devspec for (devspec, _subvolspec) in self._devspecs.get(path, [])]
 
     def isMountpoint(self, path):
         """ Check to see if a path is already mounted
 
             :param str path: Path to check
         """
-        self._cacheCheck()
-
-        return any(path in p for p in self.mountpoints.values())
+        with self._lock:
+            self._cacheCheck()
+            return path in self._devspecs
 
     def _getActiveMounts(self):
-        """ Get information about mounted devices from /proc/mounts and
-            /proc/self/mountinfo
+        """ Get information about mounted devices from /proc/self/mountinfo
 
             Refreshes self.mountpoints with current mountpoint information
         """
-        self.mountpoints = defaultdict(list)
-        mountinfo = _MountinfoCache()
+        mountpoints = defaultdict(list)
+        devspecs = defaultdict(list)
 
-        with open("/proc/mounts") as mounts:
-            for line in mounts:
+        with open(MOUNTINFO_FILE) as mountinfo:
+            for line in mountinfo:
+                # eg: 36 35 98:0 /mnt1 /mnt/parent rw,noatime master:1 - ext3 /dev/root rw
+                fields = line.split()
                 try:
-                    (devspec, mountpoint, fstype, _rest) = line.split(None, 3)
-                except ValueError:
-                    log.error("failed to parse /proc/mounts line: %s", line)
+                    separator_index = fields.index("-", 6)
+                    root = fields[3]
+                    mountpoint = fields[4]
+                    fstype = fields[separator_index + 1]
+                    devspec = fields[separator_index + 2]
+                except (ValueError, IndexError):
+                    log.error("failed to parse %s line: %s", MOUNTINFO_FILE, line)
                     continue
 
                 if fstype == "btrfs":
-                    root = mountinfo.getRoot(devspec, mountpoint)
-                    if root is not None:
-                        subvolspec = root[1:] or str(btrfs.MAIN_VOLUME_ID)
-                        self.mountpoints[(devspec, subvolspec)].append(mountpoint)
-                    else:
-                        log.error("failed to obtain subvolspec for btrfs device %s at mountpoint %s", devspec, mountpoint)
+                    subvolspec = root[1:] or str(btrfs.MAIN_VOLUME_ID)
                 else:
-                    self.mountpoints[(devspec, None)].append(mountpoint)
+                    subvolspec = None
 
-    def _cacheCheck(self):
-        """ Computes the MD5 hash on /proc/mounts and updates the cache on change
+                mountpoints[(devspec, subvolspec)].append(mountpoint)
+                devspecs[mountpoint].append((devspec, subvolspec))
+
+        self.mountpoints = mountpoints
+        self._devspecs = devspecs
+
+    def _startPolling(self):
+        """ Start watching the mount table for changes.
+
+            :returns: whether changes can be detected by polling
+            :rtype: bool
         """
+        if not hasattr(select, "poll"):
+            return False
+
+        try:
+            # programs run by blivet must not inherit the descriptor
+            fd = os.open(MOUNTS_FILE, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+        except OSError as e:
+            log.debug("failed to open %s: %s", MOUNTS_FILE, e)
+            return False
+
+        poller = select.poll()
+        poller.register(fd, select.POLLPRI | select.POLLERR)
+        self._mountsFd = fd
+        self._poller = poller
+        return True
 
-        md5hash = util.md5_file("/proc/mounts")
+    def _cacheCheck(self):
+        """ Updates the cache if the mount table has changed
 
-        if md5hash != self.mountsHash:
-            self.mountsHash = md5hash
+            The caller must hold the cache's lock.
+        """
+        if self._poller is None:
+            if self._startPolling():
+                self._getActiveMounts()
+            else:
+                md5hash = util.md5_file(MOUNTS_FILE)
+                if md5hash != self.mountsHash:
+                    self.mountsHash = md5hash
+                    self._getActiveMounts()
+        elif self._poller.poll(0):
+            # a change is only reported once, so the table is read after
+            # polling to pick up anything that changes in between
             self._getActiveMounts()
 
 mountsCache = MountsCache()
@@ -22,12 +22,10 @@
 
 from operator import gt, lt
 from decimal import Decimal
+import bisect
 import functools
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from .callstats import blockdev
 
 import parted
 
@@ -170,7 +168,7 @@ def getNextPartitionType(disk, no_primary=None):
 
 def getBestFreeSpaceRegion(disk, part_type, req_size, start=None,
                            boot=None, best_free=None, grow=None,
-                           alignment=None):
+                           alignment=None, free_index=None):
     """ Return the "best" free region on the specified disk.
 
         For non-boot partitions, we return the largest free region on the
@@ -201,6 +199,8 @@ def getBestFreeSpaceRegion(disk, part_type, req_size, start=None,
         :type grow: bool
         :keyword alignment: disk alignment requirements
         :type alignment: :class:`parted.Alignment`
+        :keyword free_index: free regions to use instead of asking parted
+        :type free_index: :class:`FreeSpaceIndex`
 
     """
     log.debug("getBestFreeSpaceRegion: disk=%s part_type=%d req_size=%s "
@@ -210,7 +210,14 @@ def getBestFreeSpaceRegion(disk, part_type, req_size, start=None,
     extended = disk.getExtendedPartition()
     alignment = alignment or parted.Alignment(offset=0, grainSize=1)
 
-    for free_geom in disk.getFreeSpaceRegions():
+    if free_index is None:
+        free_regions = disk.getFreeSpaceRegions()
+    else:
+        # regions shorter than the request can never be chosen
+        min_length = int(req_size // Size(disk.device.sectorSize))
+        free_regions = free_index.getFreeSpaceRegions(disk, min_length)
+
+    for free_geom in free_regions:
         # align the start sector of the free region since we will be aligning
         # the start sector of the partition
         if start is not None and \
@@ -424,6 +431,74 @@ def addPartition(disklabel, free, part_type, size, start=None, end=None):
                                       constraint=constraint)
     return partition
 
+class FreeSpaceIndex(object):
+    """ Free regions of disks, kept up to date while partitions are
+        allocated.
+
+        Each disk's free regions are obtained from parted once, and again
+        only after a partition has been added to or removed from the disk
+        through :meth:`addPartition` or :meth:`removePartition`. The regions
+        are also indexed by length so that those too short for a request can
+        be skipped without examining them.
+    """
+
+    def __init__(self):
+        # parted.Disk id -> (parted.Disk, regions by start, (length, index))
+        self._regions = {}
+
+    def _getEntry(self, disk):
+        entry = self._regions.get(id(disk))
+        if entry is None or entry[0] is not disk:
+            regions = disk.getFreeSpaceRegions()
+            by_length = sorted((r.length, i) for (i, r) in enumerate(regions))
+            entry = (disk, regions, by_length)
+            self._regions[id(disk)] = entry
+
+        return entry
+
+    def getFreeSpaceRegions(self, disk, min_length=0):
+        """ Return a disk's free regions.
+
+            :param disk: the disk
+            :type disk: :class:`parted.Disk`
+            :keyword int min_length: the minimum length of regions to return,
+                                     in sectors
+            :returns: the free regions in the order parted lists them
+            :rtype: list of :class:`parted.Geometry`
+        """
+        (_disk, regions, by_length) = self._getEntry(disk)
+        first = bisect.bisect_left(by_length, (min_length, -1))
+        return [regions[i] for i in sorted(i for (_length, i) in by_length[first:])]
+
+    def invalidate(self, disk):
+        """ Forget a disk's free regions.
+
+            :param disk: the disk
+            :type disk: :class:`parted.Disk`
+        """
+        self._regions.pop(id(disk), None)
+
+    def addPartition(self, disklabel, *args, **kwargs):
+        """ Add a new partition to a disk.
+
+            Takes the same arguments as :func:`addPartition`.
+        """
+        try:
+            return addPartition(disklabel, *args, **kwargs)
+        finally:
+            self.invalidate(disklabel.partedDisk)
+
+    def removePartition(self, disklabel, partition):
+        """ Remove a partition from a disk.
+
+            :param disklabel: the disklabel to remove the partition from
+            :type disklabel: :class:`~.formats.DiskLabel`
+            :param partition: the partition to remove
+            :type partition: :class:`parted.Partition`
+        """
+        disklabel.partedDisk.removePartition(partition)
+        self.invalidate(disklabel.partedDisk)
+
 def getFreeRegions(disks):
     """ Return a list of free regions on the specified disks.
 
@@ -631,27 +706,27 @@ def allocatePartitions(storage, disks, partitions, freespace):
             all_disks[disk.path] = disk
 
     removeNewPartitions(disks, new_partitions, partitions)
+    free_index = FreeSpaceIndex()
+
+    # sort the disks once, making sure the boot disk is first
+    candidates = set(disks)
+    for _part in new_partitions:
+        candidates.update(_part.req_disks or [])
+    ordered = sorted(candidates, key=storage.compareDisksKey)
+    if storage.bootDisk in candidates:
+        ordered.remove(storage.bootDisk)
+        ordered.insert(0, storage.bootDisk)
+    disk_order = dict((disk.id, i) for (i, disk) in enumerate(ordered))
 
     for _part in new_partitions:
         if _part.partedPartition and _part.isExtended:
             # ignore new extendeds as they are implicit requests
             continue
 
-        # obtain the set of candidate disks
-        req_disks = []
-        if _part.req_disks:
-            # use the requested disk set
-            req_disks = _part.req_disks
-        else:
-            # no disks specified means any disk will do
-            req_disks = disks
-
-        # sort the disks, making sure the boot disk is first
-        req_disks.sort(key=storage.compareDisksKey)
-        for disk in req_disks:
-            if storage.bootDisk and disk == storage.bootDisk:
-                boot_index = req_disks.index(disk)
-                req_disks.insert(0, req_disks.pop(boot_index))
+        # obtain the set of candidate disks; no disks specified means any
+        # disk will do
+        req_disks = sorted(_part.req_disks or disks,
+                           key=lambda d: disk_order[d.id])
 
         boot = _part.req_base_weight > 1000
 
@@ -719,7 +794,8 @@ def allocatePartitions(storage, disks, partitions, freespace):
                                           best_free=current_free,
                                           boot=boot,
                                           grow=_part.req_grow,
-                                          alignment=disklabel.alignment)
+                                          alignment=disklabel.alignment,
+                                          free_index=free_index)
 
             if best == free and not _part.req_primary and \
                new_part_type == parted.PARTITION_NORMAL:
@@ -735,7 +811,8 @@ def allocatePartitions(storage, disks, partitions, freespace):
                                                   best_free=current_free,
                                                   boot=boot,
                                                   grow=_part.req_grow,
-                                                  alignment=disklabel.alignment)
+                                                  alignment=disklabel.alignment,
+                                                  free_index=free_index)
 
             if best and free != best:
                 update = True
@@ -761,8 +838,8 @@ def allocatePartitions(storage, disks, partitions, freespace):
                             _free = best
                             if new_part_type == parted.PARTITION_EXTENDED and \
                                new_part_type != _part.req_partType:
-                                addPartition(disklabel, best, new_part_type,
-                                             None)
+                                free_index.addPartition(disklabel, best,
+                                                        new_part_type, None)
 
                                 _part_type = parted.PARTITION_LOGICAL
 
@@ -772,24 +849,25 @@ def allocatePartitions(storage, disks, partitions, freespace):
                                                                start=_part.req_start_sector,
                                                                boot=boot,
                                                                grow=_part.req_grow,
-                                                               alignment=disklabel.alignment)
+                                                               alignment=disklabel.alignment,
+                                                               free_index=free_index)
                                 if not _free:
                                     log.info("not enough space after adding "
                                              "extended partition for growth test")
                                     if new_part_type == parted.PARTITION_EXTENDED:
                                         e = disklabel.extendedPartition
-                                        disklabel.partedDisk.removePartition(e)
+                                        free_index.removePartition(disklabel, e)
 
                                     continue
 
                             temp_part = None
                             try:
-                                temp_part = addPartition(disklabel,
-                                                         _free,
-                                                         _part_type,
-                                                         req_size,
-                                                         _part.req_start_sector,
-                                                         _part.req_end_sector)
+                                temp_part = free_index.addPartition(disklabel,
+                                                                    _free,
+                                                                    _part_type,
+                                                                    req_size,
+                                                                    _part.req_start_sector,
+                                                                    _part.req_end_sector)
                             except ArithmeticError as e:
                                 log.debug("failed to allocate aligned partition "
                                          "for growth test")
@@ -826,13 +904,13 @@ def allocatePartitions(storage, disks, partitions, freespace):
                                                       disk_sector_size))
 
                     if temp_part:
-                        disklabel.partedDisk.removePartition(temp_part)
+                        free_index.removePartition(disklabel, temp_part)
                     _part.partedPartition = None
                     _part.disk = None
 
                     if new_part_type == parted.PARTITION_EXTENDED:
                         e = disklabel.extendedPartition
-                        disklabel.partedDisk.removePartition(e)
+                        free_index.removePartition(disklabel, e)
 
                     log.debug("total growth: %d sectors", new_growth)
 
@@ -880,7 +958,7 @@ def allocatePartitions(storage, disks, partitions, freespace):
         if part_type == parted.PARTITION_EXTENDED and \
            part_type != _part.req_partType:
             log.debug("creating extended partition")
-            addPartition(disklabel, free, part_type, None)
+            free_index.addPartition(disklabel, free, part_type, None)
 
             # now the extended partition exists, so set type to logical
             part_type = parted.PARTITION_LOGICAL
@@ -893,14 +971,17 @@ def allocatePartitions(storage, disks, partitions, freespace):
                                           start=_part.req_start_sector,
                                           boot=boot,
                                           grow=_part.req_grow,
-                                          alignment=disklabel.alignment)
+                                          alignment=disklabel.alignment,
+                                          free_index=free_index)
             if not free:
                 raise PartitioningError(_("not enough free space after "
                                         "creating extended partition"))
 
         try:
-            partition = addPartition(disklabel, free, part_type, aligned_size,
-                                _part.req_start_sector, _part.req_end_sector)
+            partition = free_index.addPartition(disklabel, free, part_type,
+                                                aligned_size,
+                                                _part.req_start_sector,
+                                                _part.req_end_sector)
         except ArithmeticError:
             raise PartitioningError(_("failed to allocate aligned partition"))
 
@@ -915,7 +996,7 @@ def allocatePartitions(storage, disks, partitions, freespace):
 
         # parted modifies the partition in the process of adding it to
         # the disk, so we need to grab the latest version...
-        _part.partedPartition = disklabel.partedDisk.getPartitionByPath(_part.path)
+        _part.partedPartition = disklabel.getPartitionByPath(_part.path)
 
 
 class Request(object):
@@ -1130,7 +1211,28 @@ class Chunk(object):
             :returns: the new base or None if no base was given
             :rtype: int or None
         """
-        max_growth = self.maxGrowth(req)
+        return self._trimRequest(req, self.maxGrowth(req), base=base)
+
+    def trimOverGrownRequests(self, requests, base=None):
+        """ Enforce max growth on several requests.
+
+            :param requests: the requests to trim, in the chunk's order
+            :type requests: list of :class:`Request`
+            :keyword base: base unit count to adjust for requests that are
+                           done growing
+            :type base: int
+            :returns: the new base or None if no base was given
+            :rtype: int or None
+
+            The result is the same as calling :meth:`trimOverGrownRequest`
+            for each of the requests in turn.
+        """
+        for req in requests:
+            base = self.trimOverGrownRequest(req, base=base)
+
+        return base
+
+    def _trimRequest(self, req, max_growth, base=None):
         if max_growth and req.growth >= max_growth:
             if req.growth > max_growth:
                 # we've grown beyond the maximum. put some back.
@@ -1178,32 +1280,38 @@ class Chunk(object):
         # all requests in any given growth iteration
         new_base = self.base
         last_pool = 0 # used to track changes to the pool across iterations
+        skip = set(self.skip_list)
         while not self.done and self.pool and last_pool != self.pool:
             last_pool = self.pool    # to keep from getting stuck
             self.base = new_base
-            if uniform:
-                growth = int(last_pool / self.remaining)
 
             log.debug("%d requests and %s (%s) left in chunk",
                         self.remaining, self.pool, self.lengthToSize(self.pool))
-            for p in self.requests:
-                if p.done or p in self.skip_list:
-                    continue
-
-                if not uniform:
-                    # Each request is allocated free units from the pool
-                    # based on the relative _base_ sizes of the remaining
-                    # growable requests.
-                    share = Decimal(p.base) / Decimal(self.base)
-                    growth = int(share * last_pool) # truncate, don't round
 
+            # Each request's growth in an iteration depends only on the pool
+            # and base at the start of the iteration, so all of them can be
+            # worked out before any is applied.
+            requests = [p for p in self.requests
+                        if not p.done and p not in skip]
+            if uniform:
+                growths = [int(last_pool / self.remaining)] * len(requests)
+            else:
+                # Each request is allocated free units from the pool
+                # based on the relative _base_ sizes of the remaining
+                # growable requests.
+                base = Decimal(self.base)
+                growths = [int(Decimal(p.base) / base * last_pool) # truncate, don't round
+                           for p in requests]
+
+            for (p, growth) in zip(requests, growths):
                 p.growth += growth
                 self.pool -= growth
                 log.debug("adding %s (%s) to %d (%s)",
                             growth, self.lengthToSize(growth),
                             p.device.id, p.device.name)
 
-                new_base = self.trimOverGrownRequest(p, base=new_base)
+            new_base = self.trimOverGrownRequests(requests, base=new_base)
+            for p in requests:
                 log.debug("new grow amount for request %d (%s) is %s "
                           "units, or %s",
                             p.device.id, p.device.name, p.growth,
@@ -1213,7 +1321,7 @@ class Chunk(object):
             # allocate any leftovers in pool to the first partition
             # that can still grow
             for p in self.requests:
-                if p.done or p in self.skip_list:
+                if p.done or p in skip:
                     continue
 
                 growth = self.pool
@@ -1319,20 +1427,24 @@ class DiskChunk(Chunk):
             :param req: the request
             :type req: :class:`PartitionRequest`
         """
-        req_end = req.device.partedPartition.geometry.end
         req_start = req.device.partedPartition.geometry.start
 
         # Establish the current total number of sectors of growth for requests
-        # that lie before this one within this chunk. We add the total count
-        # to this request's end sector to obtain the end sector for this
-        # request, including growth of earlier requests but not including
-        # growth of this request. Maximum growth values are obtained using
-        # this end sector and various values for maximum end sector.
+        # that lie before this one within this chunk.
         growth = 0
         for request in self.requests:
             if request.device.partedPartition.geometry.start < req_start:
                 growth += request.growth
-        req_end += growth
+
+        return self._maxGrowth(req, growth)
+
+    def _maxGrowth(self, req, preceding_growth):
+        # We add the total growth of the requests before this one to this
+        # request's end sector to obtain the end sector for this request,
+        # including growth of earlier requests but not including growth of
+        # this request. Maximum growth values are obtained using this end
+        # sector and various values for maximum end sector.
+        req_end = req.device.partedPartition.geometry.end + preceding_growth
 
         # obtain the set of possible maximum sectors-of-growth values for this
         # request and use the smallest
@@ -1354,6 +1466,21 @@ class DiskChunk(Chunk):
         max_growth = min(limits)
         return max_growth
 
+    def trimOverGrownRequests(self, requests, base=None):
+        # A request's maximum growth depends on the growth of the requests
+        # before it, so go through the chunk once from start to end keeping
+        # a running total instead of adding it up again for every request.
+        trim = set(requests)
+        growth = 0
+        for req in sorted(self.requests,
+                          key=lambda r: r.device.partedPartition.geometry.start):
+            if req in trim:
+                base = self._trimRequest(req, self._maxGrowth(req, growth),
+                                         base=base)
+            growth += req.growth
+
+        return base
+
     def lengthToSize(self, length):
         return sectorsToSize(length, self.sectorSize)
 
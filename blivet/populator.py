@@ -23,14 +23,12 @@
 import os
 import re
 import shutil
-import pprint
 import copy
 import parted
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from .callstats import blockdev, call_stats
 
 from .errors import CorruptGPTError, DeviceError, DeviceTreeError, DiskLabelScanError, DuplicateVGError, FSError, InvalidDiskLabelError, LUKSError
 from .devices import BTRFSSubVolumeDevice, BTRFSVolumeDevice, BTRFSSnapShotDevice
@@ -52,9 +50,10 @@ from . import udev
 from . import util
 from .util import open  # pylint: disable=redefined-builtin
 from .flags import flags
-from .storage_log import log_exception_info, log_method_call
+from .storage_log import log_exception_info, log_method_call, lazy_pformat
 from .i18n import _
 from .size import Size
+from .statuscache import statusCache
 
 import logging
 log = logging.getLogger("blivet")
@@ -71,6 +70,25 @@ def parted_exn_handler(exn_type, exn_options, exn_msg):
         ret = parted.EXCEPTION_RESOLVE_YES
     return ret
 
+def _runProbe(probe):
+    """ Run a single probe and return its outcome.
+
+        :param probe: a (fact, path, function) tuple
+        :returns: a (value, exception) tuple, one of which is None
+    """
+    (_fact, path, func) = probe
+    try:
+        return (func(path), None)
+    except Exception as e: # pylint: disable=broad-except
+        return (None, e)
+
+def _udevFormatKey(info):
+    """ Return the udev properties that identify a device's formatting. """
+    return tuple(info.get(prop) for prop in ("ID_FS_TYPE", "ID_FS_UUID",
+                                             "ID_FS_UUID_SUB", "ID_FS_LABEL",
+                                             "ID_PART_TABLE_TYPE",
+                                             "ID_PART_TABLE_UUID"))
+
 class Populator(object):
     def __init__(self, devicetree=None, conf=None, passphrase=None,
                  luksDict=None, iscsi=None, dasd=None):
@@ -122,6 +140,14 @@ class Populator(object):
 
         self._cleanup = False
 
+        # facts gathered concurrently for the batch of devices being added,
+        # keyed by (fact, path) (see _probeDevices)
+        self._probeResults = {}
+
+        # the udev properties describing each device's formatting when it was
+        # last scanned, keyed by sysfs path (see handleUdevEvents)
+        self._formatKeys = {}
+
     def setDiskImages(self, images):
         """ Set the disk images and reflect them in exclusiveDisks.
 
@@ -238,7 +264,7 @@ class Populator(object):
         name = udev.device_get_name(info)
         sysfs_path = udev.device_get_sysfs_path(info)
         slave_dir = os.path.normpath("%s/slaves" % sysfs_path)
-        slave_names = os.listdir(slave_dir)
+        slave_names = udev.backend.listdir(slave_dir)
         slave_devices = []
         if not slave_names:
             log.error("no slaves found for %s", name)
@@ -246,7 +272,7 @@ class Populator(object):
 
         for slave_name in slave_names:
             path = os.path.normpath("%s/%s" % (slave_dir, slave_name))
-            slave_info = udev.get_device(os.path.realpath(path))
+            slave_info = udev.get_device(udev.backend.realpath(path))
 
             # cciss in sysfs is "cciss!cXdYpZ" but we need "cciss/cXdYpZ"
             slave_name = udev.device_get_name(slave_info).replace("!", "/")
@@ -481,8 +507,8 @@ class Populator(object):
         serial = udev.device_get_serial(info)
         bus = udev.device_get_bus(info)
 
-        vendor = util.get_sysfs_attr(sysfs_path, "device/vendor")
-        model = util.get_sysfs_attr(sysfs_path, "device/model")
+        vendor = udev.get_sysfs_attr(sysfs_path, "device/vendor")
+        model = udev.get_sysfs_attr(sysfs_path, "device/model")
 
         kwargs = { "serial": serial, "vendor": vendor, "model": model, "bus": bus }
         if udev.device_is_iscsi(info) and not self._cleanup:
@@ -592,7 +618,7 @@ class Populator(object):
         log_method_call(self, name=name)
         sysfs_path = udev.device_get_sysfs_path(info)
         sys_file = "%s/loop/backing_file" % sysfs_path
-        backing_file = open(sys_file).read().strip()
+        backing_file = udev.backend.read(sys_file).strip()
         file_device = self.getDeviceByName(backing_file)
         if not file_device:
             file_device = FileDevice(backing_file, exists=True)
@@ -620,7 +646,7 @@ class Populator(object):
             will not be updated unless updateOrigFmt is True.
         """
         name = udev.device_get_name(info)
-        log_method_call(self, name=name, info=pprint.pformat(dict(info)))
+        log_method_call(self, name=name, info=lazy_pformat(info, dict))
         uuid = udev.device_get_uuid(info)
         sysfs_path = udev.device_get_sysfs_path(info)
 
@@ -682,7 +708,8 @@ class Populator(object):
                 device = None
 
         if device and device.isDisk and \
-           blockdev.mpath.is_mpath_member(device.path):
+           self._probed("mpath_member", device.path,
+                        blockdev.mpath.is_mpath_member):
             # newly added device (eg iSCSI) could make this one a multipath member
             if device.format and device.format.type != "multipath_member":
                 log.debug("%s newly detected as multipath member, dropping old format and removing kids", device.name)
@@ -732,7 +759,7 @@ class Populator(object):
 
         # If this device is read-only, mark it as such now.
         if self.udevDeviceIsDisk(info) and \
-                util.get_sysfs_attr(udev.device_get_sysfs_path(info), 'ro') == '1':
+                udev.get_sysfs_attr(udev.device_get_sysfs_path(info), 'ro') == '1':
             device.readonly = True
 
         # If this device is protected, mark it as such now. Once the tree
@@ -871,8 +898,8 @@ class Populator(object):
     def handleVgLvs(self, vg_device):
         """ Handle setup of the LV's in the vg_device. """
         vg_name = vg_device.name
-        lv_info = dict((k, v) for (k, v) in iter(self.devicetree.lvInfo.items())
-                                if v.vg_name == vg_name)
+        lvm_report = self.devicetree.lvmReport
+        lv_info = lvm_report.getVGLVs(vg_name)
 
         self.names.extend(n for n in lv_info.keys() if n not in self.names)
 
@@ -932,7 +959,7 @@ class Populator(object):
 
             if lv_attr[0] in 'Ss':
                 log.info("found lvm snapshot volume '%s'", name)
-                origin_name = blockdev.lvm.lvorigin(vg_name, lv_name)
+                origin_name = lv.origin if lvm_report.relations else blockdev.lvm.lvorigin(vg_name, lv_name)
                 if not origin_name:
                     log.error("lvm snapshot '%s-%s' has unknown origin",
                                 vg_name, lv_name)
@@ -963,11 +990,16 @@ class Populator(object):
                 lv_class = LVMThinPoolDevice
             elif lv_attr[0] == 'V':
                 # thin volume
-                pool_name = blockdev.lvm.thlvpoolname(vg_name, lv_name)
+                if lvm_report.relations:
+                    pool_name = lv.pool_lv
+                    origin_name = lv.origin
+                else:
+                    pool_name = blockdev.lvm.thlvpoolname(vg_name, lv_name)
+                    origin_name = blockdev.lvm.lvorigin(vg_name, lv_name)
+
                 pool_device_name = "%s-%s" % (vg_name, pool_name)
                 addRequiredLV(pool_device_name, "failed to look up thin pool")
 
-                origin_name = blockdev.lvm.lvorigin(vg_name, lv_name)
                 if origin_name:
                     origin_device_name = "%s-%s" % (vg_name, origin_name)
                     addRequiredLV(origin_device_name, "failed to locate origin lv")
@@ -1075,7 +1107,7 @@ class Populator(object):
         # assign parents to internal LVs (and vice versa, see
         # :class:`~.devices.lvm.LVMInternalLogicalVolumeDevice`)
         for lv in orphan_lvs.values():
-            parent_lv = lvm.determine_parent_lv(vg_name, lv, all_lvs)
+            parent_lv = lvm.determine_parent_lv(vg_name, lv, all_lvs, report=lvm_report)
             if parent_lv:
                 lv.parent_lv = parent_lv
             else:
@@ -1134,7 +1166,7 @@ class Populator(object):
     def handleUdevMDMemberFormat(self, info, device):
         # pylint: disable=unused-argument
         log_method_call(self, name=device.name, type=device.format.type)
-        md_info = blockdev.md.examine(device.path)
+        md_info = self._probed("md_examine", device.path, blockdev.md.examine)
 
         # Use mdadm info if udev info is missing
         md_uuid = md_info.uuid
@@ -1325,6 +1357,8 @@ class Populator(object):
         if not info:
             log.debug("no information for device %s", device.name)
             return
+
+        self._formatKeys[udev.device_get_sysfs_path(info)] = _udevFormatKey(info)
         if not device.mediaPresent:
             log.debug("no media present for device %s", device.name)
             return
@@ -1335,7 +1369,8 @@ class Populator(object):
         format_type = udev.device_get_format(info)
         serial = udev.device_get_serial(info)
 
-        is_multipath_member = blockdev.mpath.is_mpath_member(device.path)
+        is_multipath_member = self._probed("mpath_member", device.path,
+                                           blockdev.mpath.is_mpath_member)
         if is_multipath_member:
             format_type = "multipath_member"
 
@@ -1371,8 +1406,14 @@ class Populator(object):
 
         # set up type-specific arguments for the format constructor
         if format_type == "crypto_LUKS":
-            # luks/dmcrypt
-            kwargs["name"] = "luks-%s" % uuid
+            # luks/dmcrypt; the uuid in the header is the one cryptsetup uses
+            try:
+                kwargs["uuid"] = self._probed("luks_uuid", device.path,
+                                              blockdev.crypto.luks_uuid)
+            except blockdev.CryptoError as e:
+                log.warning("failed to read luks header of %s: %s", name, e)
+
+            kwargs["name"] = "luks-%s" % kwargs["uuid"]
         elif format_type in formats.mdraid.MDRaidMember._udevTypes:
             # mdraid
             try:
@@ -1463,6 +1504,138 @@ class Populator(object):
 
         self.handleUdevDeviceFormat(info, device)
 
+    def recordUdevFormats(self):
+        """ Note the current udev view of the formatting of known devices.
+
+            This is used after changes made by this process, so that the
+            uevents they caused are not mistaken for outside changes.
+        """
+        self._formatKeys.clear()
+        for info in udev.get_devices():
+            sysfs_path = udev.device_get_sysfs_path(info)
+            if self.devicetree.getDeviceBySysfsPath(sysfs_path, incomplete=True,
+                                                    hidden=True):
+                self._formatKeys[sysfs_path] = _udevFormatKey(info)
+
+    def _hasPendingActions(self, device):
+        """ Return True if there are actions on device or its dependents. """
+        return any(a.device is device or a.device.dependsOn(device)
+                   for a in self.devicetree.actions)
+
+    def _removeUdevDevice(self, device):
+        """ Remove a device that has gone away, along with its dependents. """
+        log_method_call(self, name=device.name)
+        if self._hasPendingActions(device):
+            log.warning("not removing %s from the tree: it has pending actions",
+                        device.name)
+            return
+
+        self.devicetree.recursiveRemove(device, actions=False)
+        if self.devicetree._isInTree(device):
+            # disks are only stripped of their formatting by recursiveRemove
+            self.devicetree._removeDevice(device)
+
+    def _refreshUdevDeviceFormat(self, info, device):
+        """ Rescan the formatting of a device that changed outside of blivet.
+
+            :returns: whether the device's formatting was rescanned
+            :rtype: bool
+
+            The device's dependents are removed from the tree. Those that still
+            exist are added again as the device's formatting is rescanned or
+            by the caller.
+        """
+        log_method_call(self, name=device.name)
+        if self._hasPendingActions(device):
+            log.warning("not rescanning %s: it has pending actions", device.name)
+            return False
+
+        for child in self.devicetree.getChildren(device):
+            self.devicetree.recursiveRemove(child, actions=False)
+
+        if not device.formatImmutable:
+            device.format = None
+
+        # facts probed before the change no longer apply
+        for fact in [k for k in self._probeResults if k[1] == device.path]:
+            del self._probeResults[fact]
+
+        self.handleUdevDeviceFormat(info, device)
+        device.originalFormat = copy.deepcopy(device.format)
+        device.deviceLinks = udev.device_get_symlinks(info)
+        return True
+
+    def _formatChanged(self, sysfs_path, info):
+        """ Whether udev info shows formatting other than that last recorded. """
+        key = _udevFormatKey(info)
+        return self._formatKeys.get(sysfs_path, key) != key
+
+    def _isLVMEvent(self, info):
+        """ Whether a uevent may reflect a change to LVM configuration. """
+        if udev.device_is_dm_lvm(info):
+            return True
+
+        keys = (_udevFormatKey(info),
+                self._formatKeys.get(udev.device_get_sysfs_path(info), ()))
+        return any(key and key[0] == "LVM2_member" for key in keys)
+
+    def handleUdevEvents(self, events):
+        """ Update the tree to reflect a batch of uevents.
+
+            :param events: (action, device) pairs, oldest first
+            :type events: list of (str, :class:`pyudev.Device`)
+
+            Removed devices are removed from the tree along with their
+            dependents. Devices whose formatting has changed are rescanned.
+            New devices are added once all other events have been applied, in
+            the order udev lists them. Devices with pending actions are left
+            alone.
+        """
+        if any(self._isLVMEvent(info) for (_action, info) in events):
+            self.devicetree.dropLVMCache()
+
+        added = OrderedDict()
+        refreshed = []
+        for (action, info) in events:
+            name = udev.device_get_name(info)
+            sysfs_path = udev.device_get_sysfs_path(info)
+            log.info("uevent: %s %s (%s)", action, name, sysfs_path)
+            device = self.devicetree.getDeviceBySysfsPath(sysfs_path,
+                                                          incomplete=True,
+                                                          hidden=True)
+            if device:
+                statusCache.invalidate(device.ancestors + device.descendants)
+
+            if action == "remove":
+                added.pop(sysfs_path, None)
+                self._formatKeys.pop(sysfs_path, None)
+                if device and self.devicetree._isInTree(device):
+                    self._removeUdevDevice(device)
+            elif device is None:
+                added[sysfs_path] = info
+            elif action == "change" and self.devicetree._isInTree(device) and \
+                 self._formatChanged(sysfs_path, info):
+                # the event may predate further changes, eg: ones made by
+                # blivet itself, so act on the device's current state
+                info = udev.get_device(sysfs_path)
+                if info is not None and self._formatChanged(sysfs_path, info) and \
+                   self._refreshUdevDeviceFormat(info, device):
+                    refreshed.append(sysfs_path)
+
+        # devices like partitions only get add events when they first appear,
+        # so look up those that sit below rescanned devices
+        if refreshed:
+            for info in udev.get_devices():
+                sysfs_path = udev.device_get_sysfs_path(info)
+                if any(sysfs_path.startswith(p + "/") for p in refreshed):
+                    added.setdefault(sysfs_path, info)
+
+        for (sysfs_path, info) in added.items():
+            if not self.devicetree.getDeviceBySysfsPath(sysfs_path,
+                                                        incomplete=True,
+                                                        hidden=True):
+                self.addUdevDevice(info)
+
     def _handleInconsistencies(self):
         for vg in [d for d in self.devicetree.devices if d.type == "lvmvg"]:
             if vg.complete:
@@ -1578,6 +1751,87 @@ class Populator(object):
         self.__luksDevs[device.format.uuid] = passphrase
         self.__passphrases.append(passphrase)
 
+    def _getProbes(self, info):
+        """ Return the probes to run for a udev device.
+
+            :param :class:`pyudev.Device` info: udev info for the device
+            :returns: a list of (fact, path, function) tuples
+            :rtype: list
+
+            Only facts that do not depend on the state of the device tree and
+            that are not changed by adding devices to it are probed.
+        """
+        path = udev.device_get_devname(info)
+        if not path or udev.device_is_dm(info) or udev.device_is_md(info) or \
+           udev.device_is_loop(info):
+            return []
+
+        probes = [("mpath_member", path, blockdev.mpath.is_mpath_member)]
+        format_type = udev.device_get_format(info)
+        if format_type in formats.mdraid.MDRaidMember._udevTypes:
+            probes.append(("md_examine", path, blockdev.md.examine))
+        elif format_type == "crypto_LUKS":
+            probes.append(("luks_uuid", path, blockdev.crypto.luks_uuid))
+
+        return probes
+
+    def _probeDevices(self, devices):
+        """ Gather facts about new devices concurrently.
+
+            :param devices: udev info for the devices that are about to be added
+            :type devices: list of :class:`pyudev.Device`
+
+            The probes run in a pool of at most :attr:`~.flags.Flags.probe_workers`
+            threads. The devices are still added to the tree one at a time,
+            in order, by the calling thread, which looks up the results by
+            way of :meth:`_probed`. Results from earlier batches are dropped,
+            since adding devices may change the facts.
+        """
+        self._probeResults.clear()
+        if flags.probe_workers < 2:
+            return
+
+        probes = []
+        for info in devices:
+            probes.extend(self._getProbes(info))
+
+        if len(probes) < 2:
+            return
+
+        log.info("probing %d devices using %d threads", len(devices),
+                 min(flags.probe_workers, len(probes)))
+        pool = ThreadPool(min(flags.probe_workers, len(probes)))
+        try:
+            results = pool.map(call_stats.inCurrentPhase(_runProbe), probes)
+        finally:
+            pool.close()
+            pool.join()
+
+        for (probe, result) in zip(probes, results):
+            self._probeResults[probe[:2]] = result
+
+    def _probed(self, fact, path, func):
+        """ Return the probed value of a fact, or obtain it now.
+
+            :param str fact: the name of the fact
+            :param str path: the device node path the fact is about
+            :param func: a function that takes path and returns the fact
+            :returns: the value returned by func, now or during probing
+
+            Exceptions raised by func during probing are raised here. A
+            probed value is only used once, when the device is added, so
+            later checks of the same fact obtain it again.
+        """
+        result = self._probeResults.pop((fact, path), None)
+        if result is None:
+            return func(path)
+
+        (value, exc) = result
+        if exc is not None:
+            raise exc
+
+        return value
+
     def populate(self, cleanupOnly=False):
         """ Locate all storage devices.
 
@@ -1594,12 +1848,14 @@ class Populator(object):
 
         parted.register_exn_handler(parted_exn_handler)
         try:
-            self._populate()
+            with call_stats.phase("populate"):
+                self._populate()
         except Exception:
             raise
         finally:
             parted.clear_exn_handler()
             self.restoreConfigs()
+            self._probeResults.clear()
 
     def _populate(self):
         log.info("DeviceTree.populate: ignoredDisks is %s ; exclusiveDisks is %s",
@@ -1615,6 +1871,7 @@ class Populator(object):
         # mark the tree as unpopulated so exception handlers can tell the
         # exception originated while finding storage devices
         self.populated = False
+        self._probeResults.clear()
 
         # resolve the protected device specs to device names
         for spec in self.protectedDevSpecs:
@@ -1656,6 +1913,7 @@ class Populator(object):
                 break
 
             log.info("devices to scan: %s", [udev.device_get_name(d) for d in devices])
+            self._probeDevices(devices)
             for dev in devices:
                 self.addUdevDevice(dev)
 
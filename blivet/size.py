@@ -156,6 +156,17 @@ def parseUnits(spec, xlate):
 
     return None
 
+_SPEC_RE = re.compile(
+   r"""(?P<numeric> # the numeric part consists of three parts, below
+       (-|\+)? # optional sign character
+       (?P<base>([0-9\.]+)) # the base
+       (?P<exp>(e|E)(-|\+)[0-9]+)?) # optional exponent
+       \s* # whitespace
+       (?P<rest>[^\s]*$) # the units specification
+    """,
+    re.VERBOSE
+)
+
 def parseSpec(spec):
     """ Parse string representation of size.
 
@@ -178,7 +189,7 @@ def parseSpec(spec):
     if radix != '.':
         spec = spec.replace(radix, '.')
 
-    # The purpose of this regular expression is to distinguish
+    # The purpose of _SPEC_RE is to distinguish
     # between the numeric part and the part that specifies the units.
     # The regular expression that matches the numeric part of the spec
     # should recognize all valid numbers and should not include any part
@@ -190,17 +201,7 @@ def parseSpec(spec):
     # part will match "0.9.9". This is not a valid number, but that will
     # be detected when an exception is raised during conversion of the numeric
     # part to a numeric value.
-    spec_re = re.compile(
-       r"""(?P<numeric> # the numeric part consists of three parts, below
-           (-|\+)? # optional sign character
-           (?P<base>([0-9\.]+)) # the base
-           (?P<exp>(e|E)(-|\+)[0-9]+)?) # optional exponent
-           \s* # whitespace
-           (?P<rest>[^\s]*$) # the units specification
-        """,
-        re.VERBOSE
-    )
-    m = re.match(spec_re, spec.strip())
+    m = _SPEC_RE.match(spec.strip())
     if not m:
         raise ValueError("invalid size specification", spec)
 
@@ -267,7 +268,10 @@ class Size(Decimal):
             If you want to use a spec value to represent a bytes value,
             you can use the letter 'b' or 'B' or omit the size specifier.
         """
-        if isinstance(value, (six.string_types, bytes)):
+        if isinstance(value, _INTEGRAL_TYPES):
+            # no partial bytes to drop
+            return Decimal.__new__(cls, value=value, context=context)
+        elif isinstance(value, (six.string_types, bytes)):
             size = parseSpec(value)
         elif isinstance(value, (six.integer_types, float, Decimal)):
             size = Decimal(value)
@@ -295,7 +299,8 @@ class Size(Decimal):
         return "Size('%s')" % self
 
     def __deepcopy__(self, memo):
-        return Size(self.convertTo())
+        # Size instances are immutable
+        return self
 
     # pickling support for Size
     # see https://docs.python.org/3/library/pickle.html#object.__reduce__
@@ -303,16 +308,28 @@ class Size(Decimal):
         return (self.__class__, (self.convertTo(),))
 
     def __add__(self, other, context=None):
+        if isinstance(other, _INTEGRAL_TYPES):
+            return _newSize(Decimal.__add__(self, other))
+
         return Size(Decimal.__add__(self, other))
 
     # needed to make sum() work with Size arguments
     def __radd__(self, other, context=None):
+        if isinstance(other, _INTEGRAL_TYPES):
+            return _newSize(Decimal.__radd__(self, other))
+
         return Size(Decimal.__radd__(self, other))
 
     def __sub__(self, other, context=None):
+        if isinstance(other, _INTEGRAL_TYPES):
+            return _newSize(Decimal.__sub__(self, other))
+
         return Size(Decimal.__sub__(self, other))
 
     def __mul__(self, other, context=None):
+        if isinstance(other, _INTEGRAL_TYPES):
+            return _newSize(Decimal.__mul__(self, other))
+
         return Size(Decimal.__mul__(self, other))
     __rmul__ = __mul__
 
@@ -325,12 +342,21 @@ class Size(Decimal):
             raise AttributeError
 
     def __truediv__(self, other, context=None):
+        if isinstance(other, _INTEGRAL_TYPES):
+            return _newSize(Decimal.__truediv__(self, other).to_integral_value(rounding=ROUND_DOWN))
+
         return Size(Decimal.__truediv__(self, other))
 
     def __floordiv__(self, other, context=None):
+        if isinstance(other, _INTEGRAL_TYPES):
+            return _newSize(Decimal.__floordiv__(self, other))
+
         return Size(Decimal.__floordiv__(self, other))
 
     def __mod__(self, other, context=None):
+        if isinstance(other, _INTEGRAL_TYPES):
+            return _newSize(Decimal.__mod__(self, other))
+
         return Size(Decimal.__mod__(self, other))
 
     def convertTo(self, spec=None):
@@ -447,4 +473,14 @@ class Size(Decimal):
             raise ValueError("invalid rounding unit: %s" % factor)
 
         rounded = (Decimal(self) / factor).to_integral_value(rounding=rounding)
-        return Size(rounded * factor)
+        return _newSize(rounded * factor)
+
+_INTEGRAL_TYPES = (Size,) + six.integer_types
+
+def _newSize(value):
+    """ Return a Size for an integral Decimal value.
+
+        Arithmetic on Size and integer operands always has an integral result,
+        so there is no need for the conversions done by :meth:`Size.__new__`.
+    """
+    return Decimal.__new__(Size, value)
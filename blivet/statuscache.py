@@ -0,0 +1,115 @@
+# statuscache.py
+# Device status cache.
+#
+# Copyright (C) 2015  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+from contextlib import contextmanager
+from threading import Lock
+
+class StatusCache(object):
+    """ Cache of device status values.
+
+        Probing the status of md, dm and lvm devices means reading sysfs or
+        asking libblockdev, and the same devices' status is checked many
+        times while actions are processed. Within a pass (see :meth:`cached`)
+        each device's status is probed once and then remembered until
+        something changes it: the device or a related device being set up,
+        torn down, created or destroyed, a format being set up or torn down,
+        or a uevent for the device.
+
+        Outside of a pass every status is probed when it is read.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._passes = 0
+        self._generation = 0
+        self._statuses = {}
+
+        self.probes = 0
+        """ number of times a status was probed during a pass """
+
+        self.hits = 0
+        """ number of times a status was taken from the cache """
+
+    @property
+    def active(self):
+        """ Whether statuses are currently being cached. """
+        return self._passes > 0
+
+    @contextmanager
+    def cached(self):
+        """ Cache device statuses for as long as the context is active.
+
+            Nested contexts share the outermost one's cache, which is
+            discarded when the outermost context exits.
+        """
+        with self._lock:
+            self._passes += 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._passes -= 1
+                if not self._passes:
+                    self._statuses.clear()
+
+    def get(self, device, probe):
+        """ Return a device's status.
+
+            :param device: the device
+            :type device: :class:`~.devices.Device`
+            :param probe: a function that returns the device's actual status
+            :returns: the cached status or the return value of probe
+        """
+        if not self._passes:
+            return probe()
+
+        with self._lock:
+            if device.id in self._statuses:
+                self.hits += 1
+                return self._statuses[device.id]
+
+            self.probes += 1
+            generation = self._generation
+
+        status = probe()
+
+        with self._lock:
+            # don't remember a status that may have changed while probing
+            if self._passes and generation == self._generation:
+                self._statuses[device.id] = status
+
+        return status
+
+    def invalidate(self, devices=None):
+        """ Forget cached statuses.
+
+            :keyword devices: the devices whose status may have changed, or
+                              None to forget every device's status
+            :type devices: list of :class:`~.devices.Device`
+        """
+        with self._lock:
+            self._generation += 1
+            if devices is None:
+                self._statuses.clear()
+            else:
+                for device in devices:
+                    self._statuses.pop(device.id, None)
+
+statusCache = StatusCache()
@@ -1,25 +1,78 @@
-import inspect
 import logging
+import pprint
 import sys
 import traceback
 
 log = logging.getLogger("blivet")
 log.addHandler(logging.NullHandler())
 
+IGNORED_FUNCS = frozenset(["function_name_and_depth",
+                           "log_method_call",
+                           "log_method_return"])
+
+# levels of the Logger methods that may be passed to log_exception_info
+_LOG_FUNC_LEVELS = {"debug": logging.DEBUG,
+                    "info": logging.INFO,
+                    "warning": logging.WARNING,
+                    "error": logging.ERROR,
+                    "critical": logging.CRITICAL}
+
 def function_name_and_depth():
-    IGNORED_FUNCS = ["function_name_and_depth",
-                     "log_method_call",
-                     "log_method_return"]
-    stack = inspect.stack()
+    """ Return the name and stack depth of the function being logged.
+
+        The logging helpers in this module are skipped when looking for the
+        function. Only the frame objects are walked, so this is much cheaper
+        than :func:`inspect.stack`, which also reads source code context.
+    """
+    # pylint: disable=protected-access
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_name in IGNORED_FUNCS:
+        frame = frame.f_back
+
+    if frame is None:
+        return ("unknown function?", 0)
+
+    methodname = frame.f_code.co_name
+    depth = 0
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+
+    return (methodname, depth)
+
+class _LazyPFormat(object):
+    """ Defer pretty-printing an object until it is actually logged. """
+    __slots__ = ["obj", "transform"]
+
+    def __init__(self, obj, transform=None):
+        self.obj = obj
+        self.transform = transform
 
-    for i, frame in enumerate(stack):
-        methodname = frame[3]
-        if methodname not in IGNORED_FUNCS:
-            return (methodname, len(stack) - i)
+    def __str__(self):
+        obj = self.obj
+        if self.transform is not None:
+            obj = self.transform(obj)
 
-    return ("unknown function?", 0)
+        return pprint.pformat(obj)
+
+    __repr__ = __str__
+
+def lazy_pformat(obj, transform=None):
+    """ Return an object that pretty-prints obj when converted to a string.
+
+        :param obj: the object to pretty-print
+        :keyword transform: a function to apply to obj before formatting it
+        :type transform: callable or NoneType
+
+        Use this rather than :func:`pprint.pformat` for logging arguments so
+        that the formatting only happens if the message is emitted.
+    """
+    return _LazyPFormat(obj, transform=transform)
 
 def log_method_call(d, *args, **kwargs):
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+
     classname = d.__class__.__name__
     (methodname, depth) = function_name_and_depth()
     spaces = depth * ' '
@@ -39,6 +92,9 @@ def log_method_call(d, *args, **kwargs):
     log.debug(fmt, *fmt_args)
 
 def log_method_return(d, retval):
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+
     classname = d.__class__.__name__
     (methodname, depth) = function_name_and_depth()
     spaces = depth * ' '
@@ -62,6 +118,12 @@ def log_exception_info(log_func=log.debug, fmt_str=None, fmt_args=None, ignored=
        Note: If the ignored flag is set, each line of the exception information
        is prepended with an 'IGNORED' prefix.
     """
+    logger = getattr(log_func, "__self__", None)
+    level = _LOG_FUNC_LEVELS.get(getattr(log_func, "__name__", None))
+    if isinstance(logger, logging.Logger) and level is not None and \
+       not logger.isEnabledFor(level):
+        return
+
     fmt_args = fmt_args or []
     (_methodname, depth) = function_name_and_depth()
     indent = depth * ' '
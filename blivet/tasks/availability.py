@@ -25,10 +25,7 @@ import hawkey
 
 from six import add_metaclass
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from ..callstats import blockdev
 
 from .. import util
 from ..errors import AvailabilityError
@@ -269,6 +266,7 @@ FSCK_HFSPLUS_APP = application("fsck.hfsplus")
 HFORMAT_APP = application("hformat")
 JFSTUNE_APP = application("jfs_tune")
 KPARTX_APP = application("kpartx")
+LVM_APP = application("lvm")
 MKDOSFS_APP = application("mkdosfs")
 MKE2FS_APP = application_by_package("mke2fs", E2FSPROGS_PACKAGE)
 MKFS_BTRFS_APP = application("mkfs.btrfs")
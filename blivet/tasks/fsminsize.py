@@ -80,11 +80,15 @@ class Ext2FSMinSize(FSMinSize):
         return [self.fs._info]
 
     def _extractBlockSize(self):
-        """ Extract block size from filesystem info.
+        """ Extract block size from filesystem superblock or info.
 
             :returns: block size of fileystem or None
             :rtype: :class:`~.size.Size` or NoneType
         """
+        superblock = self.fs._current_superblock
+        if superblock is not None and superblock.blockSize:
+            return Size(superblock.blockSize)
+
         if self.fs._current_info is None:
             return None
 
@@ -62,6 +62,11 @@ class FSSize(fstask.FSTask):
             :rtype: :class:`~.size.Size`
             :raises FSError: on failure
         """
+        # Prefer the size recorded in the superblock, if it was read.
+        superblock = self.fs._current_superblock
+        if superblock is not None and superblock.size is not None:
+            return superblock.size
+
         error_msgs = self.availabilityErrors
         if error_msgs:
             raise FSError("\n".join(error_msgs))
@@ -0,0 +1,259 @@
+# fssuperblock.py
+# Filesystem superblock reading classes.
+#
+# Copyright (C) 2015  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+
+import abc
+import os
+import struct
+import uuid
+from collections import namedtuple
+
+import six
+from six import add_metaclass
+
+from ..errors import FSError
+from ..size import Size
+from .. import util
+
+from . import fstask
+
+_superblock_fields = ("blockSize", "blockCount", "freeBlocks", "uuid", "label")
+class Superblock(namedtuple("Superblock", _superblock_fields)):
+    """ Information read directly from a filesystem's superblock.
+
+        Any of the fields may be None if the superblock does not record it.
+    """
+    __slots__ = ()
+
+    @property
+    def size(self):
+        """ The size of the filesystem, or None.
+
+            :rtype: :class:`~.size.Size` or NoneType
+        """
+        if not self.blockSize or not self.blockCount:
+            return None
+        return Size(self.blockSize * self.blockCount)
+
+    @property
+    def free(self):
+        """ The free space in the filesystem, or None.
+
+            :rtype: :class:`~.size.Size` or NoneType
+        """
+        if not self.blockSize or self.freeBlocks is None:
+            return None
+        return Size(self.blockSize * self.freeBlocks)
+
+# The primary superblocks of all of the supported filesystems lie within the
+# first 64 KiB of the device, plus 4 KiB for the btrfs one. Reading all of it
+# at once means only a single read per device.
+_BTRFS_OFFSET = 64 * 1024
+READ_SIZE = _BTRFS_OFFSET + 4096
+
+def _unpack(fmt, data, offset):
+    return struct.unpack_from(fmt, data, offset)[0]
+
+def _label(data, offset, length):
+    label = data[offset:offset + length].split(b"\0", 1)[0]
+    return label.decode("utf-8", "replace") if six.PY3 else label
+
+def _uuid(data, offset):
+    return str(uuid.UUID(bytes=bytes(data[offset:offset + 16])))
+
+def _parse_ext2(data):
+    sb = data[1024:2048]
+    if _unpack("<H", sb, 56) != 0xEF53:
+        return None
+
+    blockSize = 1024 << _unpack("<I", sb, 24)
+    blockCount = _unpack("<I", sb, 4)
+    freeBlocks = _unpack("<I", sb, 12)
+    if _unpack("<I", sb, 96) & 0x80:
+        # 64bit feature: the high halves of the block counts are valid
+        blockCount += _unpack("<I", sb, 336) << 32
+        freeBlocks += _unpack("<I", sb, 344) << 32
+
+    return Superblock(blockSize, blockCount, freeBlocks, _uuid(sb, 104),
+                      _label(sb, 120, 16))
+
+def _parse_xfs(data):
+    if data[0:4] != b"XFSB":
+        return None
+
+    # sb_fdblocks is only an approximation on filesystems with lazy
+    # superblock counters, which is good enough for reporting free space.
+    return Superblock(_unpack(">I", data, 4), _unpack(">Q", data, 8),
+                      _unpack(">Q", data, 144), _uuid(data, 32),
+                      _label(data, 108, 12))
+
+def _parse_btrfs(data):
+    sb = data[_BTRFS_OFFSET:]
+    if sb[64:72] != b"_BHRfS_M":
+        return None
+
+    total = _unpack("<Q", sb, 0x70)
+    used = _unpack("<Q", sb, 0x78)
+    sectorSize = _unpack("<I", sb, 0x90)
+    if not sectorSize:
+        return None
+
+    return Superblock(sectorSize, total // sectorSize,
+                      (total - used) // sectorSize, _uuid(sb, 0x20),
+                      _label(sb, 0x12b, 256))
+
+def _parse_vfat(data):
+    if data[510:512] != b"\x55\xaa":
+        return None
+
+    sectorSize = _unpack("<H", data, 11)
+    clusterSectors = _unpack("<B", data, 13)
+    if sectorSize not in (512, 1024, 2048, 4096) or not clusterSectors:
+        return None
+
+    sectors = _unpack("<H", data, 19) or _unpack("<I", data, 32)
+    freeBlocks = None
+    if _unpack("<H", data, 22) == 0:
+        # FAT32: free cluster count is kept in the FSInfo sector, if at all
+        serial = _unpack("<I", data, 67)
+        fsinfo = _unpack("<H", data, 48) * sectorSize
+        if data[fsinfo:fsinfo + 4] == b"RRaA" and \
+           data[fsinfo + 484:fsinfo + 488] == b"rrAa":
+            freeClusters = _unpack("<I", data, fsinfo + 488)
+            if freeClusters != 0xFFFFFFFF:
+                freeBlocks = freeClusters * clusterSectors
+    else:
+        serial = _unpack("<I", data, 39)
+
+    # The label in the boot sector may be stale; the authoritative one is
+    # the volume label entry in the root directory, so leave that to the
+    # label reading application.
+    return Superblock(sectorSize, sectors, freeBlocks,
+                      "%04X-%04X" % (serial >> 16, serial & 0xFFFF), None)
+
+def _parse_swap(data):
+    pageSize = next((p for p in (4096, 8192, 16384, 32768, 65536)
+                     if data[p - 10:p] in (b"SWAPSPACE2", b"SWAP-SPACE")),
+                    None)
+    if pageSize is None:
+        return None
+
+    return Superblock(pageSize, _unpack("<I", data, 1028) + 1, None,
+                      _uuid(data, 1036), _label(data, 1052, 16))
+
+_parsers = {"ext2": _parse_ext2,
+            "ext3": _parse_ext2,
+            "ext4": _parse_ext2,
+            "xfs": _parse_xfs,
+            "btrfs": _parse_btrfs,
+            "vfat": _parse_vfat,
+            "swap": _parse_swap}
+
+def parse_superblock(data, fstype):
+    """ Extract information from the start of a device.
+
+        :param bytes data: the first :data:`READ_SIZE` bytes of the device
+        :param str fstype: the type of filesystem to look for
+        :returns: the superblock information, or None if there is no valid
+                  superblock of that type
+        :rtype: :class:`Superblock` or NoneType
+        :raises ValueError: if the type of filesystem is not supported
+    """
+    parser = _parsers.get(fstype)
+    if parser is None:
+        raise ValueError("no superblock parser for %s" % fstype)
+
+    try:
+        return parser(data)
+    except (struct.error, ValueError):
+        # truncated or corrupt superblock
+        return None
+
+def read_superblock(device, fstype):
+    """ Read the superblock of a filesystem from a device.
+
+        :param str device: path to the device node
+        :param str fstype: the type of filesystem to look for
+        :returns: the superblock information, or None if there is no valid
+                  superblock of that type
+        :rtype: :class:`Superblock` or NoneType
+        :raises OSError: if the device can not be read
+    """
+    fd = util.eintr_retry_call(os.open, device, os.O_RDONLY)
+    try:
+        if hasattr(os, "pread"):
+            data = util.eintr_retry_call(os.pread, fd, READ_SIZE, 0)
+        else:
+            data = util.eintr_retry_call(os.read, fd, READ_SIZE)
+    finally:
+        os.close(fd)
+
+    return parse_superblock(data, fstype)
+
+@add_metaclass(abc.ABCMeta)
+class FSSuperblock(fstask.FSTask):
+    """ An abstract class that represents reading a filesystem's superblock
+        without running any external application.
+    """
+    description = "read filesystem superblock"
+
+    fstype = abc.abstractproperty(doc="The superblock format to look for.")
+
+    # TASK methods
+
+    @property
+    def _availabilityErrors(self):
+        return []
+
+    @property
+    def dependsOn(self):
+        return []
+
+    # IMPLEMENTATION methods
+
+    def doTask(self):
+        """ Returns the information in the filesystem's superblock.
+
+            :returns: the superblock information
+            :rtype: :class:`Superblock`
+            :raises FSError: if the superblock can not be read
+        """
+        try:
+            sb = read_superblock(self.fs.device, self.fstype)
+        except OSError as e:
+            raise FSError("failed to read superblock: %s" % e)
+
+        if sb is None:
+            raise FSError("no %s superblock found on %s" % (self.fstype, self.fs.device))
+
+        return sb
+
+class Ext2FSSuperblock(FSSuperblock):
+    fstype = "ext2"
+
+class BTRFSSuperblock(FSSuperblock):
+    fstype = "btrfs"
+
+class FATFSSuperblock(FSSuperblock):
+    fstype = "vfat"
+
+class XFSSuperblock(FSSuperblock):
+    fstype = "xfs"
+
+class UnimplementedFSSuperblock(fstask.UnimplementedFSTask):
+    pass
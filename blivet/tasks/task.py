@@ -23,6 +23,8 @@ import abc
 
 from six import add_metaclass
 
+from .. import util
+
 @add_metaclass(abc.ABCMeta)
 class Task(object):
     """ An abstract class that represents some task. """
@@ -59,6 +61,20 @@ class Task(object):
         """ Do the task for this class. """
         raise NotImplementedError()
 
+    def doTaskAsync(self, *args, **kwargs):
+        """ Do the task for this class in another thread.
+
+            Takes the same arguments as :meth:`doTask`.
+
+            :returns: a future for the result of :meth:`doTask`
+            :rtype: :class:`multiprocessing.pool.AsyncResult`
+
+            This allows the tasks of several filesystems to be started
+            together and their results collected afterwards (see
+            :func:`~.util.submit`).
+        """
+        return util.submit(self.doTask, *args, **kwargs)
+
 class UnimplementedTask(Task):
     """ A null Task, which returns a negative or empty for all properties."""
 
@@ -20,41 +20,57 @@
 # Red Hat Author(s): Dave Lehman <dlehman@redhat.com>
 #
 
+import heapq
+
 class CyclicGraphError(Exception):
     pass
 
 def tsort(graph):
+    """ Sort the items in a graph topologically (Kahn's algorithm).
+
+        :param graph: a graph as returned by :func:`create_graph`
+        :type graph: dict
+        :returns: the items, ordered so that every parent precedes its children
+        :rtype: list
+        :raises: :class:`CyclicGraphError` if the graph contains cycles
+
+        Whenever several items are eligible to go next, the one that comes
+        first in graph['items'] is chosen, so the result is deterministic and
+        stays as close to the original order as the edges allow.
+
+        The graph is not modified.
+    """
     order = []  # sorted list of items
 
     if not graph or not graph['items']:
         return order
 
+    items = graph['items']
+    children = graph['children']
+    incoming = graph['incoming'].copy()
+    position = dict((item, idx) for (idx, item) in enumerate(items))
+
     # determine which nodes have no incoming edges
-    roots = [n for n in graph['items'] if graph['incoming'][n] == 0]
+    roots = [(position[n], n) for n in items if incoming[n] == 0]
     if not roots:
         raise CyclicGraphError("no root nodes")
 
-    visited = []    # list of nodes visited, for cycle detection
+    heapq.heapify(roots)
     while roots:
         # remove a root, add it to the order
-        root = roots.pop()
-        if root in visited:
-            raise CyclicGraphError("graph contains cycles")
-
-        visited.append(root)
+        root = heapq.heappop(roots)[1]
         order.append(root)
+
         # remove each edge from the root to another node
-        for (parent, child) in [e for e in graph['edges'] if e[0] == root]:
-            graph['incoming'][child] -= 1
-            graph['edges'].remove((parent, child))
+        for child in children[root]:
+            incoming[child] -= 1
             # if destination node is now a root, add it to roots
-            if graph['incoming'][child] == 0:
-                roots.append(child)
+            if incoming[child] == 0:
+                heapq.heappush(roots, (position[child], child))
 
-    if len(graph['items']) != len(visited):
+    if len(order) != len(items):
         raise CyclicGraphError("graph contains cycles")
 
-
     return order
 
 def create_graph(items, edges):
@@ -68,24 +84,28 @@ def create_graph(items, edges):
         Return Value:
 
             The return value is a dictionary representing the directed graph.
-            It has three keys:
+            It has four keys:
 
                 items is the same as the input argument of the same name
                 edges is the same as the input argument of the same name
                 incoming is a dict of incoming edge count hashed by item
+                children is a dict of lists of child items hashed by item
 
     """
     graph = {'items': [],       # the items to sort
              'edges': [],       # partial order info: (parent, child) pairs
-             'incoming': {}}    # incoming edge count for each item
+             'incoming': {},    # incoming edge count for each item
+             'children': {}}    # adjacency list for each item
 
-    graph['items'] = items
-    graph['edges'] = edges
-    for item in items:
+    graph['items'] = list(items)
+    graph['edges'] = list(edges)
+    for item in graph['items']:
         graph['incoming'][item] = 0
+        graph['children'][item] = []
 
-    for (_parent, child) in edges:
+    for (parent, child) in graph['edges']:
         graph['incoming'][child] += 1
+        graph['children'][parent].append(child)
 
     return graph
 
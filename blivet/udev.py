@@ -23,12 +23,19 @@
 
 import os
 import re
+import select
+import threading
+import time
+from contextlib import contextmanager
+from collections import OrderedDict
 
 from . import util
 from .util import open  # pylint: disable=redefined-builtin
+from .callstats import blockdev
 from .size import Size
 from .flags import flags
 
+import parted
 import pyudev
 global_udev = pyudev.Context()
 
@@ -38,25 +45,354 @@ log = logging.getLogger("blivet")
 INSTALLER_BLACKLIST = (r'^mtd', r'^mmcblk.+boot', r'^mmcblk.+rpmb', r'^zram')
 """ device name regexes to ignore when flags.installer_mode is True """
 
-def get_device(sysfs_path):
+class UdevBackend(object):
+    """ The source of udev device information and of the sysfs and /dev
+        entries that go with it.
+
+        This one queries the running system. Scanning for storage reads the
+        udev database, sysfs and device nodes through :data:`backend`, and
+        makes its libblockdev calls through it too, so that a different
+        backend (see :func:`using_backend` and :mod:`~.udevreplay`) can
+        stand in for the system.
+    """
+
+    devices_available = True
+    """ whether the device nodes can be opened, eg: to inspect filesystems """
+
+    def get_device(self, sysfs_path):
+        """ Return the udev device with a sysfs path, or None. """
+        try:
+            return pyudev.Device.from_sys_path(global_udev, sysfs_path)
+        except pyudev.DeviceNotFoundError as e:
+            log.error(e)
+            return None
+
+    def list_devices(self, subsystem):
+        """ Return all of the udev devices in a subsystem. """
+        return list(global_udev.list_devices(subsystem=subsystem))
+
+    def settle(self):
+        """ Wait for udev to finish processing all uevents. """
+        # wait maximal 300 seconds for udev to be done running blkid, lvm,
+        # mdadm etc. This large timeout is needed when running on machines
+        # with lots of disks, or with slow disks
+        util.run_program(["udevadm", "settle", "--timeout=%d" % SETTLE_TIMEOUT])
+
+    def ping(self):
+        """ Wait for udev to handle the requests it has received so far.
+
+            This includes the change events it synthesizes when a device
+            that was open for writing is closed.
+
+            :returns: whether udev answered
+            :rtype: bool
+        """
+        return util.run_program(["udevadm", "control", "--ping",
+                                 "--timeout=%d" % SETTLE_TIMEOUT]) == 0
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def realpath(self, path):
+        return os.path.realpath(path)
+
+    def read(self, path):
+        """ Return the contents of a file.
+
+            :raises IOError: if the file can not be read
+        """
+        with open(path) as f:
+            return f.read()
+
+    def get_sysfs_attr(self, path, attr):
+        """ Return the value of a sysfs attribute, or None (see
+            :func:`~.util.get_sysfs_attr`).
+        """
+        return util.get_sysfs_attr(path, attr)
+
+    def get_parted_device(self, path):
+        """ Return parted's view of a block device.
+
+            :param str path: the device node's path
+            :rtype: :class:`parted.Device`
+            :raises: :class:`_ped.IOException` or :class:`_ped.DeviceException`
+                     if parted can not open the device
+        """
+        return parted.Device(path=path)
+
+    def run_program(self, argv):
+        """ Run a program that reports on the system's storage.
+
+            :param list argv: the program and its arguments
+            :returns: the program's exit status and output
+            :rtype: tuple of (int, str)
+            :raises OSError: if the program can not be run
+        """
+        return util.run_program_and_capture_output(argv)
+
+    def call_blockdev(self, tool, func, args, kwargs):
+        """ Call a libblockdev function.
+
+            :param str tool: the function's name (eg: "blockdev.lvm.pvs")
+            :param func: the function
+            :param tuple args: positional arguments
+            :param dict kwargs: keyword arguments
+            :returns: the function's return value
+        """
+        return func(*args, **kwargs)
+
+backend = UdevBackend()
+""" the backend in use (see :class:`UdevBackend`) """
+
+@contextmanager
+def using_backend(new_backend):
+    """ Use a different backend while the context is active.
+
+        :param new_backend: the backend to use
+        :type new_backend: :class:`UdevBackend`
+    """
+    global backend
+    old_backend = backend
+    old_interceptor = blockdev.interceptor
+    backend = new_backend
+    blockdev.interceptor = new_backend.call_blockdev
     try:
-        dev = pyudev.Device.from_sys_path(global_udev, sysfs_path)
-    except pyudev.DeviceNotFoundError as e:
-        log.error(e)
-        dev = None
+        yield new_backend
+    finally:
+        backend = old_backend
+        blockdev.interceptor = old_interceptor
 
-    return dev
+def get_device(sysfs_path):
+    return backend.get_device(sysfs_path)
 
 def get_devices(subsystem="block"):
     settle()
-    return [d for d in global_udev.list_devices(subsystem=subsystem)
+    return [d for d in backend.list_devices(subsystem)
                         if not __is_blacklisted_blockdev(d.sys_name)]
 
-def settle():
-    # wait maximal 300 seconds for udev to be done running blkid, lvm,
-    # mdadm etc. This large timeout is needed when running on machines with
-    # lots of disks, or with slow disks
-    util.run_program(["udevadm", "settle", "--timeout=300"])
+def get_sysfs_attr(path, attr):
+    """ Return the value of a sysfs attribute, or None.
+
+        :param str path: the sysfs path of a device
+        :param str attr: the attribute's path relative to the device's
+    """
+    return backend.get_sysfs_attr(path, attr)
+
+SETTLE_TIMEOUT = 300
+""" seconds to wait for udev to process events """
+
+UDEV_QUEUE_FILE = "/run/udev/queue"
+""" file that exists while udev has events queued """
+
+class SettleStats(object):
+    """ Counters for the udev settles that have been requested.
+
+        :attr int requested: calls to :func:`settle`
+        :attr int run: runs of "udevadm settle"
+        :attr int scoped: settles that only waited for events on the
+                          devices they were given
+        :attr int skipped: settles skipped because there was nothing to
+                           wait for
+    """
+    def __init__(self):
+        # settles may be requested by actions executing concurrently
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Set all of the counters to zero. """
+        with self._lock:
+            self.requested = 0
+            self.run = 0
+            self.scoped = 0
+            self.skipped = 0
+
+    def count(self, counter):
+        """ Add one to a counter.
+
+            :param str counter: the name of the counter (eg: "run")
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def __str__(self):
+        return "requested: %d, run: %d, scoped: %d, skipped: %d" % \
+               (self.requested, self.run, self.scoped, self.skipped)
+
+settle_stats = SettleStats()
+
+class _SettleState(object):
+    """ Tracks the block device uevents udev has yet to process.
+
+        A kernel-source monitor sees each uevent as soon as it is emitted. A
+        udev-source monitor sees it once udev has finished processing it.
+    """
+    def __init__(self):
+        self.kernel_monitor = pyudev.Monitor.from_netlink(global_udev, source="kernel")
+        self.kernel_monitor.start()
+        self.udev_monitor = get_monitor()
+
+        # seqnum -> sysfs path of events that have not been processed yet
+        self.pending = OrderedDict()
+
+        # events emitted before the monitors were started are unknown
+        self.dirty = True
+
+        # whether block device events were seen since udev was last pinged
+        self.changed = False
+
+        # settles may be requested by actions executing concurrently
+        self.lock = threading.Lock()
+
+    def update(self):
+        """ Collect the events that have been emitted or processed. """
+        device = self.kernel_monitor.poll(timeout=0)
+        while device is not None:
+            if device.subsystem == "block":
+                self.pending[device.get("SEQNUM")] = device.sys_path
+                self.changed = True
+
+            device = self.kernel_monitor.poll(timeout=0)
+
+        device = self.udev_monitor.poll(timeout=0)
+        while device is not None:
+            self.pending.pop(device.get("SEQNUM"), None)
+            device = self.udev_monitor.poll(timeout=0)
+
+    def wait(self, devices, timeout):
+        """ Wait for udev to process the pending events for some devices.
+
+            :param devices: sysfs paths of the devices
+            :type devices: list of str
+            :param float timeout: seconds to wait
+            :returns: whether the events were processed before the timeout
+            :rtype: bool
+
+            Events for the devices below the given ones (eg: partitions of a
+            disk) are also waited for. The lock must not be held by the
+            caller; it is only taken to collect events, so that concurrent
+            settles can wait at the same time.
+        """
+        prefixes = tuple(d.rstrip("/") + "/" for d in devices)
+
+        def in_scope(sys_path):
+            return sys_path in devices or sys_path.startswith(prefixes)
+
+        deadline = time.time() + timeout
+        while True:
+            with self.lock:
+                self.update()
+                if not any(in_scope(p) for p in self.pending.values()):
+                    return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            # whichever waiter gets the lock first collects the events
+            select.select([self.udev_monitor], [], [], remaining)
+
+    def settled(self):
+        """ Note that udev has processed all events queued so far. """
+        self.update()
+        self.dirty = False
+
+_settle_state = None
+
+_ping_supported = True
+""" whether udev answers pings, which older versions of udevadm can't send """
+
+@contextmanager
+def coalesced_settles():
+    """ Context manager within which :func:`settle` only waits when needed.
+
+        Block device uevents are tracked for as long as the context is
+        active. A settle is skipped if udev has processed every event emitted
+        since the previous settle, and a settle for specific devices only
+        waits for the events concerning them. Settles are not coalesced if
+        udev can not be pinged.
+    """
+    global _settle_state # pylint: disable=global-statement
+    if _settle_state is not None or not _ping_supported:
+        yield
+        return
+
+    try:
+        state = _SettleState()
+    except (EnvironmentError, ValueError) as e:
+        log.info("failed to start uevent monitors, not coalescing settles: %s", e)
+        yield
+        return
+
+    _settle_state = state
+    try:
+        yield
+    finally:
+        _settle_state = None
+        log.debug("udev settles: %s", settle_stats)
+
+def settle(devices=None):
+    """ Wait for udev to finish processing uevents.
+
+        :keyword devices: sysfs paths of the devices whose events to wait
+                          for, or None to wait for all events
+        :type devices: list of str
+
+        Outside of :func:`coalesced_settles` this always waits for the whole
+        event queue to drain.
+    """
+    global _settle_state, _ping_supported # pylint: disable=global-statement
+    settle_stats.count("requested")
+    state = _settle_state
+    if state is not None and not state.dirty:
+        try:
+            # udev only emits the change events for devices that were open
+            # for writing once it gets around to them, so once devices have
+            # changed it has to be asked to catch up before the events seen
+            # so far can be trusted
+            with state.lock:
+                state.update()
+                ping = state.changed
+                state.changed = False
+
+            if ping and not backend.ping():
+                log.info("udev does not answer pings, not coalescing settles")
+                _ping_supported = False
+                _settle_state = state = None
+            else:
+                with state.lock:
+                    state.update()
+                    idle = not state.dirty and not state.pending and \
+                           not os.path.exists(UDEV_QUEUE_FILE)
+
+                if idle:
+                    settle_stats.count("skipped")
+                    return
+
+                if devices and all(devices) and state.wait(devices, SETTLE_TIMEOUT):
+                    settle_stats.count("scoped")
+                    return
+        except EnvironmentError as e:
+            # most likely a monitor's receive buffer overflowed
+            log.debug("lost track of uevents: %s", e)
+            with state.lock:
+                state.dirty = True
+
+    backend.settle()
+    settle_stats.count("run")
+    if state is not None:
+        with state.lock:
+            try:
+                state.settled()
+            except EnvironmentError as e:
+                log.debug("lost track of uevents: %s", e)
+                state.dirty = True
 
 def trigger(subsystem=None, action="add", name=None):
     argv = ["trigger", "--action=%s" % action]
@@ -68,6 +404,43 @@ def trigger(subsystem=None, action="add", name=None):
     util.run_program(["udevadm"] + argv)
     settle()
 
+def get_monitor(subsystem="block"):
+    """ Return a started monitor for uevents from a subsystem.
+
+        :keyword str subsystem: the subsystem to receive events for
+        :returns: a monitor on :data:`global_udev`
+        :rtype: :class:`pyudev.Monitor`
+
+        Events are only delivered after udev has finished processing them.
+    """
+    monitor = pyudev.Monitor.from_netlink(global_udev)
+    monitor.filter_by(subsystem=subsystem)
+    monitor.start()
+    return monitor
+
+def get_events(monitor, timeout=0):
+    """ Return the events that are queued on a monitor.
+
+        :param monitor: a monitor as returned by :func:`get_monitor`
+        :type monitor: :class:`pyudev.Monitor`
+        :keyword timeout: seconds to wait for the first event (None to block)
+        :type timeout: float or NoneType
+        :returns: (action, device) pairs, in the order they were received
+        :rtype: list of (str, :class:`pyudev.Device`)
+
+        Events for devices that :func:`get_devices` would not return are
+        omitted.
+    """
+    events = []
+    device = monitor.poll(timeout=timeout)
+    while device is not None:
+        if not __is_blacklisted_blockdev(device.sys_name):
+            events.append((device.action, device))
+
+        device = monitor.poll(timeout=0)
+
+    return events
+
 def resolve_devspec(devspec):
     if not devspec:
         return None
@@ -129,8 +502,8 @@ def __is_blacklisted_blockdev(dev_name):
         if any(re.search(expr, dev_name) for expr in INSTALLER_BLACKLIST):
             return True
 
-    if os.path.exists("/sys/class/block/%s/device/model" %(dev_name,)):
-        model = open("/sys/class/block/%s/device/model" %(dev_name,)).read()
+    if backend.exists("/sys/class/block/%s/device/model" %(dev_name,)):
+        model = backend.read("/sys/class/block/%s/device/model" %(dev_name,))
         for bad in ("IBM *STMF KERNEL", "SCEI Flash-5", "DGC LUNZ"):
             if model.find(bad) != -1:
                 log.info("ignoring %s with model %s", dev_name, model)
@@ -171,7 +544,7 @@ def device_get_label(udev_info):
 def device_is_dm(info):
     """ Return True if the device is a device-mapper device. """
     dm_dir = os.path.join(device_get_sysfs_path(info), "dm")
-    return 'DM_NAME' in info or os.path.exists(dm_dir)
+    return 'DM_NAME' in info or backend.exists(dm_dir)
 
 def device_is_md(info):
     """ Return True if the device is a mdraid array device. """
@@ -182,7 +555,7 @@ def device_is_md(info):
     # The udev information keeps shifting around. Only md arrays have a
     # /sys/class/block/<name>/md/ subdirectory.
     md_dir = device_get_sysfs_path(info) + "/md"
-    return os.path.exists(md_dir)
+    return backend.exists(md_dir)
 
 def device_is_cciss(info):
     """ Return True if the device is a CCISS device. """
@@ -260,17 +633,17 @@ def device_is_disk(info):
     """ Return True is the device is a disk. """
     if device_is_cdrom(info):
         return False
-    has_range = os.path.exists("%s/range" % device_get_sysfs_path(info))
+    has_range = backend.exists("%s/range" % device_get_sysfs_path(info))
     return info.get("DEVTYPE") == "disk" or has_range
 
 def device_is_partition(info):
-    has_start = os.path.exists("%s/start" % device_get_sysfs_path(info))
+    has_start = backend.exists("%s/start" % device_get_sysfs_path(info))
     return info.get("DEVTYPE") == "partition" or has_start
 
 def device_is_loop(info):
     """ Return True if the device is a configured loop device. """
     return (device_get_name(info).startswith("loop") and
-            os.path.isdir("%s/loop" % device_get_sysfs_path(info)))
+            backend.isdir("%s/loop" % device_get_sysfs_path(info)))
 
 def device_get_serial(udev_info):
     """ Get the serial number/UUID from the device as reported by udev. """
@@ -0,0 +1,551 @@
+# udevreplay.py
+# Recording and replay of the system information a storage scan uses.
+#
+# Copyright (C) 2015  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+""" Record what scanning a system's storage sees and play it back elsewhere.
+
+    A :class:`RecordingBackend` passes everything through to the running
+    system and remembers the answers: the udev database, the sysfs and /dev
+    entries that were looked at and the results of libblockdev calls. A
+    :class:`ReplayBackend` answers from such a recording, so that
+    :meth:`~.devicetree.DeviceTree.populate` can be run, profiled or
+    benchmarked on another machine::
+
+        udevreplay.record("host.json")       # on the system to be scanned
+
+        tree = udevreplay.replay("host.json")
+
+    The geometry and partition table of each disk that parted is asked
+    about are recorded too, along with the output of "lvm fullreport". On
+    replay, the partition tables are written to sparse image files in a
+    temporary directory, which parted reads in place of the disks; the
+    images are removed once the tree has been populated. No device node of
+    the replaying system is opened, so filesystems are not inspected, and
+    external programs other than udevadm and lvm are not run or recorded.
+"""
+
+import errno
+import json
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from decimal import Decimal
+from threading import Lock
+
+import parted
+import _ped
+import six
+
+from . import udev
+from .callstats import blockdev
+from .devicetree import DeviceTree
+
+import logging
+log = logging.getLogger("blivet")
+
+RECORDING_VERSION = 2
+""" version of the recording file format """
+
+_OBJECT_KEY = "__object__"
+
+_PLUGIN_ERRORS = {"btrfs": "BtrfsError",
+                  "crypto": "CryptoError",
+                  "dm": "DMError",
+                  "lvm": "LVMError",
+                  "md": "MDRaidError"}
+""" the exceptions libblockdev plugins raise, by plugin name """
+
+class PartitionEntry(namedtuple("PartitionEntry",
+                                 ("number", "type", "flags", "start", "end"))):
+    """ A partition in a :class:`PartitionTable`.
+
+        The flags are a frozenset of parted partition flag constants.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def fromPartedPartition(cls, partition):
+        """ Record a partition's properties.
+
+            :param partition: the partition
+            :type partition: :class:`parted.Partition`
+            :rtype: :class:`PartitionEntry`
+        """
+        flags = frozenset(f for f in parted.partitionFlag
+                          if partition.isFlagAvailable(f) and partition.getFlag(f))
+        return cls(partition.number, partition.type, flags,
+                   partition.geometry.start, partition.geometry.end)
+
+class PartitionTable(namedtuple("PartitionTable", ("labelType", "partitions"))):
+    """ An immutable record of a partition table. """
+    __slots__ = ()
+
+    @classmethod
+    def fromPartedDisk(cls, disk):
+        """ Record the contents of a parted disk.
+
+            :param disk: the disk
+            :type disk: :class:`parted.Disk`
+            :rtype: :class:`PartitionTable`
+        """
+        return cls(disk.type,
+                   tuple(PartitionEntry.fromPartedPartition(p)
+                         for p in disk.partitions))
+
+class RecordedDevice(dict):
+    """ A udev device's properties, as read from a recording. """
+
+    def __init__(self, sys_path, sys_name, properties):
+        super(RecordedDevice, self).__init__(properties)
+        self.sys_path = sys_path
+        self.sys_name = sys_name
+
+class RecordedObject(object):
+    """ A structure returned by libblockdev, as read from a recording.
+
+        The structure's fields are attributes of this object.
+    """
+
+    def __init__(self, type_name, fields):
+        self.__dict__.update(fields)
+        self._type_name = type_name
+
+    def __repr__(self):
+        return "<recorded %s>" % self._type_name
+
+def _field_names(value):
+    # libblockdev structures are described by gobject introspection
+    info = getattr(value, "__info__", None)
+    if hasattr(info, "get_fields"):
+        return [field.get_name() for field in info.get_fields()]
+
+    return [name for name in dir(value)
+            if not name.startswith("_") and not callable(getattr(value, name))]
+
+def _encode(value):
+    """ Return a value in a form that can be stored as JSON. """
+    if value is None or isinstance(value, (bool, float) + six.integer_types +
+                                   six.string_types):
+        return value
+    elif isinstance(value, Decimal):
+        return str(value)
+    elif isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((str(k), _encode(v)) for (k, v) in value.items())
+
+    return {_OBJECT_KEY: type(value).__name__,
+            "fields": dict((name, _encode(getattr(value, name)))
+                           for name in _field_names(value))}
+
+def _decode(value):
+    """ Return a value stored by :func:`_encode`. """
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    elif isinstance(value, dict):
+        if _OBJECT_KEY in value:
+            return RecordedObject(value[_OBJECT_KEY], _decode(value["fields"]))
+
+        return dict((k, _decode(v)) for (k, v) in value.items())
+
+    return value
+
+def _call_key(args, kwargs):
+    return json.dumps([_encode(args), _encode(kwargs)], sort_keys=True)
+
+def _encode_device(device):
+    if device is None:
+        return None
+
+    return {"sys_path": device.sys_path, "sys_name": device.sys_name,
+            "properties": dict(device)}
+
+def _decode_device(data):
+    if data is None:
+        return None
+
+    return RecordedDevice(data["sys_path"], data["sys_name"], data["properties"])
+
+def _encode_parted_device(device):
+    try:
+        table = PartitionTable.fromPartedDisk(parted.Disk(device=device))
+    except (_ped.DiskLabelException, _ped.IOException, NotImplementedError):
+        table = None
+
+    if table is not None:
+        table = {"labelType": table.labelType,
+                 "partitions": [[p.number, p.type, sorted(p.flags), p.start, p.end]
+                                for p in table.partitions]}
+
+    return {"sectorSize": device.sectorSize, "length": device.length,
+            "table": table}
+
+def _new_recording():
+    return {"version": RECORDING_VERSION,
+            "devices": {}, "device": {},
+            "exists": {}, "isdir": {}, "listdir": {}, "realpath": {},
+            "read": {}, "sysfs_attrs": {}, "blockdev": {},
+            "parted": {}, "programs": {}}
+
+class RecordingBackend(udev.UdevBackend):
+    """ A udev backend that records the answers of another one. """
+
+    def __init__(self, backend=None):
+        """
+            :keyword backend: the backend to record (default: the system)
+            :type backend: :class:`~.udev.UdevBackend`
+        """
+        self._backend = backend or udev.UdevBackend()
+        self._lock = Lock()
+        self.recording = _new_recording()
+        """ what has been recorded so far """
+
+    def _record(self, kind, key, value):
+        with self._lock:
+            self.recording[kind][key] = value
+
+    def get_device(self, sysfs_path):
+        device = self._backend.get_device(sysfs_path)
+        self._record("device", sysfs_path, _encode_device(device))
+        return device
+
+    def list_devices(self, subsystem):
+        devices = self._backend.list_devices(subsystem)
+        self._record("devices", subsystem, [_encode_device(d) for d in devices])
+        return devices
+
+    def settle(self):
+        self._backend.settle()
+
+    def ping(self):
+        return self._backend.ping()
+
+    def exists(self, path):
+        ret = self._backend.exists(path)
+        self._record("exists", path, ret)
+        return ret
+
+    def isdir(self, path):
+        ret = self._backend.isdir(path)
+        self._record("isdir", path, ret)
+        return ret
+
+    def listdir(self, path):
+        try:
+            ret = self._backend.listdir(path)
+        except OSError:
+            self._record("listdir", path, None)
+            raise
+
+        self._record("listdir", path, list(ret))
+        return ret
+
+    def realpath(self, path):
+        ret = self._backend.realpath(path)
+        self._record("realpath", path, ret)
+        return ret
+
+    def read(self, path):
+        try:
+            ret = self._backend.read(path)
+        except IOError:
+            self._record("read", path, None)
+            raise
+
+        self._record("read", path, ret)
+        return ret
+
+    def get_sysfs_attr(self, path, attr):
+        ret = self._backend.get_sysfs_attr(path, attr)
+        self._record("sysfs_attrs", "%s/%s" % (path, attr), ret)
+        return ret
+
+    def get_parted_device(self, path):
+        try:
+            device = self._backend.get_parted_device(path)
+        except (_ped.IOException, _ped.DeviceException) as e:
+            self._record("parted", path, {"error": type(e).__name__, "message": str(e)})
+            raise
+
+        # the partition table is read again, separately, so that the disk
+        # label sees the device as it would without recording
+        self._record("parted", path, _encode_parted_device(device))
+        return device
+
+    def run_program(self, argv):
+        key = json.dumps(argv)
+        try:
+            (rc, out) = self._backend.run_program(argv)
+        except OSError as e:
+            self._record("programs", key, {"errno": e.errno, "message": e.strerror})
+            raise
+
+        self._record("programs", key, {"rc": rc, "output": out})
+        return (rc, out)
+
+    def call_blockdev(self, tool, func, args, kwargs):
+        key = _call_key(args, kwargs)
+        try:
+            ret = self._backend.call_blockdev(tool, func, args, kwargs)
+        except Exception as e:
+            answer = {"error": type(e).__name__, "message": str(e)}
+            raise
+        else:
+            answer = {"result": _encode(ret)}
+            return ret
+        finally:
+            with self._lock:
+                self.recording["blockdev"].setdefault(tool, {})[key] = answer
+
+    def save(self, filename):
+        """ Write the recording to a file.
+
+            :param str filename: the file to write
+        """
+        with self._lock:
+            with open(filename, "w") as f:
+                json.dump(self.recording, f, indent=1, sort_keys=True)
+
+class ReplayBackend(udev.UdevBackend):
+    """ A udev backend that answers from a recording.
+
+        Questions that were not asked while recording are answered as if
+        the device or file did not exist. libblockdev calls that were not
+        recorded raise the plugin's exception.
+
+        parted is given image files holding the recorded partition tables;
+        :meth:`close` removes them.
+    """
+    devices_available = False
+
+    def __init__(self, recording):
+        """
+            :param dict recording: a recording, as made by :class:`RecordingBackend`
+            :raises ValueError: if the recording is in an unknown format
+        """
+        if recording.get("version") != RECORDING_VERSION:
+            raise ValueError("unsupported recording version %s" % recording.get("version"))
+
+        self.recording = recording
+
+        self.misses = []
+        """ the (kind, key) pairs that were asked for but not recorded """
+
+        self._images = {}
+        self._imageDir = None
+
+    @classmethod
+    def load(cls, filename):
+        """ Return a backend that replays a recording file.
+
+            :param str filename: a file written by :meth:`RecordingBackend.save`
+            :rtype: :class:`ReplayBackend`
+        """
+        with open(filename) as f:
+            return cls(json.load(f))
+
+    def _lookup(self, kind, key, default=None):
+        try:
+            return self.recording[kind][key]
+        except KeyError:
+            log.debug("nothing recorded for %s %s", kind, key)
+            self.misses.append((kind, key))
+            return default
+
+    def get_device(self, sysfs_path):
+        return _decode_device(self._lookup("device", sysfs_path))
+
+    def list_devices(self, subsystem):
+        return [_decode_device(d) for d in self._lookup("devices", subsystem, [])]
+
+    def settle(self):
+        pass
+
+    def ping(self):
+        return True
+
+    def exists(self, path):
+        return self._lookup("exists", path, False)
+
+    def isdir(self, path):
+        return self._lookup("isdir", path, False)
+
+    def listdir(self, path):
+        ret = self._lookup("listdir", path)
+        if ret is None:
+            raise OSError(errno.ENOENT, "no such directory", path)
+
+        return list(ret)
+
+    def realpath(self, path):
+        return self._lookup("realpath", path, path)
+
+    def read(self, path):
+        ret = self._lookup("read", path)
+        if ret is None:
+            raise IOError(errno.ENOENT, "no such file", path)
+
+        return ret
+
+    def get_sysfs_attr(self, path, attr):
+        return self._lookup("sysfs_attrs", "%s/%s" % (path, attr))
+
+    def get_parted_device(self, path):
+        answer = self._lookup("parted", path)
+        if answer is None:
+            raise _ped.DeviceException("no recorded device %s" % path)
+
+        if "error" in answer:
+            error = getattr(_ped, answer["error"], None)
+            if not isinstance(error, type) or not issubclass(error, Exception):
+                error = _ped.DeviceException
+
+            raise error(answer["message"])
+
+        return parted.Device(path=self._disk_image(path, answer))
+
+    def _disk_image(self, path, device):
+        """ Return the path of an image file holding a recorded partition table.
+
+            :param str path: the recorded device's node path
+            :param dict device: the recorded device
+            :raises: :class:`_ped.IOException` if the image can not be made
+        """
+        image = self._images.get(path)
+        if image is not None:
+            return image
+
+        if self._imageDir is None:
+            self._imageDir = tempfile.mkdtemp(prefix="blivet-replay-")
+
+        # parted names the partitions after the image, so it is named after
+        # the disk
+        image = os.path.join(self._imageDir, str(len(self._images)),
+                             os.path.basename(path))
+        try:
+            os.mkdir(os.path.dirname(image))
+            with open(image, "wb") as f:
+                f.truncate(device["length"] * device["sectorSize"])
+
+            if device["table"] and device["table"]["labelType"] != "loop":
+                self._write_table(path, image, device)
+        except Exception as e: # pylint: disable=broad-except
+            raise _ped.IOException("failed to make an image of %s: %s" % (path, e))
+
+        self._images[path] = image
+        return image
+
+    def _write_table(self, path, image, device):
+        image_device = parted.Device(path=image)
+        # the recorded sectors may be larger than the image's
+        scale = max(device["sectorSize"] // image_device.sectorSize, 1)
+        table = device["table"]
+        disk = parted.freshDisk(image_device, table["labelType"])
+        for (number, ptype, flags, start, end) in sorted(table["partitions"]):
+            geometry = parted.Geometry(device=image_device, start=start * scale,
+                                       end=(end + 1) * scale - 1)
+            partition = parted.Partition(disk=disk, type=ptype, geometry=geometry)
+            disk.addPartition(partition=partition,
+                              constraint=parted.Constraint(exactGeom=geometry))
+            for flag in flags:
+                if partition.isFlagAvailable(flag):
+                    partition.setFlag(flag)
+
+            # parted numbers partitions itself, so gaps in the numbering
+            # can not be reproduced
+            if partition.number != number:
+                log.warning("partition %d of %s is replayed as partition %d",
+                            number, path, partition.number)
+
+        disk.commitToDevice()
+
+    def close(self):
+        """ Remove the image files made for parted. """
+        if self._imageDir is not None:
+            shutil.rmtree(self._imageDir, ignore_errors=True)
+            self._imageDir = None
+            self._images = {}
+
+    def run_program(self, argv):
+        answer = self._lookup("programs", json.dumps(argv))
+        if answer is None:
+            raise OSError(errno.ENOENT, "no recorded run of %s" % argv[0])
+
+        if "errno" in answer:
+            raise OSError(answer["errno"], answer["message"])
+
+        return (answer["rc"], answer["output"])
+
+    def _error(self, name, default):
+        error = getattr(blockdev, name, None)
+        if not isinstance(error, type) or not issubclass(error, Exception):
+            error = getattr(blockdev, default)
+
+        return error
+
+    def call_blockdev(self, tool, func, args, kwargs):
+        answer = self._lookup("blockdev", tool, {}).get(_call_key(args, kwargs))
+        plugin = tool.split(".")[1]
+        default = _PLUGIN_ERRORS.get(plugin, "BlockDevError")
+        if answer is None:
+            self.misses.append(("blockdev", "%s%s" % (tool, _call_key(args, kwargs))))
+            raise self._error(default, "BlockDevError")("no recorded result for %s" % tool)
+
+        if "error" in answer:
+            raise self._error(answer["error"], default)(answer["message"])
+
+        return _decode(answer["result"])
+
+def record(filename):
+    """ Scan the system's storage and save what the scan saw to a file.
+
+        :param str filename: the file to write the recording to
+        :returns: the device tree that was populated
+        :rtype: :class:`~.devicetree.DeviceTree`
+    """
+    recorder = RecordingBackend()
+    with udev.using_backend(recorder):
+        tree = DeviceTree()
+        tree.populate()
+
+    recorder.save(filename)
+    return tree
+
+def replay(filename, **kwargs):
+    """ Return a device tree populated from a recording.
+
+        :param str filename: a file written by :func:`record`
+        :returns: the populated device tree
+        :rtype: :class:`~.devicetree.DeviceTree`
+
+        Keyword arguments are passed to the :class:`~.devicetree.DeviceTree`
+        constructor.
+    """
+    backend = ReplayBackend.load(filename)
+    try:
+        with udev.using_backend(backend):
+            tree = DeviceTree(**kwargs)
+            tree.populate()
+    finally:
+        backend.close()
+
+    if backend.misses:
+        log.info("%d questions had no recorded answers", len(backend.misses))
+
+    return tree
@@ -9,6 +9,7 @@ import subprocess
 import re
 import sys
 import tempfile
+import time
 import uuid
 import hashlib
 import warnings
@@ -16,10 +17,7 @@ from decimal import Decimal
 from contextlib import contextmanager
 from functools import wraps
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from .callstats import blockdev, call_stats, caller_subsystem
 
 import six
 
@@ -27,11 +25,19 @@ import logging
 log = logging.getLogger("blivet")
 program_log = logging.getLogger("program")
 
-from threading import Lock
+from multiprocessing.pool import ThreadPool
+from threading import Lock, Timer
 # this will get set to anaconda's program_log_lock in enable_installer_mode
 program_log_lock = Lock()
 
-def _run_program(argv, root='/', stdin=None, env_prune=None, stderr_to_stdout=False, binary_output=False):
+PROGRAM_WORKERS = 8
+""" maximum number of programs run concurrently by :func:`run_program_async` """
+
+_program_pool = None
+_program_pool_lock = Lock()
+
+def _run_program(argv, root='/', stdin=None, env_prune=None, stderr_to_stdout=False, binary_output=False,
+                 timeout=None):
     if env_prune is None:
         env_prune = []
 
@@ -39,45 +45,79 @@ def _run_program(argv, root='/', stdin=None, env_prune=None, stderr_to_stdout=Fa
         if root and root != '/':
             os.chroot(root)
 
+    env = os.environ.copy()
+    env.update({"LC_ALL": "C",
+                "INSTALL_PATH": root})
+    for var in env_prune:
+        env.pop(var, None)
+
+    if stderr_to_stdout:
+        stderr_dir = subprocess.STDOUT
+    else:
+        stderr_dir = subprocess.PIPE
+
+    command = " ".join(argv)
     with program_log_lock:
-        program_log.info("Running... %s", " ".join(argv))
+        program_log.info("Running... %s", command)
 
-        env = os.environ.copy()
-        env.update({"LC_ALL": "C",
-                    "INSTALL_PATH": root})
-        for var in env_prune:
-            env.pop(var, None)
+    # the program may run concurrently with others, so its output is
+    # collected and only logged, all together, once it has finished
+    messages = [("Output of %s:", command)]
+    timer = None
+    timed_out = []
 
-        if stderr_to_stdout:
-            stderr_dir = subprocess.STDOUT
-        else:
-            stderr_dir = subprocess.PIPE
+    def kill():
+        timed_out.append(True)
         try:
-            proc = subprocess.Popen(argv,
-                                    stdin=stdin,
-                                    stdout=subprocess.PIPE,
-                                    stderr=stderr_dir,
-                                    close_fds=True,
-                                    preexec_fn=chroot, cwd=root, env=env)
-
-            out, err = proc.communicate()
-            if not binary_output and six.PY3:
-                out = out.decode("utf-8")
-            if out:
-                if not stderr_to_stdout:
-                    program_log.info("stdout:")
-                for line in out.splitlines():
-                    program_log.info("%s", line)
-
-            if not stderr_to_stdout and err:
-                program_log.info("stderr:")
-                for line in err.splitlines():
-                    program_log.info("%s", line)
-
-        except OSError as e:
+            proc.kill()
+        except OSError:
+            pass
+
+    start = time.time()
+    try:
+        proc = subprocess.Popen(argv,
+                                stdin=stdin,
+                                stdout=subprocess.PIPE,
+                                stderr=stderr_dir,
+                                close_fds=True,
+                                preexec_fn=chroot, cwd=root, env=env)
+
+        if timeout is not None:
+            timer = Timer(timeout, kill)
+            timer.start()
+
+        out, err = proc.communicate()
+    except OSError as e:
+        call_stats.record(os.path.basename(argv[0]), time.time() - start,
+                          rc=None, subsystem=caller_subsystem(skip=(__name__,)))
+        with program_log_lock:
             program_log.error("Error running %s: %s", argv[0], e.strerror)
-            raise
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    call_stats.record(os.path.basename(argv[0]), time.time() - start,
+                      rc=proc.returncode, outputSize=len(out or ""),
+                      subsystem=caller_subsystem(skip=(__name__,)))
+
+    if not binary_output and six.PY3:
+        out = out.decode("utf-8")
+    if out:
+        if not stderr_to_stdout:
+            messages.append(("stdout:",))
+        messages.extend(("%s", line) for line in out.splitlines())
+
+    if not stderr_to_stdout and err:
+        messages.append(("stderr:",))
+        messages.extend(("%s", line) for line in err.splitlines())
+
+    with program_log_lock:
+        for message in messages:
+            program_log.info(*message)
 
+        if timed_out:
+            program_log.error("%s timed out after %s seconds", argv[0], timeout)
         program_log.debug("Return code: %d", proc.returncode)
 
     return (proc.returncode, out)
@@ -99,6 +139,45 @@ def run_program_and_capture_output_binary(*args, **kwargs):
     kwargs["binary_output"] = True
     return _run_program(*args, **kwargs)
 
+def _get_program_pool():
+    global _program_pool # pylint: disable=global-statement
+    with _program_pool_lock:
+        if _program_pool is None:
+            _program_pool = ThreadPool(PROGRAM_WORKERS)
+
+    return _program_pool
+
+def submit(func, *args, **kwargs):
+    """ Call a function in a thread that may run external programs.
+
+        :param func: the function to call
+        :returns: a future for the function's return value
+        :rtype: :class:`multiprocessing.pool.AsyncResult`
+
+        The result's get() method, which takes an optional timeout, returns
+        the function's return value or raises the exception it raised. At
+        most :data:`PROGRAM_WORKERS` functions run at the same time; the
+        others wait their turn.
+    """
+    return _get_program_pool().apply_async(call_stats.inCurrentPhase(func),
+                                           args, kwargs)
+
+def run_program_async(*args, **kwargs):
+    """ Run a program in another thread.
+
+        Takes the same arguments as :func:`run_program_and_capture_output`,
+        including the timeout in seconds after which the program is killed.
+
+        :returns: a future for a (return code, output) tuple
+        :rtype: :class:`multiprocessing.pool.AsyncResult`
+
+        Example::
+
+            results = [run_program_async(["fsck", "-n", d]) for d in devices]
+            codes = [r.get()[0] for r in results]
+    """
+    return submit(_run_program, *args, **kwargs)
+
 def mount(device, mountpoint, fstype, options=None):
     if options is None:
         options = "defaults"
@@ -605,6 +684,64 @@ def variable_copy(obj, memo, omit=None, shallow=None, duplicate=None):
 
     return new
 
+def object_state(obj, shallow=None, duplicate=None):
+    """ Record an object's attributes so they can be restored later.
+
+        :param object obj: a python object
+        :param shallow: a list of names of attributes to shallow copy
+        :type shallow: iterable of str
+        :param duplicate: a list of names of attributes to duplicate
+        :type duplicate: iterable of str
+        :returns: the recorded state, for :func:`restore_object_state`
+
+        Lists, dicts and sets are copied one level deep and restored in
+        place, so that other holders of a reference to them see the restored
+        contents. Attributes in shallow are copied with copy.copy() and those
+        in duplicate with their duplicate() method (see :func:`variable_copy`).
+        They are copied again when restored. Everything else is recorded by
+        reference.
+    """
+    shallow = shallow or []
+    duplicate = duplicate or []
+
+    state = {}
+    for (attr, value) in obj.__dict__.items():
+        if value is None:
+            state[attr] = (None, None, None)
+        elif attr in shallow:
+            state[attr] = (None, "copy", copy.copy(value))
+        elif attr in duplicate:
+            state[attr] = (None, "duplicate", value.duplicate())
+        elif isinstance(value, (list, dict, set)):
+            state[attr] = (value, "contents", copy.copy(value))
+        else:
+            state[attr] = (value, None, None)
+
+    return state
+
+def restore_object_state(obj, state):
+    """ Restore an object's attributes as recorded by :func:`object_state`.
+
+        :param object obj: the python object the state was recorded for
+        :param state: the recorded state
+
+        A state can be restored any number of times.
+    """
+    obj.__dict__.clear()
+    for (attr, (value, how, saved)) in state.items():
+        if how == "copy":
+            value = copy.copy(saved)
+        elif how == "duplicate":
+            value = saved.duplicate()
+        elif how == "contents":
+            if isinstance(value, list):
+                value[:] = saved
+            else:
+                value.clear()
+                value.update(saved)
+
+        obj.__dict__[attr] = value
+
 def get_current_entropy():
     with open("/proc/sys/kernel/random/entropy_avail", "r") as fobj:
         return int(fobj.readline())
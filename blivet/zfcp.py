@@ -26,10 +26,7 @@ from .util import open  # pylint: disable=redefined-builtin
 from .i18n import _
 from .util import stringize, unicodeize
 
-import gi
-gi.require_version("BlockDev", "1.0")
-
-from gi.repository import BlockDev as blockdev
+from .callstats import blockdev
 
 import logging
 log = logging.getLogger("blivet")
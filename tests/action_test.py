@@ -1,8 +1,15 @@
 
+import random
+import threading
+import time
 import unittest
+import mock
 
 from tests.storagetestcase import StorageTestCase
 import blivet
+from blivet.actionlist import ActionList
+from blivet.errors import StorageError
+from blivet.flags import flags
 from blivet.formats import getFormat
 from blivet.size import Size
 
@@ -12,8 +19,10 @@ from blivet.devices import PartitionDevice
 from blivet.devices import MDRaidArrayDevice
 from blivet.devices import LVMVolumeGroupDevice
 from blivet.devices import LVMLogicalVolumeDevice
+from blivet.devices import StorageDevice
 
 # action classes
+from blivet.deviceaction import DeviceAction
 from blivet.deviceaction import ActionCreateDevice
 from blivet.deviceaction import ActionResizeDevice
 from blivet.deviceaction import ActionDestroyDevice
@@ -1145,4 +1154,290 @@ class DeviceActionTestCase(StorageTestCase):
 
     def testActionSorting(self, *args, **kwargs):
         """ Verify correct functioning of action sorting. """
-        pass
+        # destroy the existing layout and create a new one in its place
+        self.destroyAllDevices()
+        sda = self.storage.devicetree.getDeviceByName("sda")
+        sdb = self.storage.devicetree.getDeviceByName("sdb")
+        sdc = self.storage.devicetree.getDeviceByName("sdc")
+
+        sda1 = self.newDevice(device_class=PartitionDevice, name="sda1",
+                              size=Size("99.5 GiB"), parents=[sda])
+        self.scheduleCreateDevice(sda1)
+        self.scheduleCreateFormat(device=sda1,
+                                  fmt=self.newFormat("lvmpv", device=sda1.path))
+
+        sdb1 = self.newDevice(device_class=PartitionDevice, name="sdb1",
+                              size=Size("99.5 GiB"), parents=[sdb])
+        self.scheduleCreateDevice(sdb1)
+        self.scheduleCreateFormat(device=sdb1,
+                                  fmt=self.newFormat("lvmpv", device=sdb1.path))
+
+        vg = self.newDevice(device_class=LVMVolumeGroupDevice,
+                            name="VolGroup", parents=[sda1, sdb1])
+        self.scheduleCreateDevice(vg)
+
+        lv_root = self.newDevice(device_class=LVMLogicalVolumeDevice,
+                                 name="lv_root", parents=[vg],
+                                 size=Size("160 GiB"))
+        self.scheduleCreateDevice(lv_root)
+        self.scheduleCreateFormat(device=lv_root,
+                                  fmt=self.newFormat("ext4", mountpoint="/",
+                                                     device=lv_root.path))
+
+        # an unrelated device should not have to wait for anything but the
+        # destroy actions
+        sdc1 = self.newDevice(device_class=PartitionDevice, name="sdc1",
+                              size=Size("50 GiB"), parents=[sdc])
+        self.scheduleCreateDevice(sdc1)
+        self.scheduleCreateFormat(device=sdc1,
+                                  fmt=self.newFormat("xfs", mountpoint="/srv",
+                                                     device=sdc1.path))
+
+        actions = self.storage.devicetree.actions
+        actions.sort()
+        order = list(actions)
+        self.assertEqual(len(order), len(actions.find()))
+
+        # no action may precede an action it requires
+        for (i, action) in enumerate(order):
+            for later in order[i+1:]:
+                self.assertFalse(action.requires(later),
+                                 "%s sorted before %s" % (action, later))
+
+        # all destroy actions come before all create actions
+        last_destroy = max(i for (i, a) in enumerate(order) if a.isDestroy)
+        first_create = min(i for (i, a) in enumerate(order) if a.isCreate)
+        self.assertLess(last_destroy, first_create)
+
+        # sorting is deterministic
+        actions.sort()
+        self.assertEqual(list(actions), order)
+
+        # lookups follow the sorted order
+        self.assertEqual(actions.find(action_type="create", object_type="format"),
+                         [a for a in order if a.isCreate and a.isFormat])
+        self.assertEqual(actions.find(device=sda1),
+                         [a for a in order if a.device is sda1])
+        self.assertEqual(actions.find(path=lv_root.path, object_type="format"),
+                         [a for a in order if a.device is lv_root and a.isFormat])
+
+        actions.remove(actions.find(device=sdc1, object_type="format")[0])
+        self.assertEqual(actions.find(devid=sdc1.id, action_type="create"),
+                         [a for a in order if a.device is sdc1 and a.isDevice])
+
+    def testConcurrentSharedAncestors(self):
+        """ Verify that devices shared by concurrent actions are set up first. """
+        vg = self.storage.devicetree.getDeviceByName("VolGroup")
+        lvs = [self.storage.devicetree.getDeviceByName(n) for n in ("VolGroup-lv_root",
+                                                                     "VolGroup-lv_swap")]
+        for lv in lvs:
+            self.scheduleCreateFormat(device=lv,
+                                      fmt=self.newFormat("xfs", device=lv.path))
+
+        actions = self.storage.devicetree.actions
+        actions.sort()
+        self.assertEqual(actions._sharedAncestors(list(actions)), set([vg]))
+
+        events = []
+        main_thread = threading.current_thread()
+        lock = threading.Lock()
+
+        def execute(action, callbacks=None): # pylint: disable=unused-argument
+            with lock:
+                events.append(("execute", action.device))
+
+        def setupParents(device, orig=False): # pylint: disable=unused-argument
+            self.assertIs(threading.current_thread(), main_thread)
+            with lock:
+                events.append(("setup", device))
+
+        for action in actions:
+            action.execute = lambda callbacks=None, action=action: execute(action, callbacks)
+
+        with mock.patch.object(flags, "action_workers", 4), \
+             mock.patch.object(LVMLogicalVolumeDevice, "setupParents",
+                               autospec=True, side_effect=setupParents):
+            actions._processConcurrently(devices=[])
+
+        for lv in lvs:
+            self.assertLess(events.index(("setup", lv)), events.index(("execute", lv)))
+
+        self.assertEqual(len(actions), 0)
+
+    def testConcurrentProcessing(self):
+        """ Verify that concurrently executed actions respect dependencies. """
+        self.destroyAllDevices()
+        new_devices = []
+        for name in ("sda", "sdb", "sdc"):
+            disk = self.storage.devicetree.getDeviceByName(name)
+            for num in (1, 2):
+                part = self.newDevice(device_class=PartitionDevice,
+                                      name="%s%d" % (name, num),
+                                      size=Size("10 GiB"), parents=[disk])
+                self.scheduleCreateDevice(part)
+                self.scheduleCreateFormat(device=part,
+                                          fmt=self.newFormat("xfs", device=part.path))
+                new_devices.append(part)
+
+        actions = self.storage.devicetree.actions
+        actions.sort()
+        order = list(actions)
+
+        executed = []
+        lock = threading.Lock()
+        broken = new_devices[-1]
+
+        def execute(action, callbacks=None): # pylint: disable=unused-argument
+            with lock:
+                executed.append(action)
+
+            if action.device is broken and action.isFormat:
+                raise StorageError("mkfs failed")
+
+        for action in order:
+            action.execute = lambda callbacks=None, action=action: execute(action, callbacks)
+
+        with mock.patch.object(flags, "action_workers", 4):
+            with self.assertRaisesRegex(StorageError, "mkfs failed"):
+                actions._processConcurrently(devices=[])
+
+        # no action was executed before an action it requires
+        for (i, action) in enumerate(executed):
+            for later in executed[i+1:]:
+                self.assertFalse(action.requires(later),
+                                 "%s executed before %s" % (action, later))
+
+        # the failed action and those not executed yet remain queued
+        failed = [a for a in order if a.device is broken and a.isFormat]
+        self.assertIn(failed[0], list(actions))
+        self.assertEqual(set(actions._completed_actions),
+                         set(executed) - set(failed))
+        self.assertEqual(set(actions),
+                         set(order) - set(actions._completed_actions))
+
+        # actions on the same disk are executed in sorted order
+        for disk_name in ("sda", "sdb", "sdc"):
+            disk_actions = [a for a in order if a.device.disk.name == disk_name]
+            disk_executed = [a for a in executed if a in disk_actions]
+            self.assertEqual(disk_executed, disk_actions[:len(disk_executed)])
+
+    def testConcurrentDisks(self):
+        """ Verify that partitioning of different disks is serialized. """
+        self.destroyAllDevices()
+        disks = [self.storage.devicetree.getDeviceByName(name)
+                 for name in ("sda", "sdb")]
+        new_devices = []
+        for disk in disks:
+            part = self.newDevice(device_class=PartitionDevice,
+                                  name="%s1" % disk.name,
+                                  size=Size("10 GiB"), parents=[disk])
+            self.scheduleCreateDevice(part)
+            self.scheduleCreateFormat(device=part,
+                                      fmt=self.newFormat("xfs", device=part.path))
+            new_devices.append(part)
+
+        actions = self.storage.devicetree.actions
+        actions.sort()
+        order = list(actions)
+
+        executed = []
+        running = []
+        overlaps = []
+        lock = threading.Lock()
+
+        def execute(action, callbacks=None): # pylint: disable=unused-argument
+            with lock:
+                if running:
+                    overlaps.append((running[0], action))
+                running.append(action)
+
+            # look the devices up while the other disk's actions may run
+            for device in new_devices:
+                self.storage.devicetree.getDeviceByName(device.name)
+                self.assertIn(device, device.disk.children)
+            time.sleep(0.01)
+
+            with lock:
+                running.remove(action)
+                executed.append(action)
+
+        for action in order:
+            action.execute = lambda callbacks=None, action=action: execute(action, callbacks)
+
+        with mock.patch.object(flags, "action_workers", 4):
+            actions._processConcurrently(devices=[])
+
+        self.assertEqual(overlaps, [])
+        self.assertEqual(set(executed), set(order))
+        self.assertEqual(list(actions), [])
+        for device in new_devices:
+            self.assertEqual(self.storage.devicetree.getDeviceByName(device.name),
+                             device)
+
+def _pairwisePrune(actions):
+    """ Prune a list of actions by comparing every pair of them.
+
+        This is how :meth:`~.actionlist.ActionList.prune` used to work.
+    """
+    actions = list(actions)
+    for action in reversed(actions[:]):
+        if action not in actions:
+            continue
+
+        for obsolete in actions[:]:
+            if action.obsoletes(obsolete):
+                actions.remove(obsolete)
+                if obsolete.obsoletes(action) and action in actions:
+                    actions.remove(action)
+
+    return actions
+
+class ActionPruneTestCase(unittest.TestCase):
+    """ Compare pruning of random action lists with pairwise pruning. """
+
+    ACTION_CLASSES = (ActionCreateDevice, ActionDestroyDevice,
+                      ActionResizeDevice, ActionCreateFormat,
+                      ActionResizeFormat, ActionDestroyFormat,
+                      ActionAddMember, ActionRemoveMember)
+
+    def _newAction(self, rng, action_class, devices, container):
+        # the constructors' checks of the devices' state are bypassed, so
+        # that any sequence of actions can be tried
+        device = rng.choice(devices)
+        action = action_class.__new__(action_class)
+        DeviceAction.__init__(action, device)
+        if action_class in (ActionAddMember, ActionRemoveMember):
+            action.container = container
+        elif action_class is ActionCreateFormat:
+            action._format = getFormat("ext4", device=device.path)
+        elif action_class is ActionDestroyFormat:
+            action.origFormat = getFormat("ext4", device=device.path,
+                                          exists=rng.random() < 0.5)
+
+        return action
+
+    def testRandomPruning(self):
+        rng = random.Random(4096)
+        for _i in range(200):
+            devices = [StorageDevice("dev%d" % n, size=Size("1 GiB"),
+                                     exists=rng.random() < 0.5)
+                       for n in range(4)]
+            container = StorageDevice("container", size=Size("4 GiB"),
+                                      exists=rng.random() < 0.5)
+
+            actions = ActionList()
+            for _j in range(rng.randint(1, 20)):
+                actions.append(self._newAction(rng, rng.choice(self.ACTION_CLASSES),
+                                               devices + [container], container))
+
+            # members are often added to a container that is later destroyed
+            if rng.random() < 0.5:
+                actions.append(self._newAction(rng, ActionAddMember, devices,
+                                               container))
+                actions.append(self._newAction(rng, ActionDestroyDevice,
+                                               [container], container))
+
+            expected = [a.id for a in _pairwisePrune(actions)]
+            actions.prune()
+            self.assertEqual([a.id for a in actions], expected)
+            self.assertEqual(sorted(a.id for a in actions.find()), sorted(expected))
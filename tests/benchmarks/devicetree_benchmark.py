@@ -0,0 +1,333 @@
+""" Benchmarks for device tree operations on large synthetic systems.
+
+    Run with "python -m tests.benchmarks.devicetree_benchmark" from the top of
+    the source tree. By default each operation is timed on systems of 100,
+    1000 and 10000 devices; use --sizes to choose others. With --json the
+    results are also written to a file, as a list of records with the
+    number of devices asked for ("size"), the number of devices the
+    operation actually worked on ("devices"), the operation and the time it
+    took in seconds.
+
+    The devices are mocked up in the same way as in
+    :class:`~tests.storagetestcase.StorageTestCase`, so no disks or root
+    privileges are needed. Each group of 16 devices consists of four disks,
+    two of which hold an md raid1 array with LUKS on top, an LVM volume group
+    built on the LUKS device and partitions of the other two disks, three
+    logical volumes and two plain partitions with filesystems.
+
+    Populating only scans whole disks with filesystems on them from a fake
+    udev database, since discovering partitions, md arrays and LVM needs
+    their metadata to be on real devices. Partition allocation and LV growth
+    run against sparse files, with eight devices per file.
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import time
+import uuid
+
+from mock import Mock, patch
+
+import parted
+
+from blivet import Blivet
+from blivet import util
+from blivet.callstats import blockdev
+from blivet.devices import DiskDevice, DiskFile, LUKSDevice, MDRaidArrayDevice
+from blivet.devices import LVMLogicalVolumeDevice, LVMVolumeGroupDevice
+from blivet.devices import PartitionDevice
+from blivet.devicetree import DeviceTree
+from blivet.formats import getFormat
+from blivet.partitioning import doPartitioning, growLVM
+from blivet.size import Size
+
+from tests.storagetestcase import StorageTestCase
+
+SIZES = (100, 1000, 10000)
+
+GROUP_SIZE = 16
+""" number of devices in each synthetic storage stack """
+
+DISK_FILE_DEVICES = 8
+""" number of devices built on each sparse file for partitioning """
+
+class _UdevDevice(dict):
+    """ A udev database entry, as returned by :func:`blivet.udev.get_devices`. """
+
+    def __init__(self, sys_name, properties):
+        dict.__init__(self, properties)
+        self.sys_name = sys_name
+        self.sys_path = "/sys/devices/virtual/block/%s" % sys_name
+
+def _uuid(number):
+    return str(uuid.UUID(int=number + 1))
+
+class SyntheticStorage(StorageTestCase):
+    """ A Blivet instance holding a large number of existing devices.
+
+        This is a context manager. The patches that keep the devices from
+        looking at the host system are only in place while it is active.
+    """
+
+    def __init__(self, size):
+        """
+            :param int size: the approximate number of devices to create
+        """
+        StorageTestCase.__init__(self)
+        self.size = size
+        self._patches = []
+        self._partitions = {}
+
+    def runTest(self):
+        pass
+
+    def __enter__(self):
+        self.setUp()
+        self._patches = [patch("blivet.udev.settle"),
+                         patch.object(blockdev, "mpath",
+                                      Mock(**{"is_mpath_member.return_value": False})),
+                         patch.object(DiskDevice, "mediaPresent", True),
+                         # the mocked partitions have no geometry to look up
+                         patch.object(PartitionDevice, "preCommitFixup")]
+        for p in self._patches:
+            p.start()
+
+        try:
+            for i in range(max(1, self.size // GROUP_SIZE)):
+                self._addGroup(i)
+        except Exception:
+            self.__exit__()
+            raise
+
+        return self
+
+    def __exit__(self, *args):
+        for p in reversed(self._patches):
+            p.stop()
+
+        self._patches = []
+        self.tearDown()
+
+    def _add(self, device, fmt_type=None, **kwargs):
+        if fmt_type is not None:
+            device.format = self.newFormat(fmt_type, device=device.path,
+                                           device_instance=device,
+                                           exists=True, **kwargs)
+            device.originalFormat = copy.deepcopy(device.format)
+
+        self.storage.devicetree._addDevice(device)
+        return device
+
+    def _addDisk(self, name):
+        disk = self.newDevice(device_class=DiskDevice, name=name,
+                              size=Size("100 GiB"), exists=True)
+        self._add(disk, "disklabel")
+
+        # copies of the tree share the parted disk, which is enough for
+        # finding the partitions again
+        parted_disk = disk.format._partedDisk
+        parted_disk.duplicate.return_value = parted_disk
+        parted_disk.getPartitionByPath.side_effect = lambda path: self._partitions[path]
+        return disk
+
+    def _addPartition(self, disk, number, fmt_type, **kwargs):
+        part = self.newDevice(device_class=PartitionDevice,
+                              name="%s%d" % (disk.name, number),
+                              size=Size("10 GiB"), parents=[disk],
+                              exists=True)
+        part.partedPartition.__class__ = parted.Partition
+        self._partitions[part.path] = part.partedPartition
+        return self._add(part, fmt_type, **kwargs)
+
+    def _addGroup(self, i):
+        uuids = [_uuid(i * GROUP_SIZE + n) for n in range(6)]
+        (a, b, c, d) = [self._addDisk("disk%d%s" % (i, l)) for l in "abcd"]
+
+        members = [self._addPartition(disk, 1, "mdmember") for disk in (a, b)]
+        md = self.newDevice(device_class=MDRaidArrayDevice,
+                            name="md%d" % i, level="raid1",
+                            memberDevices=2, totalDevices=2,
+                            parents=members, exists=True)
+        self._add(md, "luks", name="luks-md%d" % i, uuid=uuids[5])
+
+        luks = self.newDevice(device_class=LUKSDevice, name="luks-md%d" % i,
+                              parents=[md], exists=True)
+        pvs = [self._add(luks, "lvmpv", vgName="vg%d" % i)]
+        pvs.extend(self._addPartition(disk, 1, "lvmpv", vgName="vg%d" % i)
+                   for disk in (c, d))
+
+        vg = self.newDevice(device_class=LVMVolumeGroupDevice,
+                            name="vg%d" % i, parents=pvs, exists=True)
+        self._add(vg)
+
+        for (n, fmt_type) in enumerate(("ext4", "xfs", "swap")):
+            lv = self.newDevice(device_class=LVMLogicalVolumeDevice,
+                                name="lv%d" % n, parents=[vg],
+                                size=Size("5 GiB"), exists=True)
+            self._add(lv, fmt_type, uuid=uuids[n])
+
+        for (n, disk) in enumerate((a, b)):
+            self._addPartition(disk, 2, "ext4", uuid=uuids[3 + n])
+
+def _udevDatabase(size):
+    """ Return a fake udev database of disks with filesystems on them. """
+    devices = []
+    for i in range(size):
+        name = "fake%d" % i
+        properties = {"DEVNAME": "/dev/%s" % name,
+                      "DEVTYPE": "disk",
+                      "MAJOR": str(8 + (i // 16) % 256),
+                      "MINOR": str(i % 16 * 16),
+                      "ID_SERIAL": "synthetic-%d" % i}
+        fmt_type = ("ext4", "xfs", "swap", None)[i % 4]
+        if fmt_type:
+            properties["ID_FS_TYPE"] = fmt_type
+            properties["ID_FS_UUID"] = _uuid(i)
+
+        devices.append(_UdevDevice(name, properties))
+
+    return devices
+
+class _Timer(object):
+    """ Collect the times of operations on systems of a given size. """
+
+    def __init__(self, size, results):
+        self.size = size
+        self.results = results
+
+    def time(self, operation, devices, func, *args, **kwargs):
+        """ Call func and record how long it took.
+
+            :param str operation: name of the operation
+            :param int devices: the number of devices the operation works on
+            :returns: the return value of func
+        """
+        start = time.time()
+        ret = func(*args, **kwargs)
+        self.results.append({"size": self.size, "devices": devices,
+                             "operation": operation,
+                             "seconds": time.time() - start})
+        return ret
+
+def _lookups(timer, tree):
+    devices = tree.devices
+    uuids = [d.format.uuid for d in devices if d.format.uuid]
+    for (operation, keys) in (("getDeviceByName", [d.name for d in devices]),
+                              ("getDeviceByPath", [d.path for d in devices]),
+                              ("getDeviceByUuid", uuids),
+                              ("getDeviceByID", [d.id for d in devices])):
+        lookup = getattr(tree, operation)
+        timer.time(operation, len(keys), lambda: [lookup(k) for k in keys])
+
+def _removeAll(timer, tree):
+    devices = len(tree.devices)
+    disks = [d for d in tree.devices if d.isDisk]
+    timer.time("recursiveRemove", devices,
+               lambda: [tree.recursiveRemove(disk) for disk in disks])
+
+    actions = tree.actions
+    num_actions = len(actions.find())
+    timer.time("ActionList.prune", num_actions, actions.prune)
+    timer.time("ActionList.sort", len(actions.find()), actions.sort)
+
+    # this includes the pruning and sorting done by process
+    timer.time("ActionList.process", len(actions.find()),
+               tree.processActions, dryRun=True)
+
+def _runSynthetic(timer):
+    with SyntheticStorage(timer.size) as synthetic:
+        with patch("blivet.udev.get_devices", return_value=_udevDatabase(timer.size)):
+            tree = DeviceTree()
+            timer.time("populate", timer.size, tree.populate)
+
+        storage = synthetic.storage
+        tree = storage.devicetree
+        _lookups(timer, tree)
+        timer.time("Blivet.copy", len(tree.devices), storage.copy)
+        _removeAll(timer, tree)
+
+def _addDiskFile(storage, path, number):
+    disk = DiskFile(path)
+    disk.format = getFormat("disklabel", device=disk.path, labelType="gpt")
+    # DiskFile has no sysfs entry to read the size from
+    disk._size = disk._currentSize = Size("2 GiB")
+    storage.devicetree._addDevice(disk)
+
+    for (size, fmt_type, grow) in ((Size("256 MiB"), "ext4", False),
+                                   (Size("512 MiB"), "ext4", True)):
+        part = storage.newPartition(size=size, grow=grow, fmt_type=fmt_type,
+                                    parents=[disk])
+        storage.createDevice(part)
+
+    pvs = []
+    for _i in range(2):
+        pv = storage.newPartition(size=Size("256 MiB"), grow=True,
+                                  fmt_type="lvmpv", parents=[disk])
+        storage.createDevice(pv)
+        pvs.append(pv)
+
+    vg = storage.newVG(parents=pvs, name="benchvg%d" % number)
+    storage.createDevice(vg)
+    for (n, grow) in enumerate((True, False)):
+        lv = storage.newLV(parents=[vg], name="lv%d" % n, size=Size("64 MiB"),
+                           grow=grow, fmt_type="xfs")
+        storage.createDevice(lv)
+
+def _runPartitioning(timer):
+    paths = []
+    try:
+        with patch("blivet.udev.settle"):
+            storage = Blivet()
+            for i in range(max(1, timer.size // DISK_FILE_DEVICES)):
+                paths.append(util.create_sparse_tempfile("bench%d" % i, Size("2 GiB")))
+                _addDiskFile(storage, paths[-1], i)
+
+            devices = len(storage.devices)
+            timer.time("doPartitioning", devices, doPartitioning, storage)
+            timer.time("growLVM", devices, growLVM, storage)
+    finally:
+        for path in paths:
+            os.unlink(path)
+
+def run(sizes=SIZES):
+    """ Time the operations on systems of each of the given sizes.
+
+        :param sizes: the numbers of devices to create
+        :type sizes: list of int
+        :returns: a list of dicts with the keys "size", "devices", "operation"
+                  and "seconds"
+    """
+    results = []
+    for size in sizes:
+        timer = _Timer(size, results)
+        _runSynthetic(timer)
+        _runPartitioning(timer)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="time device tree operations "
+                                     "on large synthetic systems")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in SIZES),
+                        help="comma-separated numbers of devices (default: %(default)s)")
+    parser.add_argument("--json", metavar="FILE",
+                        help="also write the results to FILE as JSON")
+    args = parser.parse_args()
+
+    # there are lots of warnings about the made-up devices
+    logging.getLogger("blivet").addHandler(logging.NullHandler())
+
+    results = run([int(s) for s in args.sizes.split(",")])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    print("%-20s %8s %8s %12s" % ("operation", "size", "devices", "seconds"))
+    for result in results:
+        print("%(operation)-20s %(size)8d %(devices)8d %(seconds)12.3f" % result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+""" Microbenchmark for :class:`blivet.size.Size` arithmetic.
+
+    Run with "python -m tests.benchmarks.size_benchmark" from the top of the
+    source tree. Each operation is timed as implemented by Size and as
+    computed through the generic Decimal path that every operation used to
+    take (Decimal arithmetic followed by the Size constructor).
+"""
+
+import timeit
+
+from decimal import Decimal
+
+from blivet.size import Size, MiB
+
+NUMBER = 200000
+
+def _cases():
+    a = Size("10.3 GiB")
+    b = Size("4 MiB")
+    return [("add", lambda: a + b, lambda: Size(Decimal.__add__(a, b))),
+            ("sub", lambda: a - b, lambda: Size(Decimal.__sub__(a, b))),
+            ("mul", lambda: a * 3, lambda: Size(Decimal.__mul__(a, 3))),
+            ("truediv", lambda: a / 4, lambda: Size(Decimal.__truediv__(a, 4))),
+            ("floordiv", lambda: a // b, lambda: Size(Decimal.__floordiv__(a, b))),
+            ("mod", lambda: a % b, lambda: Size(Decimal.__mod__(a, b))),
+            ("sum", lambda: sum([a, b, a, b]), None),
+            ("roundToNearest", lambda: a.roundToNearest(MiB), None),
+            ("Size(int)", lambda: Size(4096), None)]
+
+def run(number=NUMBER):
+    """ Time the cases and return a list of (name, Size, Decimal path) results.
+
+        Times are in seconds per million operations. The Decimal path time is
+        None where there is no equivalent.
+    """
+    results = []
+    for (name, fast, generic) in _cases():
+        scale = 1000000.0 / number
+        fast_time = min(timeit.repeat(fast, number=number, repeat=3)) * scale
+        generic_time = None
+        if generic is not None:
+            generic_time = min(timeit.repeat(generic, number=number, repeat=3)) * scale
+        results.append((name, fast_time, generic_time))
+
+    return results
+
+def main():
+    print("%-16s %12s %14s %8s" % ("operation", "Size (s/M)", "Decimal (s/M)", "speedup"))
+    for (name, fast_time, generic_time) in run():
+        if generic_time is None:
+            print("%-16s %12.3f %14s %8s" % (name, fast_time, "-", "-"))
+        else:
+            print("%-16s %12.3f %14.3f %7.1fx" % (name, fast_time, generic_time,
+                                                  generic_time / fast_time))
+
+if __name__ == "__main__":
+    main()
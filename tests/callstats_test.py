@@ -0,0 +1,98 @@
+import json
+import threading
+import unittest
+import mock
+
+from blivet import callstats
+from blivet import util
+
+class CallStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = callstats.CallStats()
+
+    def testAggregation(self):
+        with self.stats.phase("populate"):
+            self.stats.record("blockdev.lvm.pvs", 0.5, subsystem="populator")
+            with self.stats.phase("sort"):
+                self.stats.record("blockdev.lvm.pvs", 1.5, rc=None,
+                                  subsystem="populator")
+
+        self.stats.record("mkfs.xfs", 2.0, rc=1, outputSize=10,
+                          subsystem="tasks.fsmkfs")
+
+        tools = self.stats.byTool()
+        self.assertEqual(tools["blockdev.lvm.pvs"]["calls"], 2)
+        self.assertEqual(tools["blockdev.lvm.pvs"]["failures"], 1)
+        self.assertEqual(tools["blockdev.lvm.pvs"]["time"], 2.0)
+        self.assertEqual(tools["blockdev.lvm.pvs"]["maxTime"], 1.5)
+        self.assertEqual(tools["mkfs.xfs"]["exitCodes"], {"1": 1})
+        self.assertEqual(tools["mkfs.xfs"]["outputSize"], 10)
+
+        phases = self.stats.byPhase()
+        self.assertEqual(sorted(phases.keys()), ["none", "populate", "sort"])
+        self.assertEqual(phases["populate"]["blockdev.lvm.pvs"]["calls"], 1)
+        self.assertEqual(list(phases["none"].keys()), ["mkfs.xfs"])
+
+        subsystems = self.stats.bySubsystem()
+        self.assertEqual(subsystems["tasks.fsmkfs"]["mkfs.xfs"]["calls"], 1)
+
+        exported = json.loads(self.stats.toJSON())
+        self.assertEqual(exported["tools"], tools)
+
+        self.stats.reset()
+        self.assertEqual(self.stats.byTool(), {})
+
+    def testThreadPhases(self):
+        seen = {}
+
+        def other():
+            seen["other"] = self.stats.currentPhase
+
+        with self.stats.phase("process"):
+            with self.stats.phase("process"):
+                pass
+
+            thread = threading.Thread(target=other)
+            thread.start()
+            thread.join()
+
+            bound = self.stats.inCurrentPhase(other)
+            self.assertEqual(self.stats.currentPhase, "process")
+
+        self.assertEqual(seen["other"], None)
+        self.assertEqual(self.stats.currentPhase, None)
+
+        thread = threading.Thread(target=bound)
+        thread.start()
+        thread.join()
+        self.assertEqual(seen["other"], "process")
+        self.assertEqual(self.stats.currentPhase, None)
+
+    def testRunProgram(self):
+        with mock.patch.object(callstats, "call_stats", self.stats):
+            with mock.patch.object(util, "call_stats", self.stats):
+                util.run_program(["true"])
+                util.run_program(["false"])
+
+        tool = self.stats.byTool()
+        self.assertEqual(tool["true"]["calls"], 1)
+        self.assertEqual(tool["false"]["failures"], 1)
+        self.assertEqual(list(self.stats.bySubsystem().keys()), ["none"])
+
+    def testBlockDevProxy(self):
+        plugin = mock.Mock()
+        plugin.pvs.return_value = ["pv"]
+        plugin.pvs.side_effect = None
+        module = mock.Mock(lvm=plugin, LVMError=ValueError)
+        proxy = callstats._BlockDevProxy(module)
+
+        with mock.patch.object(callstats, "call_stats", self.stats):
+            self.assertEqual(proxy.lvm.pvs(), ["pv"])
+            plugin.pvs.side_effect = RuntimeError("failed")
+            self.assertRaises(RuntimeError, proxy.lvm.pvs)
+
+        self.assertIs(proxy.lvm.pvs, proxy.lvm.pvs)
+        self.assertIs(proxy.LVMError, ValueError)
+        counts = self.stats.byTool()["blockdev.lvm.pvs"]
+        self.assertEqual((counts["calls"], counts["failures"]), (2, 1))
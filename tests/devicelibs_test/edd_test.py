@@ -1,3 +1,9 @@
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
 import unittest
 import mock
 
@@ -133,6 +139,88 @@ class EddTestCase(unittest.TestCase):
         self.assertIn((('edd: both edd entries 0x80 and 0x81 seem to map to sda',), {}),
                       edd.log.info.call_args_list)
 
+class _Disk(object):
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+class CollectMBRsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _disk(self, name, mbrsig):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as f:
+            f.write(b"\0" * 440 + struct.pack("I", mbrsig) + b"\0" * 68)
+        return _Disk(name, path)
+
+    def test_collect_mbrs(self):
+        from blivet.devicelibs import edd
+        disks = [self._disk("sd%s" % c, i) for (i, c) in enumerate("abcdefghij")]
+        disks.append(_Disk("missing", os.path.join(self.tmpdir, "missing")))
+        expected = dict(("sd%s" % c, "0x%08x" % i)
+                        for (i, c) in enumerate("abcdefghij") if i)
+        self.assertEqual(edd.collect_mbrs(disks), expected)
+        self.assertEqual(edd.collect_mbrs([]), {})
+
+        # a duplicate signature makes all of the signatures useless
+        disks.append(self._disk("vda", 5))
+        self.assertEqual(edd.collect_mbrs(disks), {})
+
+    def test_collect_mbrs_timeout(self):
+        from blivet.devicelibs import edd
+        disks = [self._disk("sda", 1), self._disk("sdb", 2)]
+        hung = threading.Event()
+        self.addCleanup(hung.set)
+        read_mbrsig = edd._read_mbrsig
+
+        def slow_read(path):
+            if path == disks[0].path:
+                hung.wait()
+            return read_mbrsig(path)
+
+        with mock.patch.object(edd, "_read_mbrsig", side_effect=slow_read), \
+             mock.patch.object(edd, "MBR_TIMEOUT", 0.1):
+            self.assertEqual(edd.collect_mbrs(disks), {"sdb": "0x00000002"})
+
+        # a hung read stops holding up the other disks after MBR_READ_TIMEOUT
+        disks.append(self._disk("sdc", 3))
+        with mock.patch.object(edd, "_read_mbrsig", side_effect=slow_read), \
+             mock.patch.object(edd, "MBR_WORKERS", 1), \
+             mock.patch.object(edd, "MBR_READ_TIMEOUT", 0.05), \
+             mock.patch.object(edd, "MBR_TIMEOUT", 0.5):
+            start = time.time()
+            self.assertEqual(edd.collect_mbrs(disks),
+                             {"sdb": "0x00000002", "sdc": "0x00000003"})
+            # one overall deadline, not one per disk
+            self.assertLess(time.time() - start, 1)
+
+        # no more reads are started once too many of them hang
+        def slower_read(path):
+            if path in (disks[0].path, disks[1].path):
+                hung.wait()
+            return read_mbrsig(path)
+
+        with mock.patch.object(edd, "_read_mbrsig", side_effect=slower_read) as read, \
+             mock.patch.object(edd, "MBR_WORKERS", 1), \
+             mock.patch.object(edd, "MBR_THREADS", 2), \
+             mock.patch.object(edd, "MBR_READ_TIMEOUT", 0.05), \
+             mock.patch.object(edd, "MBR_TIMEOUT", 5):
+            start = time.time()
+            self.assertEqual(edd.collect_mbrs(disks), {})
+            self.assertLess(time.time() - start, 1)
+            self.assertEqual(read.call_count, 2)
+
+        # disks that never got read are skipped once the deadline passes
+        with mock.patch.object(edd, "_read_mbrsig", side_effect=slow_read), \
+             mock.patch.object(edd, "MBR_WORKERS", 1), \
+             mock.patch.object(edd, "MBR_READ_TIMEOUT", 5), \
+             mock.patch.object(edd, "MBR_TIMEOUT", 0.1):
+            start = time.time()
+            self.assertEqual(edd.collect_mbrs(disks), {})
+            self.assertLess(time.time() - start, 1)
+
 class EddTestFS(object):
     def __init__(self, test_case, target_module):
         self.fs = mock.DiskIO() # pylint: disable=no-member
@@ -0,0 +1,95 @@
+import errno
+import json
+import unittest
+import mock
+
+import blivet.devicelibs.lvm as lvm
+
+FULLREPORT = {"report": [
+    {"vg": [{"vg_name": "testvg", "vg_uuid": "vg-uuid", "vg_size": "21474836480",
+             "vg_free": "4294967296", "vg_extent_size": "4194304",
+             "vg_extent_count": "5120", "vg_free_count": "1024", "pv_count": "2"}],
+     "pv": [{"pv_name": "/dev/sda1", "pv_uuid": "pv-uuid-1", "pv_size": "10737418240",
+             "pv_free": "0", "pe_start": "1048576"},
+            {"pv_name": "/dev/sdb1", "pv_uuid": "pv-uuid-2", "pv_size": "10737418240",
+             "pv_free": "4294967296", "pe_start": "1048576"}],
+     "lv": [{"lv_name": "pool", "lv_uuid": "lv-uuid-1", "lv_size": "8589934592",
+             "lv_attr": "twi-a-tz--", "origin": "", "pool_lv": "",
+             "data_lv": "[pool_tdata]", "metadata_lv": "[pool_tmeta]"},
+            {"lv_name": "[pool_tdata]", "lv_uuid": "lv-uuid-2", "lv_size": "8589934592",
+             "lv_attr": "Twi-ao----", "origin": "", "pool_lv": "",
+             "data_lv": "", "metadata_lv": ""},
+            {"lv_name": "thin", "lv_uuid": "lv-uuid-3", "lv_size": "1073741824",
+             "lv_attr": "Vwi-a-tz--", "origin": "", "pool_lv": "pool",
+             "data_lv": "", "metadata_lv": ""}],
+     "seg": [{"lv_uuid": "lv-uuid-1", "segtype": "thin-pool", "devices": "pool_tdata(0)"},
+             {"lv_uuid": "lv-uuid-2", "segtype": "linear", "devices": "/dev/sda1(0)"},
+             {"lv_uuid": "lv-uuid-2", "segtype": "linear", "devices": "/dev/sdb1(0)"},
+             {"lv_uuid": "lv-uuid-3", "segtype": "thin", "devices": ""}]},
+    {"vg": [],
+     "pv": [{"pv_name": "/dev/sdc1", "pv_uuid": "pv-uuid-3", "pv_size": "1073741824",
+             "pv_free": "1073741824", "pe_start": "1048576"}],
+     "lv": [], "seg": []}]}
+
+class LVMReportTestCase(unittest.TestCase):
+
+    def testFullReport(self):
+        report = lvm.LVMReport.fromFullReport(json.dumps(FULLREPORT))
+        self.assertTrue(report.relations)
+
+        self.assertEqual(list(report.pvs.keys()), ["/dev/sda1", "/dev/sdb1", "/dev/sdc1"])
+        pv = report.getPV("/dev/sdb1")
+        self.assertEqual(pv.vg_name, "testvg")
+        self.assertEqual(pv.vg_uuid, "vg-uuid")
+        self.assertEqual(pv.pe_start, 1048576)
+        self.assertEqual(pv.vg_extent_size, 4194304)
+        self.assertEqual(pv.vg_pv_count, 2)
+        self.assertEqual(report.getPV("/dev/sdc1").vg_name, "")
+        self.assertIsNone(report.getPV("/dev/sdd1"))
+
+        self.assertEqual(report.getVG(uuid="vg-uuid").name, "testvg")
+        self.assertEqual(report.getVG(name="testvg").free_count, 1024)
+
+        self.assertEqual(list(report.getVGLVs("testvg").keys()),
+                         ["testvg-pool", "testvg-[pool_tdata]", "testvg-thin"])
+        self.assertEqual(report.getVGLVs("othervg"), {})
+        pool = report.getLV("testvg", "pool")
+        self.assertEqual(pool.segtype, "thin-pool")
+        self.assertEqual(pool.data_lv, "[pool_tdata]")
+        self.assertIsNone(pool.origin)
+        self.assertEqual(report.getLV("testvg", "thin").pool_lv, "pool")
+        self.assertEqual(len(report.getLV("testvg", "[pool_tdata]").segments), 2)
+
+    def testDetermineParentLV(self):
+        report = lvm.LVMReport.fromFullReport(json.dumps(FULLREPORT))
+        pool = mock.Mock(lvname="pool")
+        thin = mock.Mock(lvname="thin")
+        internal = mock.Mock(lvname="pool_tdata", name_suffix="_foo")
+
+        with mock.patch.object(lvm.blockdev, "lvm") as blockdev_lvm:
+            parent = lvm.determine_parent_lv("testvg", internal, [thin, pool],
+                                             report=report)
+            self.assertFalse(blockdev_lvm.data_lv_name.called)
+
+        self.assertEqual(parent, pool)
+
+    def testGetReport(self):
+        with mock.patch.object(lvm.udev.backend, "run_program",
+                               return_value=(0, json.dumps(FULLREPORT))) as run_program:
+            report = lvm.get_report()
+
+        self.assertEqual(run_program.call_args[0][0][:2], ["lvm", "fullreport"])
+        self.assertTrue(report.relations)
+        self.assertEqual(report.getLV("testvg", "thin").pool_lv, "pool")
+
+    @mock.patch.object(lvm.udev.backend, "run_program",
+                       mock.Mock(side_effect=OSError(errno.ENOENT, "no lvm")))
+    def testGetReportFallback(self):
+        with mock.patch.object(lvm.blockdev, "lvm") as blockdev_lvm:
+            blockdev_lvm.pvs.return_value = []
+            blockdev_lvm.vgs.return_value = []
+            blockdev_lvm.lvs.return_value = [mock.Mock(lv_name="lv", vg_name="vg")]
+            report = lvm.get_report()
+
+        self.assertFalse(report.relations)
+        self.assertEqual(list(report.lvs.keys()), ["vg-lv"])
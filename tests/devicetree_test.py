@@ -1,4 +1,6 @@
+import copy
 import unittest
+import mock
 
 from tests.imagebackedtestcase import ImageBackedTestCase
 
@@ -8,6 +10,14 @@ from blivet import devicefactory
 from blivet import util
 from blivet.udev import trigger
 from blivet.devices import LVMSnapShotDevice, LVMThinSnapShotDevice
+from blivet.devices import DiskDevice, LVMVolumeGroupDevice, LVMLogicalVolumeDevice
+from blivet.deviceaction import ActionCreateDevice, ActionCreateFormat
+from blivet.devicetree import DeviceTree
+from blivet.errors import DeviceTreeError
+from blivet.flags import flags
+from blivet.formats import getFormat
+from blivet.formats import fs
+from blivet.tasks import fsresize
 
 """
     TODO:
@@ -278,3 +288,262 @@ class LVMOnMDTestCase(BlivetResetTestCase):
                                   None,
                                   disks=self.blivet.disks[:],
                                   container_raid_level="raid1")
+
+class DeviceTreeLookupTestCase(unittest.TestCase):
+    """ Verify that indexed device lookups track changes to the devices. """
+
+    def setUp(self):
+        self.tree = DeviceTree()
+        self.disk = DiskDevice("sda", size=Size("10 GiB"), exists=True,
+                               fmt=getFormat("lvmpv", uuid="pv-uuid"))
+        self.tree._addDevice(self.disk)
+        self.vg = LVMVolumeGroupDevice("testvg", parents=[self.disk])
+        self.tree._addDevice(self.vg)
+        self.lv = LVMLogicalVolumeDevice("testlv", parents=[self.vg],
+                                         size=Size("1 GiB"),
+                                         fmt=getFormat("ext4", label="root"))
+        self.tree._addDevice(self.lv)
+
+    def testLookups(self):
+        self.assertEqual(self.tree.getDeviceByName("sda"), self.disk)
+        self.assertEqual(self.tree.getDeviceByPath("/dev/sda"), self.disk)
+        self.assertEqual(self.tree.getDeviceByUuid("pv-uuid"), self.disk)
+        self.assertEqual(self.tree.getDeviceByLabel("root"), self.lv)
+        self.assertEqual(self.tree.getDeviceByID(self.vg.id), self.vg)
+        self.assertEqual(self.tree.getDeviceByName("testvg-testlv"), self.lv)
+        self.assertEqual(self.tree.getDeviceByPath("/dev/mapper/testvg-testlv"),
+                         self.lv)
+        self.assertIsNone(self.tree.getDeviceByName("sdb"))
+
+    def testChanges(self):
+        self.disk.sysfsPath = "/devices/virtual/block/sda"
+        self.assertEqual(self.tree.getDeviceBySysfsPath(self.disk.sysfsPath),
+                         self.disk)
+
+        self.lv.format.label = "newroot"
+        self.assertIsNone(self.tree.getDeviceByLabel("root"))
+        self.assertEqual(self.tree.getDeviceByLabel("newroot"), self.lv)
+
+        self.lv.format = getFormat("xfs", uuid="fs-uuid")
+        self.assertIsNone(self.tree.getDeviceByLabel("newroot"))
+        self.assertEqual(self.tree.getDeviceByUuid("fs-uuid"), self.lv)
+
+        # renaming the vg changes the name of the lv as well
+        self.vg.name = "othervg"
+        self.assertIsNone(self.tree.getDeviceByName("testvg"))
+        self.assertIsNone(self.tree.getDeviceByName("testvg-testlv"))
+        self.assertEqual(self.tree.getDeviceByName("othervg-testlv"), self.lv)
+
+    def testHideAndRemove(self):
+        self.tree._removeDevice(self.lv)
+        self.assertIsNone(self.tree.getDeviceByName("testvg-testlv"))
+        self.assertIsNone(self.tree.getDeviceByLabel("root"))
+
+        self.tree.hide(self.disk)
+        self.assertIsNone(self.tree.getDeviceByName("sda"))
+        self.assertEqual(self.tree.getDeviceByName("sda", hidden=True),
+                         self.disk)
+
+    def testDependents(self):
+        self.assertEqual(self.tree.getChildren(self.disk), [self.vg])
+        self.assertEqual(self.tree.getDependentDevices(self.disk),
+                         [self.vg, self.lv])
+        self.assertEqual(set(self.lv.ancestors),
+                         set([self.lv, self.vg, self.disk]))
+
+        # snapshots depend on their origin without being built upon it
+        self.lv.exists = True
+        snap = LVMSnapShotDevice("snap", parents=[self.vg], origin=self.lv)
+        self.tree._addDevice(snap)
+        self.assertEqual(self.tree.getChildren(self.vg), [self.lv, snap])
+        self.assertEqual(self.tree.getDependentDevices(self.lv), [snap])
+        self.assertTrue(snap.dependsOn(self.disk))
+
+        # devices removed from the tree are no longer dependents
+        self.tree._removeDevice(snap)
+        self.assertNotIn(snap, self.vg.children)
+        self.assertNotIn(snap, self.disk.descendants)
+        self.assertEqual(self.tree.getDependentDevices(self.disk),
+                         [self.vg, self.lv])
+
+        self.tree._addDevice(snap, new=False)
+        self.assertIn(snap, self.vg.children)
+        self.assertIn(snap, self.disk.descendants)
+        self.tree._removeDevice(snap)
+
+        disk2 = DiskDevice("sdb", size=Size("10 GiB"), exists=True,
+                           fmt=getFormat("lvmpv"))
+        self.tree._addDevice(disk2)
+        self.assertEqual(disk2.descendants, [disk2])
+        self.vg.parents.append(disk2)
+        self.assertIn(disk2, self.lv.ancestors)
+        self.assertEqual(self.tree.getDependentDevices(disk2),
+                         [self.vg, self.lv])
+
+        # only the closures of related devices are recomputed
+        disk3 = DiskDevice("sdc", size=Size("10 GiB"), exists=True)
+        self.assertEqual(disk3.descendants, [disk3])
+        self.vg.parents.remove(disk2)
+        self.assertIsNotNone(disk3._descendantCache)
+        self.assertIsNone(self.lv._ancestorCache)
+        self.assertIsNone(disk2._descendantCache)
+        self.vg.parents.append(disk2)
+
+        self.vg.parents.remove(disk2)
+        self.assertNotIn(disk2, self.lv.ancestors)
+        self.assertEqual(self.tree.getChildren(disk2), [])
+
+    def testCopy(self):
+        new = copy.deepcopy(self.tree)
+        new_lv = new.getDeviceByName("testvg-testlv")
+        self.assertIsNot(new_lv, self.lv)
+        self.assertEqual(new_lv.id, self.lv.id)
+
+        # changes to the copy do not affect the original tree's indexes
+        new_lv.format.label = "copy"
+        self.assertEqual(new.getDeviceByLabel("copy"), new_lv)
+        self.assertIsNone(self.tree.getDeviceByLabel("copy"))
+        self.assertEqual(self.tree.getDeviceByLabel("root"), self.lv)
+
+class DeviceTreeMonitorTestCase(unittest.TestCase):
+    """ Verify the plumbing of uevent monitoring. """
+
+    @mock.patch("blivet.udev.get_devices", return_value=[])
+    @mock.patch("blivet.udev.get_monitor")
+    def testMonitor(self, get_monitor, *args):
+        tree = DeviceTree()
+        self.assertFalse(tree.monitoring)
+        with self.assertRaises(DeviceTreeError):
+            tree.processEvents()
+
+        tree.startMonitor()
+        self.assertTrue(tree.monitoring)
+        self.assertEqual(tree.fileno(), get_monitor.return_value.fileno.return_value)
+
+        # copies of the tree do not share the monitor
+        self.assertFalse(copy.deepcopy(tree).monitoring)
+
+        events = [("add", mock.Mock())]
+        with mock.patch("blivet.udev.get_events", return_value=events):
+            with mock.patch.object(tree._populator, "handleUdevEvents") as handle:
+                self.assertEqual(tree.processEvents(), 1)
+                handle.assert_called_once_with(events)
+
+        # monitoring continues across resets
+        tree.reset()
+        self.assertTrue(tree.monitoring)
+
+        tree.stopMonitor()
+        self.assertFalse(tree.monitoring)
+
+class DeviceTreeCheckpointTestCase(unittest.TestCase):
+    """ Verify that rolling back to a checkpoint reverts changes to the tree. """
+
+    def setUp(self):
+        self.tree = DeviceTree()
+        self.disk = DiskDevice("sda", size=Size("10 GiB"), exists=True,
+                               fmt=getFormat("lvmpv", exists=True))
+        self.tree._addDevice(self.disk)
+        self.vg = LVMVolumeGroupDevice("testvg", parents=[self.disk],
+                                       exists=True)
+        self.tree._addDevice(self.vg)
+        self.lv = LVMLogicalVolumeDevice("testlv", parents=[self.vg],
+                                         size=Size("1 GiB"), exists=True,
+                                         fmt=getFormat("ext4", label="root"))
+        self.tree._addDevice(self.lv)
+
+    def testRollback(self):
+        checkpoint = self.tree.checkpoint()
+        orig_format = self.lv.format
+
+        new_lv = LVMLogicalVolumeDevice("newlv", parents=[self.vg],
+                                        size=Size("2 GiB"))
+        self.tree.registerAction(ActionCreateDevice(new_lv))
+        self.tree.registerAction(ActionCreateFormat(self.lv, getFormat("xfs")))
+        self.lv.format.label = "other"
+        self.vg.name = "othervg"
+        self.assertEqual(len(self.tree.actions.find()), 2)
+
+        self.tree.rollback(checkpoint)
+        self.assertEqual(self.tree.actions.find(), [])
+        self.assertEqual(self.tree.devices, [self.disk, self.vg, self.lv])
+        self.assertEqual(self.vg.lvs, [self.lv])
+        self.assertEqual(list(self.lv.parents), [self.vg])
+        self.assertIs(self.lv.format, orig_format)
+        self.assertEqual(self.lv.format.label, "root")
+        self.assertEqual(self.tree.getDeviceByName("testvg-testlv"), self.lv)
+        self.assertEqual(self.tree.getDeviceByLabel("root"), self.lv)
+        self.assertIsNone(self.tree.getDeviceByName("othervg"))
+        self.assertIsNone(self.tree.getDeviceByName("testvg-newlv"))
+
+        # changes after the rollback are still observed
+        self.lv.format.label = "newroot"
+        self.assertEqual(self.tree.getDeviceByLabel("newroot"), self.lv)
+
+        # a checkpoint can be rolled back to more than once
+        self.tree._removeDevice(self.lv)
+        self.tree.rollback(checkpoint)
+        self.assertEqual(self.tree.getDeviceByName("testvg-testlv"), self.lv)
+
+        with self.assertRaises(DeviceTreeError):
+            DeviceTree().rollback(checkpoint)
+
+class DeviceTreeSizeInfoTestCase(unittest.TestCase):
+    """ Verify that populating does not gather filesystems' size info. """
+
+    def setUp(self):
+        self.addCleanup(setattr, flags, "installer_mode", flags.installer_mode)
+        flags.installer_mode = True
+
+        self.available = set(["/dev/sda"])
+        for patcher in (mock.patch.object(fsresize.Ext2FSResize, "available", True),
+                        mock.patch.object(fs.os.path, "exists",
+                                          side_effect=self.available.__contains__),
+                        mock.patch.object(LVMLogicalVolumeDevice, "controllable", True),
+                        mock.patch("blivet.devicetree.udev.settle")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.tree = DeviceTree()
+        self.disk = DiskDevice("sda", size=Size("10 GiB"), exists=True,
+                               fmt=getFormat("lvmpv", exists=True))
+        self.tree._addDevice(self.disk)
+        self.vg = LVMVolumeGroupDevice("testvg", parents=[self.disk],
+                                       exists=True)
+        self.tree._addDevice(self.vg)
+        self.lv = LVMLogicalVolumeDevice("testlv", parents=[self.vg],
+                                         size=Size("1 GiB"), exists=True,
+                                         fmt=getFormat("ext4", exists=True))
+        self.tree._addDevice(self.lv)
+
+    def testPopulate(self):
+        def update(an_fs):
+            an_fs._sizeInfoPending = False
+            an_fs._size = Size("1 GiB")
+            an_fs._resizable = True
+
+        with mock.patch.object(self.tree._populator, "populate"), \
+             mock.patch.object(fs.Ext4FS, "updateSizeInfo", autospec=True,
+                               side_effect=update) as updateSizeInfo, \
+             mock.patch.object(self.lv, "setup",
+                               side_effect=lambda: self.available.add(self.lv.path)) as setup, \
+             mock.patch.object(self.lv, "teardown",
+                               side_effect=lambda **kwargs: self.available.discard(self.lv.path)) as teardown:
+            self.tree.populate()
+            self.assertTrue(self.lv.format._sizeInfoPending)
+            self.assertFalse(updateSizeInfo.called)
+            self.assertEqual(teardown.call_count, 1)
+
+            # the lv is set up only while its size info is gathered
+            self.assertTrue(self.lv.format.resizable)
+            self.assertEqual(setup.call_count, 1)
+            self.assertEqual(updateSizeInfo.call_count, 1)
+            self.assertEqual(teardown.call_count, 2)
+            teardown.assert_called_with(recursive=True)
+            self.assertNotIn(self.lv.path, self.available)
+
+            # a copy of the format, which belongs to no device, stays pending
+            orig = copy.deepcopy(self.lv.format)
+            orig._sizeInfoPending = True
+            self.assertFalse(orig.resizable)
+            self.assertEqual(setup.call_count, 1)
@@ -0,0 +1,74 @@
+import copy
+import unittest
+
+import mock
+import parted
+
+from blivet.devices import DiskFile
+from blivet.formats import getFormat
+from blivet.size import Size
+from blivet.util import sparsetmpfile
+
+class DiskLabelTestCase(unittest.TestCase):
+
+    def _addPartition(self, disklabel, start, size):
+        sector_size = Size(disklabel.partedDevice.sectorSize)
+        end = start + int(size / sector_size) - 1
+        disklabel.addPartition(start, end)
+        return disklabel.partedDisk.getPartitionBySector(start)
+
+    def testOriginalPartedDisk(self):
+        with sparsetmpfile("origdisktest", Size("100 MiB")) as disk_file:
+            disk = DiskFile(disk_file)
+            disklabel = getFormat("disklabel", device=disk.path, labelType="msdos")
+            start = disklabel.alignment.grainSize
+            self.assertEqual(len(disklabel._origPartedDisk.partitions), 0)
+
+            # copies share the original parted disk and duplicate the current one
+            partition = self._addPartition(disklabel, start, Size("10 MiB"))
+            partition.setFlag(parted.PARTITION_BOOT)
+            new = copy.deepcopy(disklabel)
+            self.assertIs(new._origPartedDisk, disklabel._origPartedDisk)
+            self.assertIsNot(new.partedDisk, disklabel.partedDisk)
+            self.assertEqual(len(new.partitions), 1)
+
+            # a copy made after a reset only gets a parted disk when it is used
+            disklabel.resetPartedDisk()
+            stale = copy.deepcopy(disklabel)
+            self.assertIsNone(stale._partedDisk)
+            self.assertEqual(len(disklabel.partitions), 0)
+            self.assertEqual(len(stale.partitions), 0)
+            self.assertIsNot(stale.partedDisk, disklabel.partedDisk)
+
+            partition = self._addPartition(disklabel, start, Size("10 MiB"))
+            partition.setFlag(parted.PARTITION_BOOT)
+            disklabel.commitToDisk()
+            orig = disklabel._origPartedDisk
+            self.assertEqual(len(orig.partitions), 1)
+            self.assertTrue(orig.partitions[0].getFlag(parted.PARTITION_BOOT))
+
+            # changes to the current parted disk don't affect the original
+            self._addPartition(disklabel, start + int(Size("40 MiB") / disklabel.sectorSize),
+                               Size("10 MiB"))
+            self.assertEqual(len(disklabel._origPartedDisk.partitions), 1)
+            self.assertEqual(len(stale._origPartedDisk.partitions), 0)
+
+            disklabel.resetPartedDisk()
+            self.assertEqual(len(disklabel.partitions), 1)
+
+    def testImagePaths(self):
+        # a disk whose parted device is an image, as when replaying a recording
+        disklabel = getFormat("disklabel", device="/dev/blivet-test-disk", exists=True)
+        disklabel._partedDevicePath = "/tmp/images/blivet-test-disk"
+        disklabel._partedDisk = mock.Mock()
+
+        disklabel.getPartitionByPath("/dev/blivet-test-disk2")
+        disklabel._partedDisk.getPartitionByPath.assert_called_once_with(
+            "/tmp/images/blivet-test-disk2")
+        partition = mock.Mock(path="/tmp/images/blivet-test-disk2")
+        self.assertEqual(disklabel.partitionPath(partition), "/dev/blivet-test-disk2")
+
+        # partitions of disks parted opened directly are left alone
+        disklabel._partedDevicePath = "/dev/blivet-test-disk"
+        partition = mock.Mock(path="/dev/blivet-test-disk2")
+        self.assertEqual(disklabel.partitionPath(partition), "/dev/blivet-test-disk2")
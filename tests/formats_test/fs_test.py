@@ -1,9 +1,13 @@
 import os
 import tempfile
 import unittest
+import mock
 
 import blivet.formats.fs as fs
+from blivet.flags import flags
+from blivet.formats import getFormat
 from blivet.size import Size, ROUND_DOWN
+from blivet.tasks import fsresize
 
 from tests import loopbackedtestcase
 
@@ -138,3 +142,57 @@ class ResizeTmpFSTestCase(loopbackedtestcase.LoopBackedTestCase):
         except Exception: # pylint: disable=broad-except
             pass
         os.rmdir(self.mountpoint)
+
+class LazySizeInfoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, flags, "installer_mode", flags.installer_mode)
+        flags.installer_mode = True
+
+    def testLazySizeInfo(self):
+        def update(an_fs):
+            an_fs._sizeInfoPending = False
+            an_fs._size = Size("100 MiB")
+            an_fs._minInstanceSize = Size("10 MiB")
+            an_fs._resizable = True
+
+        available = set(["/dev/sda1"] + ["/dev/sdb%d" % i for i in range(4)])
+        with mock.patch.object(fsresize.Ext2FSResize, "available", True), \
+             mock.patch.object(fs.os.path, "exists", side_effect=available.__contains__), \
+             mock.patch.object(fs.Ext4FS, "updateSizeInfo", autospec=True,
+                               side_effect=update) as updateSizeInfo:
+            an_fs = fs.Ext4FS(device="/dev/sda1", exists=True, size=Size("50 MiB"))
+            self.assertFalse(updateSizeInfo.called)
+
+            # describing the filesystem or reading its size gathers nothing
+            self.assertEqual(an_fs.size, Size("50 MiB"))
+            repr(an_fs)
+            self.assertFalse(an_fs.dict["resizable"])
+            self.assertFalse(updateSizeInfo.called)
+
+            # the first read of the size info gathers it, once
+            self.assertEqual(an_fs.free, Size("90 MiB"))
+            self.assertEqual(an_fs.targetSize, Size("100 MiB"))
+            self.assertTrue(an_fs.resizable)
+            self.assertEqual(updateSizeInfo.call_count, 1)
+
+            others = [fs.Ext4FS(device="/dev/sdb%d" % i, exists=True) for i in range(4)]
+            fs.prefetch_size_info(others + [an_fs, getFormat(None)])
+            self.assertEqual(updateSizeInfo.call_count, 5)
+            self.assertTrue(all(o.resizable for o in others))
+            self.assertEqual(updateSizeInfo.call_count, 5)
+
+            # nothing is gathered for filesystems that do not exist yet
+            new_fs = fs.Ext4FS(device="/dev/sdc1")
+            self.assertEqual(new_fs.minSize, new_fs._minSize)
+            self.assertEqual(updateSizeInfo.call_count, 5)
+
+            # nor for ones whose device is not available
+            inactive_fs = fs.Ext4FS(device="/dev/mapper/vg-lv", exists=True)
+            self.assertFalse(inactive_fs.resizable)
+            self.assertTrue(inactive_fs._sizeInfoPending)
+            self.assertEqual(updateSizeInfo.call_count, 5)
+
+            available.add("/dev/mapper/vg-lv")
+            self.assertTrue(inactive_fs.resizable)
+            self.assertEqual(updateSizeInfo.call_count, 6)
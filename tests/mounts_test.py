@@ -0,0 +1,72 @@
+import unittest
+import mock
+
+from blivet import mounts
+
+MOUNTINFO = """\
+17 0 253:1 / / rw,relatime shared:1 - ext4 /dev/vda1 rw,seclabel
+18 17 0:4 / /proc rw,nosuid shared:5 - proc proc rw
+40 17 253:2 / /home rw,relatime shared:20 - btrfs /dev/vdb rw,space_cache
+41 17 253:2 /srv/data /srv rw,relatime shared:21 - btrfs /dev/vdb rw,space_cache
+42 17 253:1 / /mnt rw,relatime shared:22 - ext4 /dev/vda1 rw,seclabel
+43 42 253:3 / /mnt rw,relatime shared:23 - xfs /dev/vdc rw
+"""
+
+class MountsCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = mounts.MountsCache()
+        self.cache._poller = mock.Mock()
+        self.cache._poller.poll.return_value = [(3, mounts.select.POLLPRI)]
+        self.mountinfo = MOUNTINFO
+
+        patcher = mock.patch("blivet.mounts.open", create=True,
+                             side_effect=lambda *args: mock.mock_open(read_data=self.mountinfo)(*args))
+        self.open = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testMountpoints(self):
+        self.assertEqual(self.cache.getMountpoints("/dev/vda1"), ["/", "/mnt"])
+        self.assertEqual(self.cache.getMountpoints("/dev/vdb", subvolspec=5), ["/home"])
+        self.assertEqual(self.cache.getMountpoints("/dev/vdb", subvolspec="srv/data"), ["/srv"])
+        self.assertEqual(self.cache.getMountpoints("/dev/vdd"), [])
+
+        self.assertTrue(self.cache.isMountpoint("/srv"))
+        self.assertFalse(self.cache.isMountpoint("/srv/data"))
+        self.assertEqual(self.cache.getDevspecs("/mnt"), ["/dev/vda1", "/dev/vdc"])
+        self.assertEqual(self.cache.getDevspecs("/var"), [])
+
+    def testRefresh(self):
+        self.assertTrue(self.cache.isMountpoint("/mnt"))
+        self.assertEqual(self.open.call_count, 1)
+
+        # the mount table is only read again once it has changed
+        self.cache._poller.poll.return_value = []
+        self.mountinfo = MOUNTINFO.splitlines(True)[0]
+        self.assertTrue(self.cache.isMountpoint("/mnt"))
+        self.assertEqual(self.open.call_count, 1)
+
+        self.cache._poller.poll.return_value = [(3, mounts.select.POLLPRI)]
+        self.assertFalse(self.cache.isMountpoint("/mnt"))
+        self.assertEqual(self.open.call_count, 2)
+
+class MountsPollingTestCase(unittest.TestCase):
+
+    @unittest.skipUnless(hasattr(mounts.select, "poll") and
+                         hasattr(mounts.os, "O_CLOEXEC"), "polling not supported")
+    def testClose(self):
+        import fcntl
+        cache = mounts.MountsCache()
+        self.addCleanup(cache.close)
+        with mock.patch.object(cache, "_getActiveMounts"):
+            cache.isMountpoint("/")
+
+        fd = cache._mountsFd
+        self.assertIsNotNone(fd)
+        self.assertTrue(fcntl.fcntl(fd, fcntl.F_GETFD) & fcntl.FD_CLOEXEC)
+
+        cache.close()
+        self.assertIsNone(cache._mountsFd)
+        self.assertIsNone(cache._poller)
+        with self.assertRaises(OSError):
+            mounts.os.fstat(fd)
@@ -1,10 +1,14 @@
 
+import random
 import unittest
+from decimal import Decimal
 from mock import Mock
 
 import parted
 
 from blivet.partitioning import addPartition
+from blivet.partitioning import getBestFreeSpaceRegion
+from blivet.partitioning import FreeSpaceIndex
 from blivet.partitioning import getNextPartitionType
 from blivet.partitioning import doPartitioning
 from blivet.partitioning import allocatePartitions
@@ -222,6 +226,50 @@ class PartitioningTestCase(unittest.TestCase):
                                     Size("10 MiB"), all_free[1].start)
 
 
+    def testFreeSpaceIndex(self):
+        with sparsetmpfile("freeindextest", Size("50 MiB")) as disk_file:
+            disk = DiskFile(disk_file)
+            disk.format = getFormat("disklabel", device=disk.path, exists=False)
+            parted_disk = disk.format.partedDisk
+            index = FreeSpaceIndex()
+
+            def regions(free):
+                return [(f.start, f.end) for f in free]
+
+            free = index.getFreeSpaceRegions(parted_disk)
+            self.assertEqual(regions(free),
+                             regions(parted_disk.getFreeSpaceRegions()))
+
+            # adding a partition through the index updates it
+            part = index.addPartition(disk.format, free[0],
+                                      parted.PARTITION_NORMAL, Size("10 MiB"))
+            free = index.getFreeSpaceRegions(parted_disk)
+            self.assertEqual(regions(free),
+                             regions(parted_disk.getFreeSpaceRegions()))
+            self.assertEqual(len(free), 2)
+
+            # only regions that are long enough are returned, in disk order
+            lengths = sorted(f.length for f in free)
+            self.assertEqual(regions(index.getFreeSpaceRegions(parted_disk, lengths[1])),
+                             regions(f for f in free if f.length == lengths[1]))
+            self.assertEqual(index.getFreeSpaceRegions(parted_disk, lengths[1] + 1), [])
+
+            # the best region is the same with or without the index
+            for size in (Size("1 MiB"), Size("20 MiB"), Size("100 MiB")):
+                for grow in (False, True):
+                    best = getBestFreeSpaceRegion(parted_disk,
+                                                  parted.PARTITION_NORMAL,
+                                                  size, grow=grow)
+                    indexed = getBestFreeSpaceRegion(parted_disk,
+                                                     parted.PARTITION_NORMAL,
+                                                     size, grow=grow,
+                                                     free_index=index)
+                    self.assertEqual(regions([best] if best else []),
+                                     regions([indexed] if indexed else []))
+
+            index.removePartition(disk.format, part)
+            self.assertEqual(len(index.getFreeSpaceRegions(parted_disk)), 1)
+
     def testChunk(self):
         dev1 = Mock()
         attrs = {"req_grow": True,
@@ -504,6 +552,113 @@ class PartitioningTestCase(unittest.TestCase):
         self.assertEqual(req2.growth, 3956)
         self.assertEqual(req3.growth, 512)
 
+def _referenceGrowRequests(chunk, uniform=False):
+    """ Chunk.growRequests as it was before growth was batched. """
+    chunk.sortRequests()
+    new_base = chunk.base
+    last_pool = 0
+    while not chunk.done and chunk.pool and last_pool != chunk.pool:
+        last_pool = chunk.pool
+        chunk.base = new_base
+        if uniform:
+            growth = int(last_pool / chunk.remaining)
+
+        for p in chunk.requests:
+            if p.done or p in chunk.skip_list:
+                continue
+
+            if not uniform:
+                share = Decimal(p.base) / Decimal(chunk.base)
+                growth = int(share * last_pool)
+
+            p.growth += growth
+            chunk.pool -= growth
+            new_base = chunk.trimOverGrownRequest(p, base=new_base)
+
+    if chunk.pool:
+        for p in chunk.requests:
+            if p.done or p in chunk.skip_list:
+                continue
+
+            growth = chunk.pool
+            p.growth += growth
+            chunk.pool = 0
+            chunk.trimOverGrownRequest(p)
+            if chunk.pool == 0:
+                break
+
+    chunk.skip_list = []
+
+class ChunkGrowthTestCase(unittest.TestCase):
+    """ Compare chunk growth against the original, unbatched algorithm. """
+
+    def _chunk(self, seed):
+        rand = random.Random(seed)
+        requests = []
+        for i in range(rand.randint(1, 60)):
+            dev = Mock(req_grow=rand.random() < 0.8, id=i)
+            dev.name = "req%d" % i
+            req = Request(dev)
+            req.base = rand.choice([1, 3, 7, rand.randint(1, 5000)])
+            req.max_growth = rand.choice([0, 0, rand.randint(1, 3000)])
+            requests.append(req)
+
+        pool = rand.choice([1, 2, 97, rand.randint(0, 10 ** 6)])
+        return Chunk(sum(r.base for r in requests) + pool, requests=requests)
+
+    def _diskChunk(self, seed):
+        rand = random.Random(seed)
+        sector_size = 512
+        start = rand.randint(1, 4096)
+        sector = start
+        disk = Mock(maxPartitionLength=rand.choice([2 ** 32 - 1, 50000]))
+        disk.device.sectorSize = sector_size
+
+        requests = []
+        for i in range(rand.randint(1, 60)):
+            length = rand.randint(1, 5000)
+            partition = Mock(req_grow=rand.random() < 0.8, id=i,
+                             req_bootable=rand.random() < 0.1)
+            partition.name = "part%d" % i
+            partition.req_max_size = rand.choice([Size(0), Size(rand.randint(1, 8000) * sector_size)])
+            partition.format.maxSize = Size(0)
+            partition.partedPartition.disk = disk
+            partition.partedPartition.geometry.length = length
+            partition.partedPartition.geometry.start = sector
+            partition.partedPartition.geometry.end = sector + length - 1
+            requests.append(PartitionRequest(partition))
+            sector += length
+
+        end = sector - 1 + rand.choice([1, 97, rand.randint(0, 10 ** 6)])
+        disk.maxPartitionStartSector = rand.choice([2 ** 32 - 1, rand.randint(sector, end + 1)])
+        geometry = Mock(start=start, end=end, length=end - start + 1)
+        geometry.device.sectorSize = sector_size
+        geometry.device.path = "/dev/fake"
+
+        # add them out of order to make sure the chunk sorts them
+        rand.shuffle(requests)
+        return DiskChunk(geometry, requests=requests)
+
+    def _compare(self, make_chunk):
+        for seed in range(100):
+            uniform = seed % 4 == 0
+            skip = [i for i in range(60) if i % 7 == seed % 7] if seed % 5 == 0 else []
+            results = []
+            for grow in (_referenceGrowRequests, lambda c, uniform: c.growRequests(uniform=uniform)):
+                chunk = make_chunk(seed)
+                chunk.skip_list = [r for r in chunk.requests if r.device.id in skip]
+                grow(chunk, uniform)
+                results.append((chunk.pool, chunk.base,
+                                sorted((r.device.id, r.growth, r.done) for r in chunk.requests)))
+
+            self.assertEqual(results[0], results[1], "seed %d" % seed)
+
+    def testChunkGrowth(self):
+        self._compare(self._chunk)
+
+    def testDiskChunkGrowth(self):
+        self._compare(self._diskChunk)
+
 class ExtendedPartitionTestCase(ImageBackedTestCase):
 
     disks = {"disk1": Size("2 GiB")}
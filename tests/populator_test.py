@@ -0,0 +1,186 @@
+import threading
+import unittest
+import mock
+
+from blivet.deviceaction import ActionDestroyDevice
+from blivet.devices import DiskDevice, LVMVolumeGroupDevice
+from blivet.devicetree import DeviceTree
+from blivet.flags import flags
+from blivet.formats import getFormat
+from blivet.size import Size
+from blivet import populator
+
+class FakeUdevDevice(dict):
+    def __init__(self, name, **kwargs):
+        super(FakeUdevDevice, self).__init__(DEVNAME="/dev/%s" % name, **kwargs)
+        self.sys_name = name
+        self.sys_path = "/sys/devices/virtual/block/%s" % name
+
+class PopulatorProbeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.populator = DeviceTree()._populator
+        self.orig_workers = flags.probe_workers
+        self.threads = set()
+
+        patcher = mock.patch.object(populator.blockdev, "mpath")
+        self.mpath = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mpath.is_mpath_member.side_effect = self._isMpathMember
+
+        patcher = mock.patch.object(populator.blockdev, "md")
+        self.md = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(populator.blockdev, "crypto")
+        self.crypto = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.devices = [FakeUdevDevice("sda"),
+                        FakeUdevDevice("sdb", ID_FS_TYPE="linux_raid_member"),
+                        FakeUdevDevice("sdc"),
+                        FakeUdevDevice("sde", ID_FS_TYPE="crypto_LUKS")]
+
+    def tearDown(self):
+        flags.probe_workers = self.orig_workers
+
+    def _isMpathMember(self, path):
+        self.threads.add(threading.current_thread().name)
+        if path == "/dev/sdc":
+            raise RuntimeError("multipath failed")
+
+        return path == "/dev/sda"
+
+    def testProbeDevices(self):
+        flags.probe_workers = 4
+        self.populator._probeDevices(self.devices)
+
+        self.assertEqual(self.mpath.is_mpath_member.call_count, 4)
+        self.assertNotIn(threading.current_thread().name, self.threads)
+        self.md.examine.assert_called_once_with("/dev/sdb")
+        self.crypto.luks_uuid.assert_called_once_with("/dev/sde")
+
+        # probed facts are not looked up again
+        self.assertTrue(self.populator._probed("mpath_member", "/dev/sda",
+                                               self.mpath.is_mpath_member))
+        self.assertFalse(self.populator._probed("mpath_member", "/dev/sdb",
+                                                self.mpath.is_mpath_member))
+        self.assertEqual(self.mpath.is_mpath_member.call_count, 4)
+        self.assertEqual(self.populator._probed("md_examine", "/dev/sdb",
+                                                self.md.examine),
+                         self.md.examine.return_value)
+        self.assertEqual(self.populator._probed("luks_uuid", "/dev/sde",
+                                                self.crypto.luks_uuid),
+                         self.crypto.luks_uuid.return_value)
+
+        # errors are raised where the fact is used
+        with self.assertRaises(RuntimeError):
+            self.populator._probed("mpath_member", "/dev/sdc",
+                                   self.mpath.is_mpath_member)
+
+        # facts that were not probed are obtained directly
+        self.assertFalse(self.populator._probed("mpath_member", "/dev/sdd",
+                                                self.mpath.is_mpath_member))
+        self.assertEqual(self.mpath.is_mpath_member.call_count, 5)
+
+        # probed facts are only used once; later checks look them up again
+        self.assertTrue(self.populator._probed("mpath_member", "/dev/sda",
+                                               self.mpath.is_mpath_member))
+        self.assertEqual(self.mpath.is_mpath_member.call_count, 6)
+
+    def testProbeBatches(self):
+        flags.probe_workers = 4
+        self.populator._probeDevices(self.devices)
+        self.assertEqual(self.mpath.is_mpath_member.call_count, 4)
+
+        # facts from an earlier batch are not used for a later one
+        self.populator._probeDevices([FakeUdevDevice("sdd")])
+        self.assertEqual(self.mpath.is_mpath_member.call_count, 4)
+        self.assertTrue(self.populator._probed("mpath_member", "/dev/sda",
+                                               self.mpath.is_mpath_member))
+        self.assertEqual(self.mpath.is_mpath_member.call_count, 5)
+
+    def testSerialProbing(self):
+        flags.probe_workers = 1
+        self.populator._probeDevices(self.devices)
+        self.assertFalse(self.mpath.is_mpath_member.called)
+
+        self.assertTrue(self.populator._probed("mpath_member", "/dev/sda",
+                                               self.mpath.is_mpath_member))
+        self.assertEqual(self.threads, set([threading.current_thread().name]))
+
+class PopulatorEventsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = DeviceTree()
+        self.populator = self.tree._populator
+
+        self.disk = DiskDevice("sda", size=Size("10 GiB"), exists=True,
+                               sysfsPath="/sys/devices/virtual/block/sda",
+                               fmt=getFormat("lvmpv", exists=True))
+        self.tree._addDevice(self.disk)
+        self.vg = LVMVolumeGroupDevice("testvg", parents=[self.disk],
+                                       exists=True)
+        self.tree._addDevice(self.vg)
+        self.info = FakeUdevDevice("sda", ID_FS_TYPE="LVM2_member")
+        self.populator._formatKeys[self.info.sys_path] = populator._udevFormatKey(self.info)
+
+        for name in ("addUdevDevice", "handleUdevDeviceFormat"):
+            patcher = mock.patch.object(self.populator, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(populator.udev, "get_devices",
+                                    return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # the devices' current udev info, by sysfs path
+        self.current = {self.info.sys_path: self.info}
+        patcher = mock.patch.object(populator.udev, "get_device",
+                                    side_effect=self.current.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testAddEvents(self):
+        new = FakeUdevDevice("sdb")
+        self.populator.handleUdevEvents([("add", self.info), ("add", new),
+                                         ("change", new)])
+        self.populator.addUdevDevice.assert_called_once_with(new)
+
+        # devices that are removed again are not added
+        self.populator.addUdevDevice.reset_mock()
+        self.populator.handleUdevEvents([("add", new), ("remove", new)])
+        self.assertFalse(self.populator.addUdevDevice.called)
+
+    def testRemoveEvents(self):
+        self.populator.handleUdevEvents([("remove", self.info)])
+        self.assertIsNone(self.tree.getDeviceByName("sda"))
+        self.assertIsNone(self.tree.getDeviceByName("testvg"))
+
+    def testRemoveWithPendingActions(self):
+        self.tree.registerAction(ActionDestroyDevice(self.vg))
+        self.populator.handleUdevEvents([("remove", self.info)])
+        self.assertEqual(self.tree.getDeviceByName("sda"), self.disk)
+
+    def testChangeEvents(self):
+        # nothing that identifies the formatting has changed
+        changed = FakeUdevDevice("sda", ID_FS_TYPE="LVM2_member",
+                                 DEVLINKS="/dev/disk/by-id/foo")
+        self.populator.handleUdevEvents([("change", changed)])
+        self.assertFalse(self.populator.handleUdevDeviceFormat.called)
+        self.assertEqual(self.tree.getDeviceByName("testvg"), self.vg)
+
+        # the event is older than the device's current state
+        changed = FakeUdevDevice("sda", ID_FS_TYPE="xfs", ID_FS_UUID="abc")
+        self.populator.handleUdevEvents([("change", changed)])
+        self.assertFalse(self.populator.handleUdevDeviceFormat.called)
+        self.assertEqual(self.tree.getDeviceByName("testvg"), self.vg)
+
+        # the pv has been reformatted
+        self.current[changed.sys_path] = changed
+        self.populator.handleUdevEvents([("change", changed)])
+        self.populator.handleUdevDeviceFormat.assert_called_once_with(changed,
+                                                                      self.disk)
+        self.assertIsNone(self.tree.getDeviceByName("testvg"))
+        self.assertEqual(self.tree.getDeviceByName("sda"), self.disk)
@@ -24,6 +24,7 @@
 # we need integer division to work the same with both Python 2 and 3
 from __future__ import division
 
+import copy
 import locale
 import os
 import unittest
@@ -458,3 +459,28 @@ class UtilityMethodsTestCase(unittest.TestCase):
         self.assertIsInstance(2/s, Decimal)
         self.assertIsInstance(2**Size(2), Decimal)
         self.assertIsInstance(1024 % Size(127), Decimal)
+
+    def testIntegralArithmetic(self):
+        # the results must not differ from those of Decimal arithmetic
+        values = [Size(0), Size(1), Size(-7), Size("1 MiB"), Size("10.3 GiB"),
+                  Size("-3 TiB"), 3, -5, 4096]
+        ops = ["__add__", "__radd__", "__sub__", "__mul__", "__truediv__",
+               "__floordiv__", "__mod__"]
+        for a in values[:6]:
+            for b in values:
+                for op in ops:
+                    if not b and op in ("__truediv__", "__floordiv__", "__mod__"):
+                        continue
+
+                    expected = Size(getattr(Decimal, op)(Decimal(a), b))
+                    result = getattr(a, op)(b)
+                    self.assertIsInstance(result, Size)
+                    self.assertEqual(result, expected, msg="%s %s %s" % (a, op, b))
+
+        self.assertEqual(sum([Size(1), Size(2)]), Size(3))
+        self.assertEqual(Size(True), Size(1))
+        self.assertEqual(Size(Size(5)), Size(5))
+
+        s = Size("1 GiB")
+        self.assertEqual(copy.deepcopy(s), s)
+        self.assertIsInstance(copy.deepcopy(s), Size)
@@ -0,0 +1,85 @@
+import unittest
+import mock
+
+from blivet import statuscache
+from blivet.devices import dm
+from blivet.devices import DMDevice, StorageDevice
+
+class StatusCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = statuscache.StatusCache()
+        self.devices = [mock.Mock(id=i) for i in range(3)]
+        self.statuses = dict((d.id, True) for d in self.devices)
+
+    def _probe(self, device):
+        return lambda: self.statuses[device.id]
+
+    def testCaching(self):
+        (dev0, dev1, dev2) = self.devices
+        probe = mock.Mock(side_effect=self._probe(dev0))
+
+        # nothing is cached outside of a pass
+        self.assertTrue(self.cache.get(dev0, probe))
+        self.assertTrue(self.cache.get(dev0, probe))
+        self.assertEqual(probe.call_count, 2)
+
+        with self.cache.cached():
+            with self.cache.cached():
+                self.assertTrue(self.cache.get(dev0, probe))
+
+            self.statuses[dev0.id] = False
+            self.assertTrue(self.cache.get(dev0, probe))
+            self.assertEqual(probe.call_count, 3)
+            self.assertEqual((self.cache.probes, self.cache.hits), (1, 1))
+
+            # only the given devices are forgotten
+            self.assertTrue(self.cache.get(dev1, self._probe(dev1)))
+            self.statuses[dev1.id] = False
+            self.cache.invalidate([dev0, dev2])
+            self.assertFalse(self.cache.get(dev0, probe))
+            self.assertTrue(self.cache.get(dev1, self._probe(dev1)))
+
+            self.cache.invalidate()
+            self.assertFalse(self.cache.get(dev1, self._probe(dev1)))
+
+        self.assertFalse(self.cache.active)
+        self.statuses[dev0.id] = True
+        self.assertTrue(self.cache.get(dev0, probe))
+
+    def testInvalidateWhileProbing(self):
+        dev0 = self.devices[0]
+
+        def probe():
+            self.cache.invalidate([dev0])
+            return self.statuses[dev0.id]
+
+        with self.cache.cached():
+            self.assertTrue(self.cache.get(dev0, probe))
+            self.statuses[dev0.id] = False
+            # the first probe may have been stale, so it was not kept
+            self.assertFalse(self.cache.get(dev0, probe))
+
+    def testDeviceStatus(self):
+        cache = statuscache.StatusCache()
+        parent = StorageDevice("parent")
+        device = DMDevice("test", parents=[parent])
+        device.exists = True
+
+        with mock.patch.object(dm, "statusCache", cache), \
+             mock.patch("blivet.devices.storage.statusCache", cache), \
+             mock.patch.object(dm.blockdev, "dm") as blockdev_dm:
+            blockdev_dm.map_exists.return_value = True
+            with cache.cached():
+                self.assertTrue(device.status)
+                self.assertTrue(device.status)
+                self.assertEqual(blockdev_dm.map_exists.call_count, 1)
+
+                # a change to a related device makes the status stale
+                blockdev_dm.map_exists.return_value = False
+                parent._statusChanged()
+                self.assertFalse(device.status)
+                self.assertEqual(blockdev_dm.map_exists.call_count, 2)
+
+            self.assertFalse(device.status)
+            self.assertEqual(blockdev_dm.map_exists.call_count, 3)
@@ -0,0 +1,80 @@
+import inspect
+import logging
+import unittest
+
+from blivet import storage_log
+
+class Formatted(object):
+    """ An object that counts how many times it has been formatted. """
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count += 1
+        return "formatted"
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class StorageLogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.orig_level = storage_log.log.level
+        storage_log.log.addHandler(self.handler)
+
+    def tearDown(self):
+        storage_log.log.removeHandler(self.handler)
+        storage_log.log.setLevel(self.orig_level)
+
+    def testFunctionNameAndDepth(self):
+        (name, depth) = storage_log.function_name_and_depth()
+        self.assertEqual(name, "testFunctionNameAndDepth")
+        self.assertEqual(depth, len(inspect.stack()))
+
+    def testLogMethodCall(self):
+        storage_log.log.setLevel(logging.DEBUG)
+        arg = Formatted()
+        storage_log.log_method_call(self, arg, password="secret", size=3)
+        self.assertGreater(arg.count, 0)
+        self.assertEqual(len(self.handler.messages), 1)
+        message = self.handler.messages[0]
+        self.assertIn("StorageLogTestCase.testLogMethodCall:", message)
+        self.assertIn("formatted", message)
+        self.assertIn("password: Skipped", message)
+        self.assertNotIn("secret", message)
+
+        storage_log.log_method_return(self, arg)
+        self.assertEqual(self.handler.messages[-1].strip(),
+                         "StorageLogTestCase.testLogMethodCall returned formatted")
+
+    def testLazyFormatting(self):
+        storage_log.log.setLevel(logging.INFO)
+        arg = Formatted()
+        storage_log.log_method_call(self, arg, info=storage_log.lazy_pformat(arg))
+        storage_log.log_method_return(self, arg)
+        self.assertEqual(arg.count, 0)
+        self.assertEqual(self.handler.messages, [])
+
+        storage_log.log.setLevel(logging.DEBUG)
+        transformed = []
+        lazy = storage_log.lazy_pformat({"a": 1}, transform=lambda d: transformed.append(d) or d)
+        storage_log.log_method_call(self, info=lazy)
+        self.assertTrue(transformed)
+        self.assertIn("info: {'a': 1}", self.handler.messages[-1])
+
+    def testLogExceptionInfo(self):
+        storage_log.log.setLevel(logging.INFO)
+        try:
+            raise ValueError("oops")
+        except ValueError:
+            storage_log.log_exception_info(storage_log.log.debug)
+            self.assertEqual(self.handler.messages, [])
+            storage_log.log_exception_info(storage_log.log.info)
+
+        self.assertTrue(any("oops" in m for m in self.handler.messages))
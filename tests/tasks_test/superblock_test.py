@@ -0,0 +1,139 @@
+import os
+import struct
+import tempfile
+import unittest
+import uuid
+
+from blivet.errors import FSError
+from blivet.formats import getFormat
+from blivet.size import Size
+from blivet.tasks import fssuperblock
+
+UUID = "2c8a2d19-bc13-4a3b-8e37-5b5de3a4b9a5"
+
+def _image():
+    return bytearray(fssuperblock.READ_SIZE)
+
+def _ext4_image(blockCount, freeBlocks):
+    data = _image()
+    struct.pack_into("<IIII", data, 1024, 0, blockCount & 0xFFFFFFFF, 0,
+                     freeBlocks & 0xFFFFFFFF)
+    struct.pack_into("<I", data, 1024 + 24, 2) # 4 KiB blocks
+    struct.pack_into("<H", data, 1024 + 56, 0xEF53)
+    struct.pack_into("<I", data, 1024 + 96, 0x80) # 64bit
+    data[1024 + 104:1024 + 120] = uuid.UUID(UUID).bytes
+    data[1024 + 120:1024 + 124] = b"root"
+    struct.pack_into("<I", data, 1024 + 336, blockCount >> 32)
+    struct.pack_into("<I", data, 1024 + 344, freeBlocks >> 32)
+    return bytes(data)
+
+def _xfs_image():
+    data = _image()
+    data[0:4] = b"XFSB"
+    struct.pack_into(">IQ", data, 4, 4096, 262144)
+    data[32:48] = uuid.UUID(UUID).bytes
+    data[108:112] = b"home"
+    struct.pack_into(">Q", data, 144, 1000)
+    return bytes(data)
+
+def _btrfs_image():
+    data = _image()
+    offset = 64 * 1024
+    data[offset + 0x20:offset + 0x30] = uuid.UUID(UUID).bytes
+    data[offset + 0x40:offset + 0x48] = b"_BHRfS_M"
+    struct.pack_into("<QQ", data, offset + 0x70, 1024 ** 3, 1024 ** 2)
+    struct.pack_into("<I", data, offset + 0x90, 4096)
+    data[offset + 0x12b:offset + 0x12e] = b"vol"
+    return bytes(data)
+
+def _vfat_image():
+    data = _image()
+    struct.pack_into("<HBH", data, 11, 512, 8, 32)
+    struct.pack_into("<I", data, 32, 409600)
+    struct.pack_into("<HI", data, 22, 0, 0)
+    struct.pack_into("<H", data, 48, 1)
+    struct.pack_into("<I", data, 67, 0x1234ABCD)
+    data[510:512] = b"\x55\xaa"
+    data[512:516] = b"RRaA"
+    data[512 + 484:512 + 488] = b"rrAa"
+    struct.pack_into("<I", data, 512 + 488, 100)
+    return bytes(data)
+
+def _swap_image():
+    data = _image()
+    struct.pack_into("<II", data, 1024, 1, 255)
+    data[1036:1052] = uuid.UUID(UUID).bytes
+    data[1052:1056] = b"swap"
+    data[4096 - 10:4096] = b"SWAPSPACE2"
+    return bytes(data)
+
+class _FakeFS(object):
+    def __init__(self, device):
+        self.device = device
+
+class SuperblockTestCase(unittest.TestCase):
+
+    def testParsing(self):
+        sb = fssuperblock.parse_superblock(_ext4_image(2 ** 33, 2 ** 32 + 5), "ext4")
+        self.assertEqual(sb, (4096, 2 ** 33, 2 ** 32 + 5, UUID, "root"))
+        self.assertEqual(sb.size, Size(4096 * 2 ** 33))
+
+        sb = fssuperblock.parse_superblock(_xfs_image(), "xfs")
+        self.assertEqual(sb, (4096, 262144, 1000, UUID, "home"))
+        self.assertEqual(sb.size, Size("1 GiB"))
+
+        sb = fssuperblock.parse_superblock(_btrfs_image(), "btrfs")
+        self.assertEqual(sb, (4096, 262144, 262144 - 256, UUID, "vol"))
+        self.assertEqual(sb.free, Size("1023 MiB"))
+
+        sb = fssuperblock.parse_superblock(_vfat_image(), "vfat")
+        self.assertEqual(sb, (512, 409600, 800, "1234-ABCD", None))
+        self.assertEqual(sb.size, Size("200 MiB"))
+
+        sb = fssuperblock.parse_superblock(_swap_image(), "swap")
+        self.assertEqual(sb, (4096, 256, None, UUID, "swap"))
+
+    def testWrongType(self):
+        for fstype in ("ext2", "xfs", "btrfs", "vfat", "swap"):
+            self.assertIsNone(fssuperblock.parse_superblock(_image(), fstype))
+
+        self.assertIsNone(fssuperblock.parse_superblock(_xfs_image(), "ext2"))
+        self.assertIsNone(fssuperblock.parse_superblock(b"XFSB", "xfs"))
+        self.assertRaises(ValueError, fssuperblock.parse_superblock, _image(), "ntfs")
+
+    def testTask(self):
+        with tempfile.NamedTemporaryFile() as image:
+            image.write(_xfs_image())
+            image.flush()
+
+            task = fssuperblock.XFSSuperblock(_FakeFS(image.name))
+            self.assertTrue(task.available)
+            self.assertEqual(task.doTask().label, "home")
+
+            task = fssuperblock.Ext2FSSuperblock(_FakeFS(image.name))
+            self.assertRaises(FSError, task.doTask)
+
+        missing = os.path.join(tempfile.gettempdir(), "no-such-device-%s" % UUID)
+        task = fssuperblock.XFSSuperblock(_FakeFS(missing))
+        self.assertRaises(FSError, task.doTask)
+
+    def testSwapSpace(self):
+        with tempfile.NamedTemporaryFile() as image:
+            image.write(_swap_image())
+            image.flush()
+
+            # the signature takes precedence over what udev reported
+            swap = getFormat("swap", device=image.name, exists=True,
+                             uuid="udev-uuid", label="udev-label")
+            self.assertEqual((swap.uuid, swap.label), (UUID, "swap"))
+
+            image.seek(0)
+            image.write(_image())
+            image.flush()
+            swap = getFormat("swap", device=image.name, exists=True,
+                             uuid="udev-uuid", label="udev-label")
+            self.assertEqual((swap.uuid, swap.label), ("udev-uuid", "udev-label"))
+
+        missing = os.path.join(tempfile.gettempdir(), "no-such-device-%s" % UUID)
+        swap = getFormat("swap", device=missing, exists=True, uuid="udev-uuid")
+        self.assertEqual(swap.uuid, "udev-uuid")
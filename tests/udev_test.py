@@ -1,4 +1,5 @@
 
+import os
 import unittest
 import mock
 
@@ -34,3 +35,135 @@ class UdevTest(unittest.TestCase):
         import blivet.udev
         blivet.udev.trigger()
         self.assertTrue(blivet.udev.util.run_program.called)
+
+class FakeUevent(dict):
+    def __init__(self, seqnum, sys_path, subsystem="block"):
+        super(FakeUevent, self).__init__(SEQNUM=str(seqnum))
+        self.sys_path = sys_path
+        self.subsystem = subsystem
+
+class FakeMonitor(object):
+    def __init__(self, fd=None):
+        self.events = []
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def start(self):
+        pass
+
+    def poll(self, timeout=None):
+        # pylint: disable=unused-argument
+        return self.events.pop(0) if self.events else None
+
+class SettleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import blivet.udev
+        self.udev = blivet.udev
+        # nothing is ever written to the pipe, so waiting for the processed
+        # events monitor always times out
+        (read_fd, write_fd) = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        self.kernel = FakeMonitor()
+        self.processed = FakeMonitor(read_fd)
+
+        for (obj, attr, value) in ((blivet.udev.pyudev.Monitor, "from_netlink", mock.Mock(return_value=self.kernel)),
+                                   (blivet.udev, "get_monitor", mock.Mock(return_value=self.processed)),
+                                   (blivet.udev.util, "run_program", mock.Mock(return_value=0)),
+                                   (blivet.udev.os.path, "exists", mock.Mock(return_value=False))):
+            patcher = mock.patch.object(obj, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        blivet.udev.settle_stats.reset()
+
+    def _emit(self, seqnum, sys_path, processed=True):
+        event = FakeUevent(seqnum, sys_path)
+        self.kernel.events.append(event)
+        if processed:
+            self.processed.events.append(event)
+
+    def testUncoalesced(self):
+        self.udev.settle()
+        self.udev.settle()
+        self.assertEqual(self.udev.util.run_program.call_count, 2)
+        self.assertEqual(self.udev.settle_stats.run, 2)
+
+    def testCoalesced(self):
+        stats = self.udev.settle_stats
+        with self.udev.coalesced_settles():
+            # nothing is known about events emitted before the monitors started
+            self.udev.settle(devices=["/sys/block/sda"])
+            self.assertEqual(stats.run, 1)
+
+            # no new events
+            self.udev.settle()
+            self.udev.settle()
+            self.assertEqual(stats.skipped, 2)
+
+            # all new events have been processed
+            self._emit(1, "/sys/block/sda")
+            self.udev.settle()
+            self.assertEqual(stats.skipped, 3)
+
+            # an event for another device is still being processed
+            self._emit(2, "/sys/block/sdb", processed=False)
+            self._emit(3, "/sys/block/sda/sda1")
+            self.udev.settle(devices=["/sys/block/sda"])
+            self.assertEqual(stats.scoped, 1)
+
+            self.udev.settle()
+            self.assertEqual(stats.run, 2)
+
+            # udev has its own queue of events
+            self.udev.os.path.exists.return_value = True
+            self.udev.settle()
+            self.assertEqual(stats.run, 3)
+
+        self.assertEqual(stats.requested, 7)
+        self.assertEqual(len(self._settles()), 3)
+        # udev was only pinged when new events had been seen
+        self.assertEqual(len(self._pings()), 2)
+        self.assertIsNone(self.udev._settle_state)
+
+    def _settles(self):
+        return [c for c in self.udev.util.run_program.call_args_list
+                if c[0][0][:2] == ["udevadm", "settle"]]
+
+    def _pings(self):
+        return [c for c in self.udev.util.run_program.call_args_list
+                if c[0][0][:3] == ["udevadm", "control", "--ping"]]
+
+    def testNoPing(self):
+        self.addCleanup(setattr, self.udev, "_ping_supported", True)
+        with self.udev.coalesced_settles():
+            self.udev.settle()
+            self.udev.util.run_program.return_value = 1
+            self._emit(1, "/sys/block/sda")
+            self.udev.settle()
+
+            # settles are not coalesced once udev failed to answer
+            self.assertIsNone(self.udev._settle_state)
+            self._emit(2, "/sys/block/sda")
+            self.udev.settle()
+
+        with self.udev.coalesced_settles():
+            self.assertIsNone(self.udev._settle_state)
+            self.udev.settle()
+
+        self.assertEqual(self.udev.settle_stats.skipped, 0)
+        self.assertEqual(len(self._settles()), 4)
+        self.assertEqual(len(self._pings()), 1)
+
+    def testScopedTimeout(self):
+        with mock.patch.object(self.udev, "SETTLE_TIMEOUT", 0.01), \
+             self.udev.coalesced_settles():
+            self.udev.settle()
+            self._emit(1, "/sys/block/sda", processed=False)
+            self.udev.settle(devices=["/sys/block/sda"])
+
+        self.assertEqual(self.udev.settle_stats.scoped, 0)
+        self.assertEqual(self.udev.settle_stats.run, 2)
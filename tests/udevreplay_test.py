@@ -0,0 +1,207 @@
+import errno
+import os
+import tempfile
+import unittest
+import mock
+
+import parted
+import _ped
+
+from blivet import udev
+from blivet import udevreplay
+from blivet.formats import getFormat
+from blivet.size import Size
+from blivet.util import sparsetmpfile
+
+class FakeUdevDevice(dict):
+    def __init__(self, name, **kwargs):
+        super(FakeUdevDevice, self).__init__(DEVNAME="/dev/%s" % name, **kwargs)
+        self.sys_name = name
+        self.sys_path = "/sys/devices/virtual/block/%s" % name
+
+class FakeBackend(udev.UdevBackend):
+    """ A backend with a single disk on it. """
+
+    def __init__(self):
+        self.disk = FakeUdevDevice("sda", DEVTYPE="disk", ID_FS_TYPE="ext4")
+        self.parted_devices = {}
+
+    def get_device(self, sysfs_path):
+        return self.disk if sysfs_path == self.disk.sys_path else None
+
+    def list_devices(self, subsystem):
+        return [self.disk]
+
+    def settle(self):
+        pass
+
+    def exists(self, path):
+        return path == "/dev/sda"
+
+    def listdir(self, path):
+        if path != "/sys/block/sda/slaves":
+            raise OSError("no such directory")
+
+        return []
+
+    def get_sysfs_attr(self, path, attr):
+        return "2048" if attr == "size" else None
+
+    def get_parted_device(self, path):
+        if path not in self.parted_devices:
+            raise _ped.DeviceException("no such device")
+
+        return self.parted_devices[path]
+
+    def run_program(self, argv):
+        if argv[0] != "lvm":
+            raise OSError(errno.ENOENT, "no such program")
+
+        return (0, "report")
+
+class PVData(object):
+    def __init__(self, pv_name, vg_name):
+        self.pv_name = pv_name
+        self.vg_name = vg_name
+
+class UdevReplayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = udevreplay.RecordingBackend(FakeBackend())
+        fd, self.filename = tempfile.mkstemp(prefix="udevreplay")
+        os.close(fd)
+        self.addCleanup(os.unlink, self.filename)
+
+    def _replay(self):
+        self.recorder.save(self.filename)
+        return udevreplay.ReplayBackend.load(self.filename)
+
+    def testDevices(self):
+        recorder = self.recorder
+        disk = recorder.list_devices("block")[0]
+        self.assertIs(recorder.get_device(disk.sys_path), disk)
+        self.assertIsNone(recorder.get_device("/sys/devices/nothing"))
+        self.assertTrue(recorder.exists("/dev/sda"))
+        self.assertEqual(recorder.get_sysfs_attr(disk.sys_path, "size"), "2048")
+        self.assertEqual(recorder.listdir("/sys/block/sda/slaves"), [])
+        self.assertRaises(OSError, recorder.listdir, "/sys/block/sdb/slaves")
+
+        replay = self._replay()
+        replayed = replay.list_devices("block")
+        self.assertEqual(replayed, [disk])
+        self.assertEqual(replayed[0].sys_name, "sda")
+        self.assertEqual(replay.get_device(disk.sys_path), disk)
+        self.assertIsNone(replay.get_device("/sys/devices/nothing"))
+        self.assertTrue(replay.exists("/dev/sda"))
+        self.assertEqual(replay.get_sysfs_attr(disk.sys_path, "size"), "2048")
+        self.assertEqual(replay.listdir("/sys/block/sda/slaves"), [])
+        self.assertRaises(OSError, replay.listdir, "/sys/block/sdb/slaves")
+        self.assertEqual(replay.misses, [])
+
+        # things that were never looked at don't exist
+        self.assertFalse(replay.exists("/dev/sdb"))
+        self.assertIsNone(replay.get_sysfs_attr(disk.sys_path, "ro"))
+        self.assertRaises(IOError, replay.read, "/sys/block/sda/loop/backing_file")
+        self.assertEqual(len(replay.misses), 3)
+
+    def testBlockDev(self):
+        pvs = mock.Mock(return_value=[PVData("/dev/sda1", "vg")])
+        failure = mock.Mock(side_effect=ValueError("not a PV"))
+
+        self.assertEqual(self.recorder.call_blockdev("blockdev.lvm.pvs", pvs, (), {}),
+                         pvs.return_value)
+        self.assertRaises(ValueError, self.recorder.call_blockdev,
+                          "blockdev.lvm.pvinfo", failure, ("/dev/sdb",), {})
+
+        replay = self._replay()
+        errors = mock.Mock(ValueError=ValueError, LVMError=KeyError,
+                           BlockDevError=RuntimeError)
+        with mock.patch.object(udevreplay, "blockdev", errors):
+            result = replay.call_blockdev("blockdev.lvm.pvs", pvs, (), {})
+            self.assertEqual((result[0].pv_name, result[0].vg_name), ("/dev/sda1", "vg"))
+            self.assertRaises(ValueError, replay.call_blockdev,
+                              "blockdev.lvm.pvinfo", failure, ("/dev/sdb",), {})
+
+            # calls that were not recorded fail the way the plugin would
+            self.assertRaises(KeyError, replay.call_blockdev,
+                              "blockdev.lvm.pvinfo", failure, ("/dev/sdc",), {})
+            self.assertRaises(RuntimeError, replay.call_blockdev,
+                              "blockdev.loop.get_loop_name", failure, ("/dev/sdc",), {})
+
+        self.assertEqual(pvs.call_count, 1)
+        self.assertEqual(failure.call_count, 1)
+
+    def _label(self, path):
+        device = parted.Device(path=path)
+        disk = parted.freshDisk(device, "msdos")
+        for (start, end) in ((2048, 22527), (22528, 43007)):
+            geometry = parted.Geometry(device=device, start=start, end=end)
+            partition = parted.Partition(disk=disk, type=parted.PARTITION_NORMAL,
+                                         geometry=geometry)
+            disk.addPartition(partition=partition,
+                              constraint=parted.Constraint(exactGeom=geometry))
+
+        disk.getPartitionBySector(2048).setFlag(parted.PARTITION_BOOT)
+        disk.commitToDevice()
+        return (device, udevreplay.PartitionTable.fromPartedDisk(disk))
+
+    def testPartedDevice(self):
+        with sparsetmpfile("replaytest", Size("100 MiB")) as disk_file:
+            (device, table) = self._label(disk_file)
+            self.recorder._backend.parted_devices["/dev/sda"] = device
+            self.assertTrue(self.recorder.exists("/dev/sda"))
+            self.assertIs(self.recorder.get_parted_device("/dev/sda"), device)
+            self.assertRaises(_ped.DeviceException, self.recorder.get_parted_device,
+                              "/dev/sdb")
+
+        replay = self._replay()
+        self.addCleanup(replay.close)
+        self.assertRaises(_ped.DeviceException, replay.get_parted_device, "/dev/sdb")
+        self.assertRaises(_ped.DeviceException, replay.get_parted_device, "/dev/sdc")
+
+        # parted reads the recorded partition table from an image of the disk
+        replayed = replay.get_parted_device("/dev/sda")
+        self.assertNotEqual(replayed.path, "/dev/sda")
+        self.assertEqual(os.path.basename(replayed.path), "sda")
+        self.assertEqual(replayed.length, device.length)
+        self.assertEqual(udevreplay.PartitionTable.fromPartedDisk(parted.Disk(device=replayed)),
+                         table)
+
+        with udev.using_backend(replay):
+            label = getFormat("disklabel", device="/dev/sda", exists=True)
+
+        self.assertEqual(udevreplay.PartitionTable.fromPartedDisk(label._origPartedDisk),
+                         table)
+        self.assertEqual(label.getPartitionByPath("/dev/sda2").geometry.start, 22528)
+        self.assertIsNone(label.getPartitionByPath("/dev/sda3"))
+
+        replay.close()
+        self.assertFalse(os.path.exists(replayed.path))
+
+    def testPrograms(self):
+        self.assertEqual(self.recorder.run_program(["lvm", "fullreport"]), (0, "report"))
+        self.assertRaises(OSError, self.recorder.run_program, ["mdadm"])
+
+        replay = self._replay()
+        self.assertEqual(replay.run_program(["lvm", "fullreport"]), (0, "report"))
+        with self.assertRaises(OSError) as cm:
+            replay.run_program(["mdadm"])
+        self.assertEqual(cm.exception.errno, errno.ENOENT)
+
+        # programs that were not run while recording are not run either
+        self.assertRaises(OSError, replay.run_program, ["lvm", "pvs"])
+        self.assertFalse(replay.devices_available)
+
+    def testUsingBackend(self):
+        original = udev.backend
+        with udev.using_backend(self.recorder):
+            self.assertIs(udev.backend, self.recorder)
+            devices = udev.get_devices()
+            self.assertEqual([d.sys_name for d in devices], ["sda"])
+            self.assertEqual(udev.get_sysfs_attr(devices[0].sys_path, "size"), "2048")
+
+        self.assertIs(udev.backend, original)
+        self.assertIn("block", self.recorder.recording["devices"])
+
+    def testVersion(self):
+        self.assertRaises(ValueError, udevreplay.ReplayBackend, {"version": 0})
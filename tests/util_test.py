@@ -1,7 +1,10 @@
 
+import time
 import unittest
 from decimal import Decimal
 
+import mock
+
 from blivet import util
 
 class MiscTest(unittest.TestCase):
@@ -21,3 +24,30 @@ class MiscTest(unittest.TestCase):
             self.assertTrue(util.power_of_two(2 ** i), msg=i)
             self.assertFalse(util.power_of_two(2 ** i + 1), msg=i)
             self.assertFalse(util.power_of_two(2 ** i - 1), msg=i)
+
+class RunProgramTest(unittest.TestCase):
+
+    def test_run_program(self):
+        (rc, out) = util.run_program_and_capture_output(["echo", "hello"])
+        self.assertEqual(rc, 0)
+        self.assertEqual(out.strip(), "hello")
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertNotEqual(util.run_program(["sleep", "10"], timeout=0.5), 0)
+        self.assertLess(time.time() - start, 5)
+
+    def test_concurrent(self):
+        # the programs do not wait for one another to finish
+        start = time.time()
+        results = [util.run_program_async(["sleep", "1"]) for _i in range(4)]
+        self.assertEqual([r.get(timeout=10)[0] for r in results], [0] * 4)
+        self.assertLess(time.time() - start, 3)
+
+    def test_log_command_first(self):
+        # the command line is logged when the program starts, not when it ends
+        with mock.patch.object(util, "program_log") as program_log:
+            result = util.run_program_async(["sleep", "1"])
+            time.sleep(0.5)
+            program_log.info.assert_called_once_with("Running... %s", "sleep 1")
+            self.assertEqual(result.get(timeout=10)[0], 0)